@@ -0,0 +1,399 @@
+#!/usr/bin:env python
+"""
+Measures the throughput of ``scrape_airfares.py`` against the local stand-in
+server in ``mock_expedia.py``.  Nothing leaves the machine.
+
+Three modes are timed:
+
+- ``serial``: one ``scrape_airfares`` call after another.
+- ``threaded``: ``scrape_airfares`` calls spread over a thread pool sharing one
+  session.  Failed requests are counted rather than stopping the run.
+- ``routes``: ``scrape_routes`` end to end.  Failed routes are counted from
+  the routes missing from its result.
+
+For each mode the requests/sec, p50/p99 request latency and error count are
+reported, along with the time ``parse_airfares`` takes per flight leg.
+"""
+from __future__ import print_function
+import argparse
+import contextlib
+import io
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+import mock_expedia
+import scrape_airfares as scr
+
+modes = ["serial", "threaded", "routes"]
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['num_routes']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-m", "--modes", dest="modes", nargs="+",
+                        help="Modes to time, any of {0}. Default: all."
+                        .format(modes), default=modes, choices=modes)
+    parser.add_argument("-n", "--num_routes", dest="num_routes",
+                        help="Number of routes scraped per mode. "
+                        "Default: 64.", default=64, type=int)
+    parser.add_argument("-w", "--max_workers", dest="max_workers",
+                        help="Concurrent requests for the threaded and routes "
+                        "modes. Default: 8.", default=8, type=int)
+    parser.add_argument("-d", "--page_dir", dest="page_dir",
+                        help="Directory of recorded '.htm' results pages. "
+                        "Default: the test fixtures.",
+                        default=mock_expedia.fixture_dir, type=str)
+    parser.add_argument("-l", "--latency", dest="latency",
+                        help="Mean server delay (seconds). Default: 0.05.",
+                        default=0.05, type=float)
+    parser.add_argument("-j", "--jitter", dest="jitter",
+                        help="Server delay jitter (seconds). Default: 0.",
+                        default=0.0, type=float)
+    parser.add_argument("-e", "--error_rate", dest="error_rate",
+                        help="Fraction of server responses that fail. "
+                        "Default: 0.", default=0.0, type=float)
+    parser.add_argument("-s", "--seed", dest="seed",
+                        help="Random seed for the server. Default: 0.",
+                        default=0, type=int)
+    parser.add_argument("-p", "--parse_repeats", dest="parse_repeats",
+                        help="Number of times each page is parsed when timing "
+                        "the parser. Default: 20.", default=20, type=int)
+    parser.add_argument("-o", "--fname_out", dest="fname_out",
+                        help="Save the results to this .json file.", type=str)
+
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    args = vars(args)
+
+    return args
+
+
+def get_routes(num_routes):
+    """
+    Makes a list of distinct routes.
+
+    Parameters
+    ----------
+
+    num_routes: Integer. Required.
+        Number of routes.
+
+    Returns
+    ----------
+
+    routes: List of tuples.
+        The (source_airport, dest_airport) pairs.
+    """
+
+    return [("S{0:03d}".format(idx), "D{0:03d}".format(idx))
+            for idx in range(num_routes)]
+
+
+def get_timed_session(pool_size, latencies):
+    """
+    Creates a scraping session that records the latency of every response.
+
+    Parameters
+    ----------
+
+    pool_size: Integer. Required.
+        See ``scrape_airfares.get_session``.
+
+    latencies: List. Required.
+        Each response's latency (seconds, until the headers were received) is
+        appended to this list.
+
+    Returns
+    ----------
+
+    session: ``requests.Session``.
+        The session.
+    """
+
+    session = scr.get_session(pool_size)
+
+    def record(response, *args, **kwargs):
+        latencies.append(response.elapsed.total_seconds())
+
+    session.hooks["response"].append(record)
+
+    return session
+
+
+def run_mode(mode, routes, date, max_workers):
+    """
+    Scrapes every route in one of the benchmark modes.
+
+    Parameters
+    ----------
+
+    mode: String. Required.
+        One of ``modes``.
+
+    routes: List of tuples. Required.
+        The (source_airport, dest_airport) pairs to scrape.
+
+    date: String. Required.
+        The date of the flights.  Must be in 'DD/MM/YYYY' format.
+
+    max_workers: Integer. Required.
+        Concurrent requests for the threaded and routes modes.
+
+    Returns
+    ----------
+
+    result: Dictionary.
+        The timings, see ``summarise``.
+    """
+
+    latencies = []
+    num_errors = 0
+
+    pool_size = 1 if mode == "serial" else max_workers
+    session = get_timed_session(pool_size, latencies)
+
+    def scrape(route):
+        try:
+            scr.scrape_airfares(route[0], route[1], date, session)
+            return 0
+        except (requests.RequestException, ValueError):
+            # An error response or a page without results.
+            return 1
+
+    # The scraper prints each URL; keep that out of the timings.
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+
+        if mode == "serial":
+            num_errors = sum(scrape(route) for route in routes)
+        elif mode == "threaded":
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                num_errors = sum(executor.map(scrape, routes))
+        else:
+            airfares = scr.scrape_routes(routes, date, max_workers, session)
+            num_errors = len(routes) - len(airfares)
+
+        elapsed = time.perf_counter() - start
+
+    return summarise(mode, len(routes), elapsed, latencies, num_errors)
+
+
+def summarise(mode, num_requests, elapsed, latencies, num_errors):
+    """
+    Collects the throughput and latency of a run.
+
+    Parameters
+    ----------
+
+    mode: String. Required.
+        The mode that was run.
+
+    num_requests: Integer. Required.
+        Number of requests made.
+
+    elapsed: Float. Required.
+        Wall time of the run (seconds).
+
+    latencies: List of floats. Required.
+        Latency of each response (seconds).
+
+    num_errors: Integer. Required.
+        Number of failed requests.
+
+    Returns
+    ----------
+
+    result: Dictionary.
+        Keyed by ``mode``, ``num_requests``, ``num_errors``, ``elapsed``,
+        ``requests_per_sec``, ``latency_p50`` and ``latency_p99``.
+    """
+
+    if latencies:
+        p50, p99 = np.percentile(latencies, [50, 99])
+    else:
+        p50, p99 = np.nan, np.nan
+
+    result = {"mode": mode,
+              "num_requests": num_requests,
+              "num_errors": num_errors,
+              "elapsed": elapsed,
+              "requests_per_sec": num_requests / elapsed,
+              "latency_p50": p50,
+              "latency_p99": p99}
+
+    return result
+
+
+def time_parser(pages, repeats=20):
+    """
+    Times ``parse_airfares`` on recorded pages.
+
+    Parameters
+    ----------
+
+    pages: Dictionary. Required.
+        The recorded pages, see ``mock_expedia.load_pages``.
+
+    repeats: Integer. Optional, default 20.
+        Number of times each page is parsed.
+
+    Returns
+    ----------
+
+    result: Dictionary.
+        Keyed by ``num_pages``, ``num_legs`` (over all pages, once each),
+        ``seconds_per_page`` and ``seconds_per_leg``.
+    """
+
+    num_legs = 0
+    elapsed = 0.0
+
+    for content in pages.values():
+        num_legs += len(scr.parse_airfares(content))
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            scr.parse_airfares(content)
+        elapsed += (time.perf_counter() - start) / repeats
+
+    result = {"num_pages": len(pages),
+              "num_legs": num_legs,
+              "seconds_per_page": elapsed / max(len(pages), 1),
+              "seconds_per_leg": elapsed / max(num_legs, 1)}
+
+    return result
+
+
+def run_benchmark(mode_list=modes, num_routes=64, max_workers=8,
+                  page_dir=mock_expedia.fixture_dir, latency=0.05, jitter=0.0,
+                  error_rate=0.0, seed=0, parse_repeats=20,
+                  date="01/02/2019"):
+    """
+    Starts the stand-in server and times the scraper against it.
+
+    Parameters
+    ----------
+
+    mode_list: List of strings. Optional, default all ``modes``.
+        The modes to time.
+
+    num_routes, max_workers, page_dir, latency, jitter, error_rate, seed,
+    parse_repeats: Optional.
+        See ``parse_inputs``.
+
+    date: String. Optional, default "01/02/2019".
+        Date searched for.
+
+    Returns
+    ----------
+
+    results: Dictionary.
+        Keyed by ``settings``, ``modes`` (a list of ``summarise`` results) and
+        ``parser`` (see ``time_parser``).
+    """
+
+    server = mock_expedia.start_server(page_dir, latency, jitter, error_rate,
+                                       seed=seed)
+
+    base_url = scr.base_url
+    scr.base_url = server.url
+
+    try:
+        routes = get_routes(num_routes)
+        mode_results = [run_mode(mode, routes, date, max_workers)
+                        for mode in mode_list]
+    finally:
+        scr.base_url = base_url
+        server.shutdown()
+        server.server_close()
+
+    results = {"settings": {"num_routes": num_routes,
+                            "max_workers": max_workers,
+                            "latency": latency,
+                            "jitter": jitter,
+                            "error_rate": error_rate,
+                            "seed": seed},
+               "modes": mode_results,
+               "parser": time_parser(server.pages or
+                                     {"default": server.default_page},
+                                     parse_repeats)}
+
+    return results
+
+
+def print_results(results):
+    """
+    Prints a summary table of the benchmark.
+
+    Parameters
+    ----------
+
+    results: Dictionary. Required.
+        See ``run_benchmark``.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    print("{0:>10} {1:>9} {2:>7} {3:>10} {4:>10} {5:>10}"
+          .format("mode", "requests", "errors", "req/s", "p50 (ms)",
+                  "p99 (ms)"))
+    for result in results["modes"]:
+        print("{0:>10} {1:>9d} {2:>7d} {3:>10.1f} {4:>10.2f} {5:>10.2f}"
+              .format(result["mode"], result["num_requests"],
+                      result["num_errors"], result["requests_per_sec"],
+                      result["latency_p50"] * 1e3,
+                      result["latency_p99"] * 1e3))
+
+    parser = results["parser"]
+    print("Parsing {0} legs over {1} pages took {2:.2f} us per leg "
+          "({3:.3f} ms per page)".format(parser["num_legs"],
+                                         parser["num_pages"],
+                                         parser["seconds_per_leg"] * 1e6,
+                                         parser["seconds_per_page"] * 1e3))
+
+
+if __name__ == '__main__':
+
+    args = parse_inputs()
+    enable_from_args(args, "benchmark_scraper")
+
+    with profiler.stage("run_benchmark", num_items=args["num_routes"]):
+        results = run_benchmark(args["modes"], args["num_routes"],
+                                args["max_workers"], args["page_dir"],
+                                args["latency"], args["jitter"],
+                                args["error_rate"], args["seed"],
+                                args["parse_repeats"])
+
+    print_results(results)
+
+    if args["fname_out"]:
+        with open(args["fname_out"], "w") as f:
+            json.dump(results, f, indent=4)
+        print("Saved results to {0}".format(args["fname_out"]))
@@ -4,6 +4,11 @@ import argparse
 import h5py
 import numpy as np
 
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+import locations_data as ld
+
 
 def parse_inputs():
     """
@@ -28,6 +33,12 @@ def parse_inputs():
                         help="Name of the HDF5 file the data will be placed "
                         "in. Default: './data/astro3d_data.hdf5", 
                         default="./data/astro3d_data.hdf5", type=str)
+    parser.add_argument("--hierarchy", dest="hierarchy", action="store_true",
+                        help="Write the older layout with one dataset per "
+                        "group under 'Cities/<city>/<institute>/<group>' "
+                        "instead of a single table.")
+
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
     args = vars(args)
@@ -40,6 +51,7 @@ def parse_inputs():
 if __name__ == '__main__':
 
     args = parse_inputs()
+    enable_from_args(args, "create_data")
 
     cities = ["Melbourne", "Canberra", "Sydney", "Perth"] 
     cities_coord = {"Melbourne":[144.96332,-37.814],
@@ -71,29 +83,56 @@ if __name__ == '__main__':
                "Students":[7, 7, 11, 6, 7, 2]}
 
     inst_count = 0
-    with h5py.File(args["fname"], "w") as f:
+
+    if not args["hierarchy"]:
+        # One row per (city, institute, group), written as a handful of
+        # datasets; see ``locations_data.py``.
+        locations = dict((column, []) for column in
+                         ld.string_columns + ["count"] + ld.float_columns)
+
         for city in institutes.keys():
-            numpeople_city = 0
             for institution in institutes[city]:
-                NumPeople = 0
                 for group in groups:
-                    grp_name = "Cities/{0}/{1}/{2}/" \
-                                .format(city, institution, group)
-
-                    f.create_dataset(grp_name,
-                                     data=np.array(numbers[group][inst_count]),
-                                     dtype=np.int32)
-
-                    print(numbers[group][inst_count])
-                    NumPeople += numbers[group][inst_count]
-                    numpeople_city += numbers[group][inst_count]
-
-                grp_name = "Cities/{0}/{1}".format(city, institution)
-                f[grp_name].attrs.create("Coords", inst_coord[institution])
-                f[grp_name].attrs.create("NumPeople", NumPeople) 
-                print("{0} people at {1}".format(NumPeople, institution))
+                    locations["city"].append(city)
+                    locations["institute"].append(institution)
+                    locations["group"].append(group)
+                    locations["count"].append(numbers[group][inst_count])
+                    locations["lon"].append(inst_coord[institution][0])
+                    locations["lat"].append(inst_coord[institution][1])
+                    locations["city_lon"].append(cities_coord[city][0])
+                    locations["city_lat"].append(cities_coord[city][1])
                 inst_count += 1
-            grp_name = "Cities/{0}".format(city)
-            f[grp_name].attrs.create("Coords", cities_coord[city])
-            f[grp_name].attrs.create("NumPeople", numpeople_city) 
+
+        with profiler.stage("write_locations",
+                            num_items=len(locations["count"])):
+            ld.write_locations(args["fname"], locations)
+
+        _, num_people = ld.get_city_people(ld.load_locations(args["fname"]))
+        print("{0} people in total".format(num_people.sum()))
+    else:
+        with h5py.File(args["fname"], "w") as f:
+            for city in institutes.keys():
+                numpeople_city = 0
+                for institution in institutes[city]:
+                    NumPeople = 0
+                    for group in groups:
+                        grp_name = "Cities/{0}/{1}/{2}" \
+                                    .format(city, institution, group)
+
+                        f.create_dataset(grp_name, data=np.array(
+                                         numbers[group][inst_count]),
+                                         dtype=np.int32)
+
+                        print(numbers[group][inst_count])
+                        NumPeople += numbers[group][inst_count]
+                        numpeople_city += numbers[group][inst_count]
+
+                    grp_name = "Cities/{0}/{1}".format(city, institution)
+                    f[grp_name].attrs.create("Coords", inst_coord[institution])
+                    f[grp_name].attrs.create("NumPeople", NumPeople) 
+                    print("{0} people at {1}".format(NumPeople, institution))
+                    inst_count += 1
+                grp_name = "Cities/{0}".format(city)
+                f[grp_name].attrs.create("Coords", cities_coord[city])
+                f[grp_name].attrs.create("NumPeople", numpeople_city) 
 
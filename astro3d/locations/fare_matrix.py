@@ -0,0 +1,460 @@
+#!/usr/bin:env python
+from __future__ import print_function
+import numpy as np
+import argparse
+from datetime import datetime, timedelta
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+# My airline scraping
+import scrape_airfares as scr
+import locations_data as ld
+
+# USD to AUD.
+exchange_rate = 1.31
+
+# How the nonstop prices of a route can be summarised.
+fare_statistics = {"mean": np.mean, "median": np.median, "min": np.min}
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    If there has not been a start date specified a RuntimeError will be
+    raised.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['fname_in']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-f", "--fname_in", dest="fname_in",
+                        help="Filename for the HDF5 data file containing the "
+                        "cities. Default: './data/astro3d_data.hdf5'",
+                        default="./data/astro3d_data.hdf5", type=str)
+    parser.add_argument("-s", "--date_start", dest="date_start",
+                        help="First date for the meeting. 'DD/MM/YYYY'. "
+                        "Required.", type=str)
+    parser.add_argument("-e", "--date_end", dest="date_end",
+                        help="Last date for the meeting (inclusive). "
+                        "'DD/MM/YYYY'. Default: same as the start date.",
+                        type=str)
+    parser.add_argument("-w", "--max_workers", dest="max_workers",
+                        help="Maximum number of airfares scraped "
+                        "concurrently. Default: 8.", default=8, type=int)
+    parser.add_argument("-c", "--cache_dir", dest="cache_dir",
+                        help="Directory scraped airfares are cached in. "
+                        "Default: './data/airfares'.",
+                        default="./data/airfares", type=str)
+    parser.add_argument("--cache_ttl", dest="cache_ttl",
+                        help="Number of hours cached airfares stay valid. "
+                        "A negative value means they never expire. "
+                        "Default: 24.", default=24.0, type=float)
+    parser.add_argument("--offline", dest="offline", action="store_true",
+                        help="Only use cached airfares; never scrape.")
+
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    args = vars(args)
+
+    if args["date_start"] is None:
+        parser.print_help()
+        raise RuntimeError
+
+    if args["date_end"] is None:
+        args["date_end"] = args["date_start"]
+
+    # Store the expiry time in seconds.
+    if args["cache_ttl"] < 0:
+        args["cache_ttl"] = None
+    else:
+        args["cache_ttl"] *= 3600.0
+
+    return args
+
+
+def get_nonstop_prices(airfares):
+    """
+    Gets the prices (in AUD) of the nonstop flights in a scraped flight list.
+
+    Parameters
+    ----------
+
+    airfares: List. Required.
+        The ``flightlist`` returned by ``scrape_airfares.scrape_airfares``.
+
+    Returns
+    ----------
+
+    prices: List of floats.
+        The price of each nonstop flight.
+    """
+
+    num_flights = len(airfares)
+    prices = []
+
+    for trip_num in range(0, num_flights):
+        if airfares[trip_num]["stops"] != "Nonstop":
+            continue
+
+        prices.append(float(airfares[trip_num]['ticket price'])*exchange_rate)
+
+    return prices
+
+
+def get_dates(date_start, date_end):
+    """
+    Lists every date between two dates (inclusive).
+
+    Parameters
+    ----------
+
+    date_start, date_end: Strings. Required.
+        The first and last dates.  Must be in 'DD/MM/YYYY' format.
+
+    Returns
+    ----------
+
+    dates: List of strings.
+        The dates in 'DD/MM/YYYY' format.
+    """
+
+    dt_start = datetime.strptime(date_start, "%d/%m/%Y")
+    dt_end = datetime.strptime(date_end, "%d/%m/%Y")
+
+    num_days = (dt_end - dt_start).days + 1
+    if num_days < 1:
+        print("The end date {0} is before the start date {1}."
+              .format(date_end, date_start))
+        raise ValueError
+
+    dates = [(dt_start + timedelta(days=day)).strftime("%d/%m/%Y")
+             for day in range(num_days)]
+
+    return dates
+
+
+def get_num_people(locations, cities):
+    """
+    Counts the number of people in each city.
+
+    Parameters
+    ----------
+
+    locations: Dictionary of arrays. Required.
+        The location data, see ``locations_data.load_locations``.
+
+    cities: List of strings. Required.
+        The cities to count.
+
+    Returns
+    ----------
+
+    num_people: Array of floats.
+        The number of people in each city, in the same order as ``cities``.
+        Cities without any people are 0.
+    """
+
+    all_cities, all_people = ld.get_city_people(locations)
+    city_people = dict(zip(all_cities, all_people))
+
+    num_people = np.array([city_people.get(city, 0) for city in cities],
+                          dtype=np.float64)
+
+    return num_people
+
+
+def check_statistic(statistic):
+    """
+    Checks a fare statistic is supported.
+
+    If it isn't, a ValueError will be raised.
+
+    Parameters
+    ----------
+
+    statistic: String. Required.
+        The statistic, see ``fare_statistics``.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    if statistic not in fare_statistics:
+        print("The statistic was {0} but only {1} are supported."
+              .format(statistic, list(fare_statistics.keys())))
+        raise ValueError
+
+
+def build_fare_matrix(cities, dates, statistic="mean", max_workers=8,
+                      cache_dir=None, ttl=None, offline=False):
+    """
+    Collects the nonstop airfares between every pair of cities on every date.
+
+    All (date, source, destination) combinations are scraped concurrently,
+    see ``scrape_airfares.scrape_routes_dates``.
+
+    Parameters
+    ----------
+
+    cities: List of strings. Required.
+        The cities (airport codes) people fly between.
+
+    dates: List of strings. Required.
+        The dates of the flights.  Must be in 'DD/MM/YYYY' format.
+
+    statistic: String. Optional, default "mean".
+        How the nonstop prices of a route are summarised.  One of "mean",
+        "median" or "min".
+
+    max_workers, cache_dir, ttl, offline: Optional.
+        Scraping options, see ``scrape_airfares.scrape_routes``.
+
+    Returns
+    ----------
+
+    fares: 3D array of floats, shape (num_dates, num_cities, num_cities).
+        ``fares[date, source, dest]`` is the summarised price (AUD) of flying
+        from ``source`` to ``dest`` on ``date``.  The diagonal is zero and
+        routes without any nonstop flights, or that failed to scrape, are NaN.
+
+    prices: Dictionary.
+        Keyed by (date, source, dest) with the list of nonstop prices.
+    """
+
+    check_statistic(statistic)
+
+    routes = [(city, city_dest) for city in cities for city_dest in cities
+              if city_dest != city]
+
+    all_airfares = scr.scrape_routes_dates(routes, dates, max_workers,
+                                           cache_dir=cache_dir, ttl=ttl,
+                                           offline=offline)
+
+    # Routes that failed to scrape have no prices, so end up as NaN.
+    prices = {}
+    for date in dates:
+        for (source, dest) in routes:
+            key = (date, source, dest)
+            if key in all_airfares:
+                prices[key] = get_nonstop_prices(all_airfares[key])
+            else:
+                prices[key] = []
+
+    fares = summarise_prices(prices, cities, dates, statistic)
+
+    return fares, prices
+
+
+def summarise_prices(prices, cities, dates, statistic="mean"):
+    """
+    Summarises the nonstop prices of every route into a fare matrix.
+
+    Parameters
+    ----------
+
+    prices: Dictionary. Required.
+        Keyed by (date, source, dest) with the list of nonstop prices, see
+        ``build_fare_matrix``.
+
+    cities, dates: Lists of strings. Required.
+        The cities and dates of the matrix.
+
+    statistic: String. Optional, default "mean".
+        See ``build_fare_matrix``.
+
+    Returns
+    ----------
+
+    fares: 3D array of floats, shape (num_dates, num_cities, num_cities).
+        See ``build_fare_matrix``.
+    """
+
+    check_statistic(statistic)
+
+    city_idx = dict((city, idx) for (idx, city) in enumerate(cities))
+    date_idx = dict((date, idx) for (idx, date) in enumerate(dates))
+
+    fares = np.zeros((len(dates), len(cities), len(cities)))
+
+    for (date, city, city_dest), route_prices in prices.items():
+        if route_prices:
+            fare = fare_statistics[statistic](route_prices)
+        else:
+            fare = np.nan
+
+        fares[date_idx[date], city_idx[city], city_idx[city_dest]] = fare
+
+    return fares
+
+
+def load_cached_fare_matrix(cities, date, cache_dir=".", ttl=None,
+                            statistic="mean"):
+    """
+    Builds the fare matrix for one date from previously cached airfares only.
+
+    Unlike ``build_fare_matrix`` nothing is scraped; routes without a valid
+    cached file are simply left as NaN.
+
+    Parameters
+    ----------
+
+    cities: List of strings. Required.
+        The cities (airport codes) people fly between.
+
+    date: String. Required.
+        The date of the flights.  Must be in 'DD/MM/YYYY' format.
+
+    cache_dir, ttl: Optional.
+        See ``scrape_airfares.load_cached_airfares``.
+
+    statistic: String. Optional, default "mean".
+        See ``build_fare_matrix``.
+
+    Returns
+    ----------
+
+    fares: 2D array of floats, shape (num_cities, num_cities).
+        ``fares[source, dest]`` is the summarised price (AUD).  The diagonal
+        is zero and routes that aren't cached or have no nonstop flights are
+        NaN.
+    """
+
+    check_statistic(statistic)
+
+    fares = np.full((len(cities), len(cities)), np.nan)
+
+    for source_idx, city in enumerate(cities):
+        fares[source_idx, source_idx] = 0.0
+
+        for dest_idx, city_dest in enumerate(cities):
+            if city_dest == city:
+                continue
+
+            airfares = scr.load_cached_airfares(city, city_dest, date,
+                                                cache_dir, ttl)
+            if airfares is None:
+                continue
+
+            route_prices = get_nonstop_prices(airfares)
+            if route_prices:
+                fares[source_idx, dest_idx] = \
+                    fare_statistics[statistic](route_prices)
+
+    return fares
+
+
+def get_meeting_costs(fares, num_people):
+    """
+    Computes the total airfare cost of holding the meeting in each city on
+    each date.
+
+    Everyone from every other city flies to the host city; people in the
+    host city don't fly.
+
+    Parameters
+    ----------
+
+    fares: 3D array of floats, shape (num_dates, num_cities, num_cities).
+        See ``build_fare_matrix``.
+
+    num_people: Array of floats, shape (num_cities,).
+        Number of people in each city.
+
+    Returns
+    ----------
+
+    costs: 2D array of floats, shape (num_dates, num_cities).
+        ``costs[date, host]`` is the total cost (AUD).  NaN if any route to
+        the host had no nonstop flights.
+    """
+
+    fares = np.array(fares, dtype=np.float64)
+
+    idx = np.arange(fares.shape[1])
+    fares[:, idx, idx] = 0.0
+
+    costs = np.einsum("s,dsh->dh", num_people, fares)
+
+    return costs
+
+
+def find_cheapest_meeting(costs, dates, cities):
+    """
+    Finds the cheapest date and host city for the meeting.
+
+    If no date/city has a known cost a ValueError will be raised.
+
+    Parameters
+    ----------
+
+    costs: 2D array of floats, shape (num_dates, num_cities).
+        See ``get_meeting_costs``.
+
+    dates, cities: Lists of strings.
+        The dates and cities of ``costs``.
+
+    Returns
+    ----------
+
+    date, city: Strings.
+        The cheapest date and host city.
+
+    cost: Float.
+        The total cost (AUD).
+    """
+
+    if np.all(np.isnan(costs)):
+        print("None of the dates/cities have a known meeting cost.")
+        raise ValueError
+
+    date_idx, city_idx = np.unravel_index(np.nanargmin(costs), costs.shape)
+
+    return dates[date_idx], cities[city_idx], costs[date_idx, city_idx]
+
+
+if __name__ == '__main__':
+
+    args = parse_inputs()
+    enable_from_args(args, "fare_matrix")
+
+    dates = get_dates(args["date_start"], args["date_end"])
+
+    locations = ld.load_locations(args["fname_in"])
+    cities = list(ld.get_unique(locations["city"])[0])
+    num_people = get_num_people(locations, cities)
+
+    fares, prices = build_fare_matrix(cities, dates,
+                                      max_workers=args["max_workers"],
+                                      cache_dir=args["cache_dir"],
+                                      ttl=args["cache_ttl"],
+                                      offline=args["offline"])
+
+    with profiler.stage("meeting_costs", num_items=fares.size):
+        costs = get_meeting_costs(fares, num_people)
+
+    print("The cost (AUD) to hold a meeting in each city on each date is:")
+    print("{0:>12} ".format("") + " ".join("{0:>12}".format(city)
+                                           for city in cities))
+    for date, date_costs in zip(dates, costs):
+        print("{0:>12} ".format(date) + " ".join("{0:12.2f}".format(cost)
+                                                 for cost in date_costs))
+
+    date, city, cost = find_cheapest_meeting(costs, dates, cities)
+    print("The cheapest meeting is in {0} on {1} and costs {2:.2f}"
+          .format(city, date, cost))
@@ -0,0 +1,218 @@
+#!/usr/bin:env python
+"""
+Reads and writes the astro3d location data file.
+
+The data is held as one row per (city, institute, group) with the columns
+``city``, ``institute``, ``group``, ``count``, ``lon``, ``lat`` (institute
+coordinates) and ``city_lon``, ``city_lat`` (city coordinates).
+
+Files written by ``create_data.py`` store these columns as a handful of
+datasets inside the ``Table`` group.  Older files store one scalar dataset per
+group under ``Cities/<city>/<institute>/<group>``; these are still read, in a
+single walk of the hierarchy.
+"""
+from __future__ import print_function
+import numpy as np
+import h5py
+
+string_columns = ["city", "institute", "group"]
+float_columns = ["lon", "lat", "city_lon", "city_lat"]
+
+
+def write_locations(fname, locations):
+    """
+    Writes the location columns to a HDF5 file using the table layout.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Name of the HDF5 file.
+
+    locations: Dictionary of arrays. Required.
+        The columns, see the module docstring.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    with h5py.File(fname, "w") as f:
+        table = f.create_group("Table")
+
+        for column in string_columns:
+            table.create_dataset(column, data=np.char.encode(
+                                 np.asarray(locations[column], dtype=str),
+                                 "utf-8"))
+
+        table.create_dataset("count", data=np.asarray(locations["count"]),
+                             dtype=np.int32)
+
+        for column in float_columns:
+            table.create_dataset(column, data=np.asarray(locations[column]),
+                                 dtype=np.float64)
+
+
+def load_locations(fname):
+    """
+    Reads the whole location data file into columns.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Name of the HDF5 file, in either the table or hierarchical layout.
+
+    Returns
+    ----------
+
+    locations: Dictionary of arrays.
+        The columns, see the module docstring.  Strings are returned as
+        unicode arrays.
+    """
+
+    with h5py.File(fname, "r") as f:
+        if "Table" in f:
+            table = f["Table"]
+            locations = {}
+            for column in string_columns:
+                locations[column] = np.char.decode(table[column][:], "utf-8")
+            locations["count"] = table["count"][:]
+            for column in float_columns:
+                locations[column] = table[column][:]
+
+            return locations
+
+        # Older hierarchical layout.  Walk it once, reading each attribute and
+        # scalar dataset a single time.
+        rows = dict((column, []) for column in
+                    string_columns + ["count"] + float_columns)
+
+        for city, city_group in f["Cities"].items():
+            city_lon, city_lat = city_group.attrs["Coords"][:2]
+            for institute, inst_group in city_group.items():
+                lon, lat = inst_group.attrs["Coords"][:2]
+                for group, dataset in inst_group.items():
+                    rows["city"].append(city)
+                    rows["institute"].append(institute)
+                    rows["group"].append(group)
+                    rows["count"].append(dataset[()])
+                    rows["lon"].append(lon)
+                    rows["lat"].append(lat)
+                    rows["city_lon"].append(city_lon)
+                    rows["city_lat"].append(city_lat)
+
+    locations = {}
+    for column in string_columns:
+        locations[column] = np.array(rows[column], dtype=str)
+    locations["count"] = np.array(rows["count"], dtype=np.int32)
+    for column in float_columns:
+        locations[column] = np.array(rows[column], dtype=np.float64)
+
+    return locations
+
+
+def get_unique(values):
+    """
+    Finds the unique values of a column in order of first appearance.
+
+    Parameters
+    ----------
+
+    values: Array. Required.
+        The column.
+
+    Returns
+    ----------
+
+    unique: Array.
+        The unique values.
+
+    codes: Array of integers.
+        For each row, the index of its value in ``unique``.
+    """
+
+    unique, first, codes = np.unique(values, return_index=True,
+                                     return_inverse=True)
+
+    # ``np.unique`` sorts, so reorder by first appearance.
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    return unique[order], rank[codes.ravel()]
+
+
+def get_city_people(locations):
+    """
+    Counts the number of people in each city.
+
+    Parameters
+    ----------
+
+    locations: Dictionary of arrays. Required.
+        The columns, see ``load_locations``.
+
+    Returns
+    ----------
+
+    cities: Array of strings.
+        The cities, in order of first appearance.
+
+    num_people: Array of integers.
+        The number of people in each city.
+    """
+
+    cities, city_codes = get_unique(locations["city"])
+    num_people = np.bincount(city_codes, weights=locations["count"],
+                             minlength=len(cities)).astype(np.int64)
+
+    return cities, num_people
+
+
+def get_institute_table(locations):
+    """
+    Pivots the location rows into one row per institute.
+
+    Parameters
+    ----------
+
+    locations: Dictionary of arrays. Required.
+        The columns, see ``load_locations``.
+
+    Returns
+    ----------
+
+    institutes: Dictionary of arrays.
+        Keyed by ``institute``, ``city``, ``lon``, ``lat``, ``city_lon``,
+        ``city_lat`` (one entry per institute), ``group_names`` (one entry per
+        group), ``counts`` (shape (num_institutes, num_groups)) and
+        ``num_people`` (total per institute).
+    """
+
+    institute_names, inst_codes = get_unique(locations["institute"])
+    group_names, group_codes = get_unique(locations["group"])
+
+    num_inst = len(institute_names)
+    num_groups = len(group_names)
+
+    counts = np.bincount(inst_codes * num_groups + group_codes,
+                         weights=locations["count"],
+                         minlength=num_inst * num_groups)
+    counts = counts.reshape(num_inst, num_groups).astype(np.int64)
+
+    # Index of the first row of each institute, to pull out its per-institute
+    # columns.
+    first_row = np.zeros(num_inst, dtype=np.int64)
+    first_row[inst_codes[::-1]] = np.arange(len(inst_codes))[::-1]
+
+    institutes = {"institute": institute_names,
+                  "group_names": group_names,
+                  "counts": counts,
+                  "num_people": counts.sum(axis=1)}
+
+    for column in ["city"] + float_columns:
+        institutes[column] = locations[column][first_row]
+
+    return institutes
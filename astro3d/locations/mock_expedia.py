@@ -0,0 +1,312 @@
+#!/usr/bin:env python
+"""
+A local stand-in for the Expedia flight search, for testing and benchmarking
+``scrape_airfares.py`` without network access.
+
+Recorded results pages are served for any search.  A page saved as
+'<SOURCE>_<DEST>_<D>_<M>_<YYYY>.htm' (the same naming as the cached .json
+files) is served for that route and date; every other search gets the default
+page.  Each response can be delayed, and a fraction of them fail with a 503.
+
+Point the scraper at the stand-in by setting ``scrape_airfares.base_url`` to
+the URL returned by ``start_server``.
+"""
+from __future__ import print_function
+import argparse
+import glob
+import os
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+fixture_dir = "{0}/tests/fixtures".format(
+    os.path.dirname(os.path.realpath(__file__)))
+default_page = "{0}/MEL_SYD_1_2_2019.htm".format(fixture_dir)
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['port']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-p", "--port", dest="port",
+                        help="Port to listen on. Default: 8000.",
+                        default=8000, type=int)
+    parser.add_argument("-d", "--page_dir", dest="page_dir",
+                        help="Directory of recorded '.htm' results pages. "
+                        "Default: the test fixtures.",
+                        default=fixture_dir, type=str)
+    parser.add_argument("-l", "--latency", dest="latency",
+                        help="Mean delay (seconds) before each response. "
+                        "Default: 0.", default=0.0, type=float)
+    parser.add_argument("-j", "--jitter", dest="jitter",
+                        help="Each delay is drawn uniformly within this many "
+                        "seconds of the mean. Default: 0.",
+                        default=0.0, type=float)
+    parser.add_argument("-e", "--error_rate", dest="error_rate",
+                        help="Fraction of responses that fail with a 503. "
+                        "Default: 0.", default=0.0, type=float)
+    parser.add_argument("-s", "--seed", dest="seed",
+                        help="Random seed for the delays and errors.",
+                        type=int)
+
+    args = parser.parse_args()
+    args = vars(args)
+
+    return args
+
+
+def load_pages(page_dir=fixture_dir):
+    """
+    Reads the recorded results pages.
+
+    Parameters
+    ----------
+
+    page_dir: String. Optional, default the test fixtures.
+        Directory containing the '.htm' pages.
+
+    Returns
+    ----------
+
+    pages: Dictionary.
+        Keyed by the page name (e.g., 'MEL_SYD_1_2_2019') with the page
+        contents (bytes) as the value.
+    """
+
+    pages = {}
+    for fname in sorted(glob.glob("{0}/*.htm".format(page_dir))):
+        with open(fname, "rb") as f:
+            pages[os.path.basename(fname)[:-len(".htm")]] = f.read()
+
+    return pages
+
+
+def get_page_name(path):
+    """
+    Works out which recorded page matches a search URL.
+
+    Parameters
+    ----------
+
+    path: String. Required.
+        The requested path, see ``scrape_airfares.get_url``.
+
+    Returns
+    ----------
+
+    name: String or None.
+        The page name, 'SOURCE_DEST_D_M_YYYY', or None if the path isn't a
+        flight search.
+    """
+
+    url = urlparse(path)
+    if url.path != "/Flights-Search":
+        return None
+
+    leg = parse_qs(url.query).get("leg1")
+    if not leg:
+        return None
+
+    # The leg looks like 'from:MEL,to:SYD,departure:2/1/2019TANYT' with an
+    # American date.
+    fields = dict(field.split(":", 1) for field in leg[0].split(",")
+                  if ":" in field)
+
+    try:
+        month, day, year = fields["departure"].split("T")[0].split("/")
+        return "{0}_{1}_{2}_{3}_{4}".format(fields["from"], fields["to"],
+                                            day, month, year)
+    except (KeyError, ValueError):
+        return None
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, pages, default_page, latency=0.0, jitter=0.0,
+                 error_rate=0.0, seed=None):
+        """
+        A threaded HTTP server holding the recorded pages and response
+        settings.
+
+        Parameters
+        ----------
+
+        address: Tuple. Required.
+            The (host, port) to listen on.  Port 0 picks a free port.
+
+        pages: Dictionary. Required.
+            The recorded pages, see ``load_pages``.
+
+        default_page: Bytes. Required.
+            Page served for searches without a recorded page.
+
+        latency, jitter, error_rate, seed: Optional.
+            See ``parse_inputs``.
+        """
+
+        HTTPServer.__init__(self, address, MockHandler)
+
+        self.pages = pages
+        self.default_page = default_page
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+
+        self.num_requests = 0
+        self.num_errors = 0
+
+    @property
+    def url(self):
+        return "http://{0}:{1}".format(*self.server_address[:2])
+
+    def draw_response(self):
+        """
+        Draws the delay of a response and whether it fails.
+
+        Parameters
+        ----------
+
+        None.
+
+        Returns
+        ----------
+
+        delay: Float.
+            Seconds to wait before responding.
+
+        fail: Boolean.
+            Whether the response is a 503.
+        """
+
+        with self.rng_lock:
+            delay = self.latency + self.jitter * (2.0 * self.rng.random() - 1.0)
+            fail = self.rng.random() < self.error_rate
+
+            self.num_requests += 1
+            self.num_errors += fail
+
+        return max(delay, 0.0), fail
+
+
+class MockHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    # The headers and body are written separately; without this each
+    # keep-alive response waits on a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+
+        name = get_page_name(self.path)
+        if name is None:
+            self.send_body(404, b"Not Found")
+            return
+
+        delay, fail = self.server.draw_response()
+        time.sleep(delay)
+
+        if fail:
+            self.send_body(503, b"Service Unavailable")
+            return
+
+        self.send_body(200, self.server.pages.get(name,
+                                                  self.server.default_page))
+
+    def send_body(self, status, body):
+
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't print a line for every request.
+        pass
+
+
+def start_server(page_dir=fixture_dir, latency=0.0, jitter=0.0,
+                 error_rate=0.0, port=0, seed=None):
+    """
+    Starts the stand-in server in a background thread.
+
+    Parameters
+    ----------
+
+    page_dir: String. Optional, default the test fixtures.
+        Directory of recorded '.htm' pages.  The MEL to SYD fixture is served
+        for searches without a recorded page unless a page called
+        'default.htm' is present.
+
+    latency, jitter, error_rate, seed: Optional.
+        See ``parse_inputs``.
+
+    port: Integer. Optional, default 0.
+        Port to listen on.  0 picks a free port.
+
+    Returns
+    ----------
+
+    server: ``MockServer``.
+        The running server.  Its ``url`` is the ``scrape_airfares.base_url``
+        to use.  Stop it with ``server.shutdown()``.
+    """
+
+    pages = load_pages(page_dir)
+
+    if "default" in pages:
+        default = pages["default"]
+    else:
+        with open(default_page, "rb") as f:
+            default = f.read()
+
+    server = MockServer(("127.0.0.1", port), pages, default, latency, jitter,
+                        error_rate, seed)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+
+if __name__ == '__main__':
+
+    args = parse_inputs()
+
+    server = start_server(args["page_dir"], args["latency"], args["jitter"],
+                          args["error_rate"], args["port"], args["seed"])
+
+    print("Serving {0} recorded pages at {1}".format(len(server.pages),
+                                                     server.url))
+
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,10 +1,14 @@
 #!/usr/bin:env python
 from __future__ import print_function
 import numpy as np
+import os
+import json
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap
 import argparse
-import h5py
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
 
 # Import Bokeh plotting.
 from bokeh.io import output_file, show
@@ -12,6 +16,7 @@ from bokeh.models import ColumnDataSource, GMapOptions
 from bokeh.plotting import gmap
 from bokeh.plotting import figure, output_file, show, ColumnDataSource
 from bokeh.models import HoverTool, TapTool
+from bokeh.models import AjaxDataSource, CDSView, GroupFilter
 from bokeh.layouts import row, column, gridplot
 
 import locale 
@@ -19,9 +24,8 @@ locale.setlocale(locale.LC_ALL, '')
 
 # My airline scraping
 import scrape_airfares as scr
-
-# USD to AUD.
-exchange_rate = 1.31
+import fare_matrix as fm
+import locations_data as ld
 
 def parse_input():
     """
@@ -63,9 +67,45 @@ def parse_input():
                           "Default: './data/astro3d_data.hdf5'",
                           default="./data/astro3d_data.hdf5", type=str)
 
+    optional.add_argument("-o", "--fname_out", dest="fname_out",
+                          help="Filename for the output HTML page. "
+                          "Default: 'test.html'",
+                          default="test.html", type=str)
+
+    optional.add_argument("-l", "--lazy", dest="lazy", action="store_true",
+                          help="Save the plotted data to .json files next to "
+                          "the page, which fetches them once it has loaded. "
+                          "Keeps the page small but it must then be served "
+                          "over HTTP.")
+
+    optional.add_argument("-w", "--max_workers", dest="max_workers",
+                          help="Maximum number of airfares scraped "
+                          "concurrently. Default: 8.", default=8, type=int)
+
+    optional.add_argument("-c", "--cache_dir", dest="cache_dir",
+                          help="Directory scraped airfares are cached in. "
+                          "Default: './data/airfares'.",
+                          default="./data/airfares", type=str)
+
+    optional.add_argument("-e", "--cache_ttl", dest="cache_ttl",
+                          help="Number of hours cached airfares stay valid. "
+                          "A negative value means they never expire. "
+                          "Default: 24.", default=24.0, type=float)
+
+    optional.add_argument("--offline", dest="offline", action="store_true",
+                          help="Only use cached airfares; never scrape.")
+
+    add_profile_arguments(parser)
+
     args = parser.parse_args()
     args = vars(args)
 
+    # Store the expiry time in seconds.
+    if args["cache_ttl"] < 0:
+        args["cache_ttl"] = None
+    else:
+        args["cache_ttl"] *= 3600.0
+
     return args
 
 
@@ -149,181 +189,216 @@ def get_google_key(key_dir="."):
     return key
 
 
-def determine_fares(city, city_dest, date):
+def determine_fares(city, city_dest, date, cache_dir=None, ttl=None,
+                    offline=False):
 
-    airfares = scr.scrape_airfares(city, city_dest, date)
-    
-    num_flights = len(airfares)
-    prices = []
+    airfares = scr.get_airfares(city, city_dest, date, cache_dir=cache_dir,
+                                ttl=ttl, offline=offline)
 
-    for trip_num in range(0, num_flights):
-        if airfares[trip_num]["stops"] != "Nonstop":
-            continue
+    return fm.get_nonstop_prices(airfares)
+
+
+def deal_with_airfares(args, locations, cities):
+    """
+    Gets the median nonstop airfare between every pair of cities on the date
+    passed at runtime and prints the cost of holding the meeting in each city.
 
-        prices.append(float(airfares[trip_num]['ticket price'])*exchange_rate)
+    Parameters
+    ----------
 
-    return prices
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package. See function
+        `parse_inputs()`.
 
+    locations: Dictionary of arrays.  Required.
+        The location data, see ``locations_data.load_locations``.
 
-def deal_with_airfares(args, data_file, cities):
+    cities: List of strings.  Required.
+        The cities (airport codes) people fly between.
 
-    mean_cost = {}
-    airfare_cost = {}
+    Returns
+    ----------
 
-    for city in cities:
-        mean_cost[city] = 0.0
+    median_fares: 2D array of floats, shape (num_cities, num_cities).
+        ``median_fares[source, dest]`` is the median nonstop price (AUD).  The
+        diagonal is zero and routes without nonstop flights are NaN.
+    """
 
-    for city in cities:
-        airfare_cost[city] = {}
+    cities = list(cities)
+    date = args["date"]
 
-        # We need to get the airfares from every combination of cities.
-        for count, city_dest in enumerate(cities):
-            if city_dest == city:  # Don't travel to itself!
-                continue
+    # We need to get the airfares from every combination of cities (but don't
+    # travel to itself!).  All of these are scraped concurrently, skipping any
+    # that are already cached.
+    fares, prices = fm.build_fare_matrix(cities, [date],
+                                         max_workers=args["max_workers"],
+                                         cache_dir=args["cache_dir"],
+                                         ttl=args["cache_ttl"],
+                                         offline=args["offline"])
 
-            prices = determine_fares(city, city_dest, args["date"])
-            mean_cost[city_dest] += np.mean(prices)* \
-                                   data_file["Cities"][city].attrs["NumPeople"]
-            airfare_cost[city][city_dest] = prices 
+    for (_, city, city_dest), route_prices in prices.items():
+        print("{0} to {1} costs {2}".format(city, city_dest, route_prices))
 
-            print("{0} to {1} costs {2}".format(city, city_dest, prices))
+    num_people = fm.get_num_people(locations, cities)
+    mean_cost = fm.get_meeting_costs(fares, num_people)[0]
 
+    # The prices are already in AUD.
     print("The cost to hold a meeting in each city is:")
-    for city in mean_cost.keys():
-        print("{0}: {1}".format(city, 
-                                locale.currency(mean_cost[city]*exchange_rate,
-                                                grouping=True)))
+    for city, cost in zip(cities, mean_cost):
+        print("{0}: {1}".format(city, locale.currency(cost, grouping=True)))
 
-    return airfare_cost
+    median_fares = fm.summarise_prices(prices, cities, [date], "median")[0]
 
+    return median_fares
 
-def plot_cities(GMap, airfare_plots, args):
+
+def get_institute_data(locations):
     """
-    Plots the location of the cities the institutes belong to. 
+    Builds the columns Bokeh plots the institutes from.
 
     Parameters
     ----------
 
-    GMap: Bokeh GMap (Google Map) Axis. 
-        Map that we're plotting the data on top of.
+    locations: Dictionary of arrays.  Required.
+        The location data, see ``locations_data.load_locations``.
+
+    Returns
+    ----------
+
+    data: Dictionary of arrays.
+        One entry per institute, keyed by ``x``, ``y`` (coordinates of the
+        institute's city), ``institutes``, ``people`` and the name of each
+        group (number of people in that group).
+
+    group_names: List of strings.
+        The groups.
+    """
+
+    institutes = ld.get_institute_table(locations)
+    group_names = [str(group) for group in institutes["group_names"]]
+
+    # Institutes are plotted at their city.
+    data = dict(x=institutes["city_lon"],
+                y=institutes["city_lat"],
+                institutes=institutes["institute"],
+                people=institutes["num_people"],)
+
+    for count, group in enumerate(group_names):
+        data[group] = institutes["counts"][:, count]
+
+    return data, group_names
+
+
+def get_fare_data(fares, cities):
+    """
+    Flattens a fare matrix into the columns Bokeh plots the airfares from.
+
+    Parameters
+    ----------
+
+    fares: 2D array of floats, shape (num_cities, num_cities).  Required.
+        ``fares[source, dest]`` is the price (AUD), see
+        ``deal_with_airfares``.
+
+    cities: List of strings.  Required.
+        The cities of ``fares``.
+
+    Returns
+    ----------
+
+    data: Dictionary of arrays.
+        One entry per (source, dest) pair, keyed by ``source``, ``dest`` and
+        ``fare``.
+    """
+
+    cities = np.asarray(cities)
+    num_cities = len(cities)
+
+    data = dict(source=np.repeat(cities, num_cities),
+                dest=np.tile(cities, num_cities),
+                fare=np.asarray(fares, dtype=np.float64).ravel())
+
+    return data
+
+
+def make_source(data, args, name):
+    """
+    Creates the Bokeh data source for a set of columns.
+
+    If ``args["lazy"]`` is set the columns are saved to '<name>.json' next to
+    the page and fetched by the browser once the page has loaded, rather than
+    being embedded in the HTML.  The page then needs to be served over HTTP
+    (e.g., ``python -m http.server``).
+
+    Parameters
+    ----------
+
+    data: Dictionary of arrays.  Required.
+        The columns.
 
     args: Dictionary.  Required.
         Dictionary of arguments from the ``argparse`` package. See function
         `parse_inputs()`.
-        Dictionary is keyed by the argument name (e.g., args['fname_in']).
-        Used to determine the data file containing the data we're using. 
+
+    name: String.  Required.
+        Name of the data set.
 
     Returns
     ----------
 
-    None.  The data is plotted onto the Google Map axis. 
+    source: Bokeh ``ColumnDataSource`` or ``AjaxDataSource``.
+        The data source.
     """
 
-    # First open the file that has all the data we're plotting.
-    data_file = h5py.File(args["fname_in"], "r")
+    if not args["lazy"]:
+        return ColumnDataSource(data=data)
 
-    inst_name = []
-    lon = [] 
-    lat = []
-    NumPeople = []  # Total number of people per institute.
-    NumPeople_group = []  # Number of people per group within each institute
-                          # (will be an array of dicts). 
+    # JSON has no NaN, so missing values become null.
+    columns = {}
+    for key, values in data.items():
+        values = np.asarray(values)
+        if values.dtype.kind == "f":
+            values = np.where(np.isnan(values), None, values)
+        columns[key] = values.tolist()
 
-    # We need to count manually (i.e. without `enumerate`) because some cities
-    # have multiple institutes.
-    count = 0
+    fname = "{0}_{1}.json".format(args["fname_out"].rsplit(".", 1)[0], name)
+    with open(fname, "w") as f:
+        json.dump(columns, f)
 
-    # The group structure for `data_file` is first keyed by each city that
-    # contains an institute.  Each institute then has an entry, with each group
-    # then having an entry inside it.
-    # E.g., data_file["Cities"]["Melbourne"]["Swinburne University of
-    # Technology"]["CIs"].value would give the number of CIs at Swinburne.
+    # Start with empty columns so the glyphs and tooltips know their names.
+    source = AjaxDataSource(data_url=os.path.basename(fname),
+                            polling_interval=None, mode="replace",
+                            method="GET",
+                            data=dict((key, []) for key in columns))
 
-    cities = data_file["Cities"].keys()
+    return source
 
-    for city in cities:
-        for institute in data_file["Cities"][city].keys():
-
-            inst_name.append(institute)
-            lon.append(data_file["Cities"][city].attrs["Coords"][0])
-            lat.append(data_file["Cities"][city].attrs["Coords"][1])
-            NumPeople.append(data_file["Cities"][city][institute].attrs["NumPeople"])
 
-            groups = data_file["Cities"][city][institute].keys()
+def plot_cities(GMap, locations, args):
+    """
+    Plots the location of the cities the institutes belong to. 
 
-            NumPeople_group.append({})
+    Parameters
+    ----------
 
-            for group in groups:
-                NumPeople_group[count][group] = \
-                data_file["Cities"][city][institute][group].value 
+    GMap: Bokeh GMap (Google Map) Axis. 
+        Map that we're plotting the data on top of.
 
-            count += 1 
+    locations: Dictionary of arrays.  Required.
+        The location data, see ``locations_data.load_locations``.
 
-    # If a date is passed at Runtime we want to determine the airfares at
-    # the date.
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package. See function
+        `parse_inputs()`.
 
-    if len(cities) > 1 and args["date"]:
-        airfare_cost = deal_with_airfares(args, data_file, cities)
+    Returns
+    ----------
 
-        airfares = [[] for x in range(len(cities))]
-        for count, city in enumerate(cities):
-            for dest_city in cities:
-                if dest_city == city:
-                    airfares[count].append([])
-                else:      
-                    airfares[count].append(airfare_cost[city][dest_city])
-            
-    
+    None.  The data is plotted onto the Google Map axis. 
+    """
 
-    # Now that we've got the number of people within each institute, we need to
-    # construct an array that holds the number of people within each group.
-    # This needs to be an array because Bokeh only likes them.  The structure
-    # of this will be:
-
-    # total_NumPeople_group = [[AIs at SUT, AIs at UMelb, AIs at ANU,...,],
-    #                          [CIs at SUT, CIs at UMelb, CIs at ANU,...,],
-    #                          [etc...]]
-    group_names = [x for x in NumPeople_group[0].keys()]
-    total_NumPeople_group = [[] for x in range(len(group_names))]
-
-    for count in range(len(inst_name)):
-        for group_num, group in enumerate(NumPeople_group[count]): 
-            total_NumPeople_group[group_num].append(NumPeople_group[count][group])
-
-    # We need to feed a dictionary into Bokeh so it knows what to list when we
-    # hover over each point.
-    data = dict(x=lon,
-                y=lat,
-                institutes=inst_name,
-                people=NumPeople,)
-
-    # Now lets add each of the groups to this dictionary...
-    for count, group in enumerate(group_names): 
-        data[group] = total_NumPeople_group[count]
-
-    if args["date"]:
-        for city_count, city in enumerate(cities):
-            airfares_to_show = []
-            for dest_count, dest_city in enumerate(cities):
-                if dest_city == city:
-                    airfares_to_show.append(0.0)
-                    continue
-                airfares_this_city = airfares[city_count][dest_count]
-                airfares_to_show.append(np.median(airfares_this_city))
-
-                #plot3 = airfare_plots[dest_city].circle(range(len(airfares_this_city)),
-                #                                        airfares_this_city, 
-                #                                        color=colors[city_count]) 
-            airfare_plots[city].vbar(x=list(cities), 
-                                     top=airfares_to_show,
-                                     width=0.5) 
-
-            airfare_plots[city].yaxis.axis_label = "Median Price"
-
-            #data[city] = airfares_to_show 
-
-    # Then turn it into a Bokeh friendly format.
-    source = ColumnDataSource(data=data)
+    data, group_names = get_institute_data(locations)
+    source = make_source(data, args, "institutes")
 
     # Plot a Cross at each of the capital cities.
     # Note: For places such as Melbourne that have multiple institutes, we
@@ -339,7 +414,7 @@ def plot_cities(GMap, airfare_plots, args):
     # these tooltips.
     for group in group_names:
         tooltip_name = group
-        tooltip_value = "@{0}".format(group)
+        tooltip_value = "@{{{0}}}".format(group)
 
         tooltips.append((tooltip_name, tooltip_value))
 
@@ -347,107 +422,97 @@ def plot_cities(GMap, airfare_plots, args):
     # these crosses as we will have other objects on the same map but we don't
     # want the tooltips to show for them.
     GMap.add_tools(HoverTool(renderers=[plot1], tooltips=tooltips))
- 
-    data_file.close()
 
 
-def plot_group_means(GMap, args):
+def plot_airfares(airfare_plots, fares, cities, args):
     """
-    Plots the mean location of the groups. 
+    Plots the median airfare from each city to every other city.
+
+    Every figure draws from one shared data source; each only shows the rows
+    for its own city.
 
     Parameters
     ----------
 
-    GMap: Bokeh GMap (Google Map) Axis. 
-        Map that we're plotting the data on top of.
+    airfare_plots: Dictionary of Bokeh figures.  Required.
+        The airfare figure of each city.
+
+    fares: 2D array of floats, shape (num_cities, num_cities).  Required.
+        See ``deal_with_airfares``.
+
+    cities: List of strings.  Required.
+        The cities of ``fares``.
 
     args: Dictionary.  Required.
         Dictionary of arguments from the ``argparse`` package. See function
         `parse_inputs()`.
-        Dictionary is keyed by the argument name (e.g., args['fname_in']).
-        Used to determine the data file containing the data we're using. 
 
     Returns
     ----------
 
-    None.  The data is plotted onto the Google Map axis. 
+    None.  The bars are plotted onto each figure.
     """
 
-    data_file = h5py.File(args["fname_in"],"r")
+    source = make_source(get_fare_data(fares, cities), args, "airfares")
 
-    group_weighted_lon = {} 
-    group_weighted_lat = {}
-    group_names = []
+    for city in cities:
+        view = CDSView(source=source,
+                       filters=[GroupFilter(column_name="source", group=city)])
 
-    total_weighted_lon = 0.0
-    total_weighted_lat = 0.0
+        airfare_plots[city].vbar(x="dest", top="fare", width=0.5,
+                                 source=source, view=view)
 
-    NumPeople = {} 
+        airfare_plots[city].yaxis.axis_label = "Median Price"
 
-    for city_count, city in enumerate(data_file["Cities"].keys()): 
-        for institute in data_file["Cities"][city].keys():
-            lon = data_file["Cities"][city][institute].attrs["Coords"][0]
-            lat = data_file["Cities"][city][institute].attrs["Coords"][1]
 
-            total_weighted_lon += lon * \
-                                  data_file["Cities"][city][institute].attrs['NumPeople']
-           
-            total_weighted_lat += lat * \
-                                  data_file["Cities"][city][institute].attrs['NumPeople']
+def plot_group_means(GMap, locations):
+    """
+    Plots the mean location of the groups.
 
-            groups = data_file["Cities"][city][institute].keys()
-            for group in groups:
-                if city_count == 0:
-                    group_weighted_lon[group] = 0.0
-                    group_weighted_lat[group] = 0.0
-                    NumPeople[group] = 0.0
+    Parameters
+    ----------
 
-                group_weighted_lon[group] += \
-                        data_file["Cities"][city][institute][group].value * lon 
+    GMap: Bokeh GMap (Google Map) Axis. 
+        Map that we're plotting the data on top of.
 
-                group_weighted_lat[group] += \
-                        data_file["Cities"][city][institute][group].value * lat 
+    locations: Dictionary of arrays.  Required.
+        The location data, see ``locations_data.load_locations``.
 
-                NumPeople[group] += \
-                        data_file["Cities"][city][institute][group].value 
+    Returns
+    ----------
 
+    None.  The data is plotted onto the Google Map axis. 
+    """
 
-    for group in group_weighted_lon.keys():
-        group_weighted_lon[group] /= NumPeople[group]
-        group_weighted_lat[group] /= NumPeople[group]
-        group_names.append(group)
+    institutes = ld.get_institute_table(locations)
 
-    lon_values = [lon for lon in group_weighted_lon.values()]
-    lat_values = [lat for lat in group_weighted_lat.values()]
-    people = [num for num in NumPeople.values()]
+    # Weight each institute's coordinates by the number of people in each
+    # group there.
+    counts = institutes["counts"]
+    people = counts.sum(axis=0)
+
+    lon_values = counts.T.dot(institutes["lon"]) / people
+    lat_values = counts.T.dot(institutes["lat"]) / people
 
     source = ColumnDataSource(data=dict(
                               x=lon_values,
                               y=lat_values,
-                              group_name=group_names,
+                              group_name=institutes["group_names"],
                               people=people,
-                              fill_colors=colors,))
+                              fill_colors=colors[:len(people)],))
 
     plot2 = GMap.circle('x', 'y', size=15, source=source,
                         fill_color='fill_colors')
     GMap.add_tools(HoverTool(renderers=[plot2], tooltips=[
                       ("Group", "@group_name"),
                       ("Number People", "@people")]))
-   
 
-    data_file.close()
 
+def determine_cities(locations):
 
-def determine_cities(args):
+    city_names, _ = ld.get_unique(locations["city"])
 
-
-    city_names = []
-    with h5py.File(args["fname_in"], "r") as data_file:
-   
-        cities = data_file["Cities"].keys()
-        for city in cities:
-            city_names.append(city)
-    return city_names 
+    return list(city_names)
 
 
 def plot_data(args): 
@@ -466,10 +531,14 @@ def plot_data(args):
     Returns
     ----------
 
-    None.  The figure is saved as a html file as 'test.html'. 
+    None.  The figure is saved as a html file, see ``args["fname_out"]``.
     """
 
-    output_file("test.html")
+    # Load BokehJS from the CDN rather than inlining it in the page.
+    output_file(args["fname_out"], mode="cdn")
+
+    # Read the data file once; every plot below uses these columns.
+    locations = ld.load_locations(args["fname_in"])
 
     # First let's get the properties of the map we're drawing. 
     map_options = get_Gmap_options()
@@ -480,26 +549,29 @@ def plot_data(args):
     # Now let's plot Australia!
     GMap = gmap(API_key, map_options,
              title="Australia")
-        
-    if args["date"]:
-        city_names = determine_cities(args)
-        airfare_plots = {}
 
+    city_names = determine_cities(locations)
+
+    # Plot the cities each institution belongs to.
+    plot_cities(GMap, locations, args)
+
+    # Then for each group, plot the mean location of the group.
+    plot_group_means(GMap, locations)
+
+    # If a date is passed at Runtime we want to plot the airfares on that
+    # date.
+    if args["date"] and len(city_names) > 1:
+        fares = deal_with_airfares(args, locations, city_names)
+
+        airfare_plots = {}
         for city in city_names: 
             airfare_plots[city] = figure(x_range=city_names, plot_width=400, 
                                          plot_height=400, tools="", 
                                          toolbar_location=None,
                                          title=city)
-    else:
-        airfare_plots = None
 
-    # Plot the cities each institution belongs to.
-    plot_cities(GMap, airfare_plots, args)
-
-    # Then for each group, plot the mean location of the group.
-    plot_group_means(GMap, args)
+        plot_airfares(airfare_plots, fares, city_names, args)
 
-    if args["date"]:      
         grid = []
         for city in city_names: 
             grid.append(airfare_plots[city])
@@ -514,8 +586,10 @@ def plot_data(args):
 if __name__ == '__main__':
 
     args = parse_input()
+    enable_from_args(args, "plot_locations")
 
     set_globalplot_properties()
 
-    plot_data(args) 
+    with profiler.stage("plot_data"):
+        plot_data(args)
 
@@ -2,12 +2,25 @@
 
 import json
 import requests
-from lxml import html
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 import argparse
+import os
+import time
+import threading
 from datetime import datetime
-import certifi
-import urllib3
+from concurrent.futures import ThreadPoolExecutor
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+# Site the searches are sent to.  Can be pointed at a local stand-in, see
+# ``mock_expedia.py``.
+base_url = "https://www.expedia.com"
+
+# Seconds to wait for Expedia to connect and to send each part of a response.
+request_timeout = 30.0
+
+headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/42.0.2311.90 Safari/537.36'}
 
 
 def parse_inputs():
@@ -52,6 +65,8 @@ def parse_inputs():
                           help="Date for leaving the source city. 'DD/MM/YYYY'",
                           type=str)
 
+    add_profile_arguments(optional)
+
     args = parser.parse_args()
     args = vars(args)
 
@@ -71,13 +86,80 @@ def parse_inputs():
     return args
 
 
-def scrape_airfares(source_airport, dest_airport, date):
+def get_session(pool_size=10):
+    """
+    Creates a ``requests`` session with a pool of reusable connections.
+
+    A single session should be shared by every request (and thread) so
+    connections to Expedia are kept alive rather than re-established.
+
+    Parameters
+    ----------
+
+    pool_size: Integer. Optional, default 10.
+        Maximum number of connections kept open to each host.  Should be at
+        least the number of concurrent requests.
+
+    Returns
+    ----------
+
+    session: ``requests.Session``.
+        The pooled session.
+    """
+
+    session = requests.Session()
+
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    session.headers.update(headers)
+    session.verify = False
+
+    return session
+
+
+def get_url(source_airport, dest_airport, date):
+    """
+    Builds the Expedia one-way search URL.
+
+    Parameters
+    ----------
+
+    source_airport, dest_airport: Strings. Required.
+        The airport codes we're leaving from and arriving at.
+
+    date: String. Required.
+        The date we're scraping airfares for. Must be in 'DD/MM/YYYY' format.
+
+    Returns
+    ----------
+
+    url: String.
+        The search URL.
+    """
+
+    # Expedia is an American website so need to use the date as 'MM/DD/YYYY'.
+    dt = datetime.strptime(date, "%d/%m/%Y")
+    date_string = "{0}/{1}/{2}".format(dt.month, dt.day, dt.year)
+
+    url="{3}/Flights-Search?trip=oneway&leg1=from:{0},to:{1},departure:{2}TANYT&passengers=adults:1,children:0,seniors:0,infantinlap:Y&options=cabinclass%3Aeconomy&mode=search&origref=www.expedia.com".format(source_airport,dest_airport,date_string,base_url)
+
+    return url
+
+
+def scrape_airfares(source_airport, dest_airport, date, session=None,
+                    timeout=None):
     """
     Gets airfare prices from Expedia.
 
     This function was taken (essentially) whole from
     https://www.scrapehero.com/scrape-flight-schedules-and-prices-from-expedia/
 
+    If the request times out or the response is an HTTP error a
+    ``requests.RequestException`` will be raised.
+
     Parameters
     ----------
 
@@ -90,6 +172,14 @@ def scrape_airfares(source_airport, dest_airport, date):
     date: String. Required. 
         The date we're scraping airfares for. Must be in 'DD/MM/YYYY' format. 
 
+    session: ``requests.Session``. Optional.
+        Pooled session to make the request with, see ``get_session``.  If not
+        specified a new one is created.
+
+    timeout: Float. Optional.
+        Seconds to wait for the connection and for each read.  If not
+        specified, ``request_timeout`` is used.
+
     Returns
     ----------
 
@@ -103,101 +193,431 @@ def scrape_airfares(source_airport, dest_airport, date):
                                                             dest_airport,
                                                             date))
 
-    # Expedia is an American website so need to use the date as 'MM/DD/YYYY'.
-    dt = datetime.strptime(date, "%d/%m/%Y")
-    date_string = "{0}/{1}/{2}".format(dt.month, dt.day, dt.year)
+    if session is None:
+        session = get_session()
 
-    http = urllib3.PoolManager(
-           cert_reqs='CERT_REQUIRED',
-           ca_certs=certifi.where())
+    if timeout is None:
+        timeout = request_timeout
 
-    url="https://www.expedia.com/Flights-Search?trip=oneway&leg1=from:{0},to:{1},departure:{2}TANYT&passengers=adults:1,children:0,seniors:0,infantinlap:Y&options=cabinclass%3Aeconomy&mode=search&origref=www.expedia.com".format(source_airport,dest_airport,date_string)
+    url = get_url(source_airport, dest_airport, date)
 
     print(url)
-    headers = {'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/42.0.2311.90 Safari/537.36'}
-    response = requests.get(url, headers=headers, verify=False)
+    response = session.get(url, timeout=timeout)
+    response.raise_for_status()
+
+    return parse_airfares(response.content)
 
-    parser = html.fromstring(response.content)
-    json_data_xpath = parser.xpath("//script[@id='cachedResultsJson']//text()")
 
-    raw_json =json.loads(json_data_xpath[0] if json_data_xpath else '')
+def extract_cached_json(content):
+    """
+    Pulls the ``cachedResultsJson`` script payload out of a results page.
+
+    Rather than building a full HTML DOM this scans for the script's id and
+    slices out the text up to the closing tag.  Script contents are raw text
+    in HTML so no unescaping is needed.
+
+    If the page does not contain the script a ValueError will be raised.
+
+    Parameters
+    ----------
+
+    content: Bytes or string. Required.
+        The HTML of the search results page.
+
+    Returns
+    ----------
+
+    payload: Bytes or string (same type as ``content``).
+        The text inside the ``<script id="cachedResultsJson">`` tag.
+    """
+
+    if isinstance(content, str):
+        marker, tag_open, tag_close, gt = ("cachedResultsJson", "<script",
+                                           "</script", ">")
+    else:
+        marker, tag_open, tag_close, gt = (b"cachedResultsJson", b"<script",
+                                           b"</script", b">")
+
+    idx = content.find(marker)
+    while idx != -1:
+        # Make sure the id is inside a script's opening tag (i.e., there's no
+        # '>' between '<script' and the id) and not, e.g., some other text.
+        tag_start = content.rfind(tag_open, 0, idx)
+        tag_end = content.find(gt, idx)
+
+        if tag_start != -1 and tag_end != -1 and \
+           content.find(gt, tag_start, idx) == -1:
+            payload_end = content.find(tag_close, tag_end)
+            if payload_end != -1:
+                return content[tag_end + 1:payload_end]
+
+        idx = content.find(marker, idx + len(marker))
+
+    print("Could not find the cachedResultsJson script in the results page.")
+    raise ValueError
+
+
+Leg = namedtuple("Leg", ["price", "stops", "departure", "arrival",
+                         "flight_duration", "airline", "plane", "plane_code",
+                         "timings"])
+
+
+def parse_leg(leg):
+    """
+    Decodes a single leg of the Expedia results into a compact record.
+
+    Each nested dictionary of the leg is looked up once.
+
+    Parameters
+    ----------
+
+    leg: Dictionary. Required.
+        One entry of the ``legs`` dictionary in the results JSON.
+
+    Returns
+    ----------
+
+    record: ``Leg`` named tuple.
+        The fields needed for the ``flightlist``, already formatted.
+    """
+
+    get = leg.get
+
+    exact_price = get('price', {}).get('totalPriceAsDecimal', '')
+
+    departure_location = get('departureLocation', {})
+    arrival_location = get('arrivalLocation', {})
+    airline_name = get('carrierSummary', {}).get('airlineName', '')
+
+    no_of_stops = get("stops", "")
+    if no_of_stops == 0:
+        stop = "Nonstop"
+    else:
+        stop = str(no_of_stops)+' Stop'
+
+    flight_duration = get('duration', {})
+    total_flight_duration = "{0} days {1} hours {2} minutes" \
+                            .format(flight_duration.get('numOfDays', ''),
+                                    flight_duration.get('hours', ''),
+                                    flight_duration.get('minutes', ''))
+
+    departure = departure_location.get('airportLongName', '') + ", " + \
+                departure_location.get('airportCity', '')
+    arrival = arrival_location.get('airportLongName', '') + ", " + \
+              arrival_location.get('airportCity', '')
+
+    timeline = get('timeline', [])
+    if timeline:
+        carrier = timeline[0].get('carrier', {})
+    else:
+        carrier = {}
+
+    if not airline_name:
+        airline_name = carrier.get('operatedBy', '')
+
+    timings = []
+    for segment in timeline:
+        if 'departureAirport' in segment:
+            timings.append({
+                'departure_airport': segment['departureAirport'].get('longName', ''),
+                'departure_time': segment['departureTime'].get('time', ''),
+                'arrival_airport': segment.get('arrivalAirport', {}).get('longName', ''),
+                'arrival_time': segment.get('arrivalTime', {}).get('time', '')
+            })
+
+    return Leg("{0:.2f}".format(exact_price), stop, departure, arrival,
+               total_flight_duration, airline_name, carrier.get('plane', ''),
+               carrier.get('planeCode', ''), timings)
+
+
+def parse_airfares(content):
+    """
+    Parses the flight information out of an Expedia search results page.
+
+    Parameters
+    ----------
+
+    content: Bytes or string. Required.
+        The HTML of the search results page.
+
+    Returns
+    ----------
+
+    flightlist: List.
+        The flight information, sorted by ticket price.  See
+        ``scrape_airfares``.
+    """
+
+    raw_json = json.loads(extract_cached_json(content))
     flight_data = json.loads(raw_json["content"])
 
-    flight_info  = OrderedDict() 
-    lists=[]
-
-    for i in flight_data['legs'].keys():
-        total_distance =  flight_data['legs'][i].get("formattedDistance",'')
-        exact_price = flight_data['legs'][i].get('price',{}).get('totalPriceAsDecimal','')
-
-        departure_location_airport = flight_data['legs'][i].get('departureLocation',{}).get('airportLongName','')
-        departure_location_city = flight_data['legs'][i].get('departureLocation',{}).get('airportCity','')
-        departure_location_airport_code = flight_data['legs'][i].get('departureLocation',{}).get('airportCode','')
-        
-        arrival_location_airport = flight_data['legs'][i].get('arrivalLocation',{}).get('airportLongName','')
-        arrival_location_airport_code = flight_data['legs'][i].get('arrivalLocation',{}).get('airportCode','')
-        arrival_location_city = flight_data['legs'][i].get('arrivalLocation',{}).get('airportCity','')
-        airline_name = flight_data['legs'][i].get('carrierSummary',{}).get('airlineName','')
-        
-        no_of_stops = flight_data['legs'][i].get("stops","")
-        flight_duration = flight_data['legs'][i].get('duration',{})
-        flight_hour = flight_duration.get('hours','')
-        flight_minutes = flight_duration.get('minutes','')
-        flight_days = flight_duration.get('numOfDays','')
-
-        if no_of_stops==0:
-            stop = "Nonstop"
-        else:
-            stop = str(no_of_stops)+' Stop'
-
-        total_flight_duration = "{0} days {1} hours {2} minutes".format(flight_days,flight_hour,flight_minutes)
-        departure = departure_location_airport+", "+departure_location_city
-        arrival = arrival_location_airport+", "+arrival_location_city
-        carrier = flight_data['legs'][i].get('timeline',[])[0].get('carrier',{})
-        plane = carrier.get('plane','')
-        plane_code = carrier.get('planeCode','')
-        formatted_price = "{0:.2f}".format(exact_price)
-
-        if not airline_name:
-            airline_name = carrier.get('operatedBy','')
-        
-        timings = []
-        for timeline in  flight_data['legs'][i].get('timeline',{}):
-            if 'departureAirport' in timeline.keys():
-                departure_airport = timeline['departureAirport'].get('longName','')
-                departure_time = timeline['departureTime'].get('time','')
-                arrival_airport = timeline.get('arrivalAirport',{}).get('longName','')
-                arrival_time = timeline.get('arrivalTime',{}).get('time','')
-                flight_timing = {
-                                    'departure_airport':departure_airport,
-                                    'departure_time':departure_time,
-                                    'arrival_airport':arrival_airport,
-                                    'arrival_time':arrival_time
-                }
-                timings.append(flight_timing)
-
-        flight_info={'stops':stop,
-            'ticket price':formatted_price,
-            'departure':departure,
-            'arrival':arrival,
-            'flight duration':total_flight_duration,
-            'airline':airline_name,
-            'plane':plane,
-            'timings':timings,
-            'plane code':plane_code
-        }
-        lists.append(flight_info)
-
-    flightlist = sorted(lists, key=lambda k: k['ticket price'],reverse=False)
-
-    return flightlist 
-
-
-
-def save_json(data, source_airport, dest_airport, date):
+    legs = [parse_leg(leg) for leg in flight_data['legs'].values()]
+    legs.sort(key=lambda leg: leg.price)
+
+    flightlist = [{'stops': leg.stops,
+                   'ticket price': leg.price,
+                   'departure': leg.departure,
+                   'arrival': leg.arrival,
+                   'flight duration': leg.flight_duration,
+                   'airline': leg.airline,
+                   'plane': leg.plane,
+                   'timings': leg.timings,
+                   'plane code': leg.plane_code}
+                  for leg in legs]
+
+    return flightlist
+
+
+def get_json_fname(source_airport, dest_airport, date, cache_dir="."):
+    """
+    Gets the name of the .json file the airfares of a route are saved in.
+
+    Parameters
+    ----------
+
+    source_airport, dest_airport: Strings. Required.
+        The airport codes of the route.
+
+    date: String. Required.
+        The date of the airfares.  Must be in 'DD/MM/YYYY' format.
+
+    cache_dir: String. Optional, default ".".
+        Directory the .json files are kept in.
+
+    Returns
+    ----------
+
+    fname: String.
+        '<cache_dir>/<source_airport>_<dest_airport>_<day>_<month>_<year>.json'
+    """
+
+    dt = datetime.strptime(date, "%d/%m/%Y")
+
+    fname = "{0}/{1}_{2}_{3}_{4}_{5}.json".format(cache_dir,
+                                                  source_airport,
+                                                  dest_airport,
+                                                  dt.day,
+                                                  dt.month,
+                                                  dt.year)
+
+    return fname
+
+
+def load_cached_airfares(source_airport, dest_airport, date, cache_dir=".",
+                         ttl=None):
+    """
+    Loads previously saved airfares for a route if they haven't expired.
+
+    Parameters
+    ----------
+
+    source_airport, dest_airport: Strings. Required.
+        The airport codes of the route.
+
+    date: String. Required.
+        The date of the airfares.  Must be in 'DD/MM/YYYY' format.
+
+    cache_dir: String. Optional, default ".".
+        Directory the .json files are kept in.
+
+    ttl: Float. Optional.
+        Number of seconds a saved file stays valid (based on its modification
+        time).  If not specified, saved files never expire.
+
+    Returns
+    ----------
+
+    flightlist: List or None.
+        The saved flight information, or None if there is no valid file.
+    """
+
+    fname = get_json_fname(source_airport, dest_airport, date, cache_dir)
+
+    try:
+        age = time.time() - os.path.getmtime(fname)
+    except OSError:
+        return None
+
+    if ttl is not None and age > ttl:
+        return None
+
+    with open(fname, "r") as fp:
+        flightlist = json.load(fp)
+
+    return flightlist
+
+
+def get_airfares(source_airport, dest_airport, date, session=None,
+                 cache_dir=None, ttl=None, offline=False):
+    """
+    Gets the airfares for a route, only scraping Expedia on a cache miss.
+
+    If ``offline`` is set and there is no valid cached file a RuntimeError
+    will be raised.
+
+    Parameters
+    ----------
+
+    source_airport, dest_airport: Strings. Required.
+        The airport codes of the route.
+
+    date: String. Required.
+        The date of the airfares.  Must be in 'DD/MM/YYYY' format.
+
+    session: ``requests.Session``. Optional.
+        Pooled session used on a cache miss, see ``get_session``.
+
+    cache_dir: String. Optional.
+        Directory the cached .json files are kept in.  If not specified, no
+        caching is done.
+
+    ttl: Float. Optional.
+        Number of seconds a cached file stays valid.  If not specified, cached
+        files never expire.
+
+    offline: Boolean. Optional, default False.
+        If True, never make a network request.
+
+    Returns
+    ----------
+
+    flightlist: List.
+        The flight information, see ``scrape_airfares``.
+    """
+
+    if cache_dir is not None:
+        flightlist = load_cached_airfares(source_airport, dest_airport, date,
+                                          cache_dir, ttl)
+        if flightlist is not None:
+            return flightlist
+
+    if offline:
+        print("There are no cached airfares from {0} to {1} on {2} in {3} and "
+              "we are running offline.".format(source_airport, dest_airport,
+                                               date, cache_dir))
+        raise RuntimeError
+
+    flightlist = scrape_airfares(source_airport, dest_airport, date, session)
+
+    if cache_dir is not None:
+        save_json(flightlist, source_airport, dest_airport, date, cache_dir)
+
+    return flightlist
+
+
+def scrape_routes(routes, date, max_workers=8, session=None, cache_dir=None,
+                  ttl=None, offline=False):
+    """
+    Scrapes the airfares for many routes concurrently.
+
+    All requests share one pooled session and at most ``max_workers`` are in
+    flight at once.  Routes with valid cached airfares are not requested, see
+    ``get_airfares``.
+
+    Parameters
+    ----------
+
+    routes: List of tuples. Required.
+        The (source_airport, dest_airport) pairs to scrape.
+
+    date: String. Required.
+        The date we're scraping airfares for. Must be in 'DD/MM/YYYY' format.
+
+    max_workers: Integer. Optional, default 8.
+        Maximum number of concurrent requests.
+
+    session: ``requests.Session``. Optional.
+        Pooled session to make the requests with, see ``get_session``.  If not
+        specified a new one is created.
+
+    cache_dir, ttl, offline: Optional.
+        Caching options, see ``get_airfares``.
+
+    Returns
+    ----------
+
+    airfares: ``OrderedDict``.
+        Keyed by each route (in the order given) with the ``flightlist`` of
+        that route as the value.  See ``scrape_airfares``.  Routes that failed
+        are left out, see ``scrape_routes_dates``.
+    """
+
+    airfares_dates = scrape_routes_dates(routes, [date], max_workers, session,
+                                         cache_dir, ttl, offline)
+
+    airfares = OrderedDict()
+    for (source, dest) in routes:
+        if (date, source, dest) in airfares_dates:
+            airfares[(source, dest)] = airfares_dates[(date, source, dest)]
+
+    return airfares
+
+
+def scrape_routes_dates(routes, dates, max_workers=8, session=None,
+                        cache_dir=None, ttl=None, offline=False):
+    """
+    Scrapes the airfares for many routes on many dates concurrently.
+
+    A route that fails (a network error, an HTTP error, a page without
+    results or a cache miss while offline) doesn't stop the others.  The
+    failed routes are printed at the end and left out of the result.
+
+    Parameters
+    ----------
+
+    routes: List of tuples. Required.
+        The (source_airport, dest_airport) pairs to scrape.
+
+    dates: List of strings. Required.
+        The dates we're scraping airfares for. Must be in 'DD/MM/YYYY' format.
+
+    max_workers, session, cache_dir, ttl, offline: Optional.
+        See ``scrape_routes``.
+
+    Returns
+    ----------
+
+    airfares: ``OrderedDict``.
+        Keyed by (date, source_airport, dest_airport) with the ``flightlist``
+        as the value.  Only the routes that succeeded are included.
+    """
+
+    if session is None:
+        session = get_session(pool_size=max_workers)
+
+    keys = [(date, source, dest) for date in dates for (source, dest) in routes]
+
+    # Stages aren't thread-safe, so the routes are only timed as a whole.
+    with profiler.stage("scrape_routes", num_items=len(keys)), \
+         ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(get_airfares, source, dest, date, session,
+                                   cache_dir, ttl, offline)
+                   for (date, source, dest) in keys]
+
+        airfares = OrderedDict()
+        failed = []
+        for key, future in zip(keys, futures):
+            try:
+                airfares[key] = future.result()
+            except (requests.RequestException, ValueError,
+                    RuntimeError) as err:
+                failed.append((key, err))
+
+    if failed:
+        print("{0} of {1} routes failed:".format(len(failed), len(keys)))
+        for (date, source, dest), err in failed:
+            print("  {0} to {1} on {2}: {3}".format(source, dest, date, err))
+
+    return airfares
+
+
+def save_json(data, source_airport, dest_airport, date, cache_dir="."):
     """
     Saves the scraped airfares as a .json file.
 
+    The file is written to a temporary name first and then moved into place
+    so a concurrent reader never sees a partially written file.
+
     Parameters
     ----------
 
@@ -214,23 +634,26 @@ def save_json(data, source_airport, dest_airport, date):
     date: String. Required. 
         The date we scraped data for.  Must be in 'DD/MM/YYYY' format.
 
+    cache_dir: String. Optional, default ".".
+        Directory the .json file is saved in.  Created if it doesn't exist.
+
     Returns
     ----------
 
     None.  The .json file is saved as
-    '<source_airport>_<dest_aiport>_<day>_<month>_<year>.json'
+    '<cache_dir>/<source_airport>_<dest_aiport>_<day>_<month>_<year>.json'
     """
 
-    dt = datetime.strptime(args["date"], "%d/%m/%Y")
+    fname = get_json_fname(source_airport, dest_airport, date, cache_dir)
 
-    fname = "{0}_{1}_{2}_{3}_{4}.json".format(args["source_airport"],
-                                              args["dest_airport"],
-                                              dt.day,
-                                              dt.month,
-                                              dt.year)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
 
-    with open(fname,'w') as fp:
-        json.dump(scraped_data,fp,indent = 4)
+    fname_tmp = "{0}.{1}.{2}.tmp".format(fname, os.getpid(),
+                                         threading.get_ident())
+    with open(fname_tmp,'w') as fp:
+        json.dump(data,fp,indent = 4)
+    os.replace(fname_tmp, fname)
 
     print("Saved data to {0}".format(fname))
 
@@ -238,10 +661,12 @@ def save_json(data, source_airport, dest_airport, date):
 if __name__ == '__main__':
 
     args = parse_inputs()
+    enable_from_args(args, "scrape_airfares")
 
-    scraped_data = scrape_airfares(args["source_airport"],
-                                   args["dest_airport"],
-                                   args["date"])
+    with profiler.stage("scrape_airfares", num_items=1):
+        scraped_data = scrape_airfares(args["source_airport"],
+                                       args["dest_airport"],
+                                       args["date"])
       
     save_json(scraped_data, args["source_airport"], args["dest_airport"],
               args["date"])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import sys
+import os
+import numpy as np
+import h5py
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+
+import locations_data as ld
+
+
+def get_locations():
+    """
+    Builds a small set of location columns, two institutes in one city and one
+    in another, each with two groups.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    locations: Dictionary of arrays.
+        The columns, see ``locations_data.load_locations``.
+    """
+
+    locations = {"city": ["Melbourne"]*4 + ["Perth"]*2,
+                 "institute": ["SUT", "SUT", "UMelb", "UMelb", "UWA", "UWA"],
+                 "group": ["CIs", "Students"]*3,
+                 "count": [3, 7, 2, 5, 1, 4],
+                 "lon": [145.0, 145.0, 144.9, 144.9, 115.8, 115.8],
+                 "lat": [-37.8, -37.8, -37.7, -37.7, -31.9, -31.9],
+                 "city_lon": [144.96]*4 + [115.86]*2,
+                 "city_lat": [-37.81]*4 + [-31.95]*2}
+
+    return locations
+
+
+def test_layouts(tmpdir):
+    """
+    Checks the table and hierarchical layouts load to the same institutes.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    locations = get_locations()
+
+    fname_table = str(tmpdir.join("table.hdf5"))
+    ld.write_locations(fname_table, locations)
+
+    fname_hierarchy = str(tmpdir.join("hierarchy.hdf5"))
+    with h5py.File(fname_hierarchy, "w") as f:
+        for row in range(len(locations["city"])):
+            name = "Cities/{0}/{1}/{2}".format(locations["city"][row],
+                                               locations["institute"][row],
+                                               locations["group"][row])
+            f.create_dataset(name, data=np.array(locations["count"][row]),
+                             dtype=np.int32)
+
+            inst = f["Cities/{0}/{1}".format(locations["city"][row],
+                                             locations["institute"][row])]
+            inst.attrs["Coords"] = [locations["lon"][row],
+                                    locations["lat"][row]]
+            f[name].parent.parent.attrs["Coords"] = \
+                [locations["city_lon"][row], locations["city_lat"][row]]
+
+    for fname in [fname_table, fname_hierarchy]:
+        institutes = ld.get_institute_table(ld.load_locations(fname))
+
+        if list(institutes["institute"]) != ["SUT", "UMelb", "UWA"] or \
+           list(institutes["group_names"]) != ["CIs", "Students"]:
+            print("The institutes/groups of {0} were {1} and {2}."
+                  .format(fname, institutes["institute"],
+                          institutes["group_names"]))
+            pytest.fail()
+
+        if not np.array_equal(institutes["counts"], [[3, 7], [2, 5], [1, 4]]):
+            print("The group counts of {0} were {1}."
+                  .format(fname, institutes["counts"]))
+            pytest.fail()
+
+        if not np.allclose(institutes["city_lon"], [144.96, 144.96, 115.86]):
+            print("The city coordinates of {0} were {1}."
+                  .format(fname, institutes["city_lon"]))
+            pytest.fail()
+
+    cities, num_people = ld.get_city_people(ld.load_locations(fname_table))
+    assert list(cities) == ["Melbourne", "Perth"]
+    assert list(num_people) == [17, 5]
+
+
+if __name__ == "__main__":
+
+    import tempfile
+    import py
+
+    test_layouts(py.path.local(tempfile.mkdtemp()))
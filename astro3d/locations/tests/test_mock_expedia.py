@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import sys
+import os
+import pytest
+import requests
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+
+import mock_expedia
+import scrape_airfares as scr
+
+fixture_dir = "{0}/fixtures".format(test_dir)
+date = "01/02/2019"
+
+
+def test_scrape_mock():
+    """
+    Scrapes the recorded page from the local stand-in server and checks it
+    matches the saved flight list, then checks failed responses raise and
+    only drop the failed routes from ``scrape_routes``.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    expected = scr.load_cached_airfares("MEL", "SYD", date, fixture_dir)
+
+    base_url = scr.base_url
+    server = mock_expedia.start_server(fixture_dir, seed=2)
+    scr.base_url = server.url
+
+    try:
+        airfares = scr.scrape_routes([("MEL", "SYD"), ("SYD", "MEL")], date,
+                                     max_workers=2)
+
+        for route, flightlist in airfares.items():
+            if flightlist != expected:
+                print("The flight list scraped for {0} does not match the "
+                      "saved one.".format(route))
+                pytest.fail()
+
+        if server.num_requests != 2:
+            print("The server received {0} requests rather than 2."
+                  .format(server.num_requests))
+            pytest.fail()
+
+        server.error_rate = 1.0
+        with pytest.raises(requests.HTTPError):
+            scr.scrape_airfares("MEL", "SYD", date)
+
+        # Half the routes fail.  The others are still returned, in order.
+        server.error_rate = 0.5
+        num_errors = server.num_errors
+        routes = [("MEL", "SYD"), ("SYD", "MEL"), ("MEL", "PER"),
+                  ("PER", "MEL"), ("SYD", "PER"), ("PER", "SYD")]
+        airfares = scr.scrape_routes(routes, date, max_workers=2)
+
+        if list(airfares.keys()) != [route for route in routes
+                                     if route in airfares] or \
+           any(flightlist != expected for flightlist in airfares.values()):
+            print("The routes that succeeded were {0}.".format(airfares))
+            pytest.fail()
+
+        num_failed = server.num_errors - num_errors
+        if len(routes) - len(airfares) != num_failed or \
+           num_failed in [0, len(routes)]:
+            print("{0} routes were returned but the server failed {1} of {2} "
+                  "requests.".format(len(airfares), num_failed, len(routes)))
+            pytest.fail()
+    finally:
+        scr.base_url = base_url
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+
+    test_scrape_mock()
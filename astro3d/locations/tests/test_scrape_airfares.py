@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import json
+import sys
+import os
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+
+import scrape_airfares as scr
+
+fixture_dir = "{0}/fixtures".format(test_dir)
+
+source_airport = "MEL"
+dest_airport = "SYD"
+date = "01/02/2019"
+
+
+def test_parse():
+    """
+    Checks the saved results page parses to the saved flight list.
+
+    The .json fixture was produced by the original ``lxml`` parser, so this
+    ensures the targeted scan gives identical output.  The page also mentions
+    ``cachedResultsJson`` outside of the script tag.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    fname_page = "{0}/{1}_{2}_1_2_2019.htm".format(fixture_dir, source_airport,
+                                                   dest_airport)
+    with open(fname_page, "rb") as f:
+        content = f.read()
+
+    expected = scr.load_cached_airfares(source_airport, dest_airport, date,
+                                        fixture_dir)
+
+    for page in [content, content.decode("utf-8")]:
+        flightlist = scr.parse_airfares(page)
+
+        if flightlist != expected:
+            print("The parsed flight list does not match the saved one.")
+            pytest.fail()
+
+    with pytest.raises(ValueError):
+        scr.parse_airfares(b"<html><body>cachedResultsJson</body></html>")
+
+
+def test_offline_cache():
+    """
+    Checks the saved flight list is used without any network access.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    flightlist = scr.get_airfares(source_airport, dest_airport, date,
+                                  cache_dir=fixture_dir, offline=True)
+
+    with open(scr.get_json_fname(source_airport, dest_airport, date,
+                                 fixture_dir), "r") as f:
+        expected = json.load(f)
+
+    if flightlist != expected:
+        print("The cached flight list was not returned.")
+        pytest.fail()
+
+    with pytest.raises(RuntimeError):
+        scr.get_airfares(dest_airport, source_airport, date,
+                         cache_dir=fixture_dir, offline=True)
+
+
+if __name__ == "__main__":
+
+    test_parse()
+    test_offline_cache()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import sys
+import os
+import numpy as np
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+
+import venue_optimizer as vo
+
+
+def test_optimize_venue():
+    """
+    Checks the distances, the fare override and the cheapest venues on a
+    small example.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    # Melbourne to Sydney is about 713 km.
+    distance = vo.haversine_distance([144.96], [-37.81], [151.21], [-33.87])
+    if not np.isclose(distance[0, 0], 713.4, atol=0.5):
+        print("The Melbourne to Sydney distance was {0} km."
+              .format(distance[0, 0]))
+        pytest.fail()
+
+    # Two institutes (Melbourne and Perth) and two venues (the same cities).
+    inst_lon = np.array([144.96, 115.86])
+    inst_lat = np.array([-37.81, -31.95])
+
+    # Only the Perth to Melbourne fare is known.
+    fares = np.array([[0.0, np.nan],
+                      [50.0, 0.0]])
+
+    cost = vo.build_cost_matrix(inst_lon, inst_lat, inst_lon, inst_lat,
+                                cost_per_km=1.0, fares=fares,
+                                inst_city=[0, 1], venue_city=[0, 1])
+
+    if cost[1, 0] != 50.0 or not cost[0, 1] > 2000.0 or \
+       not np.allclose(np.diag(cost), 0.0, atol=1e-3):
+        print("The cost matrix was {0}.".format(cost))
+        pytest.fail()
+
+    # Group 0 is mostly in Perth and group 1 is entirely in Melbourne.
+    counts = np.array([[1, 4],
+                       [3, 0]])
+
+    group_costs, total_costs, group_best, total_best = \
+        vo.optimize_venue(cost, counts)
+
+    if list(group_best) != [0, 0] or total_best != 0:
+        print("The cheapest venues were {0} and {1} with costs {2} and {3}."
+              .format(group_best, total_best, group_costs, total_costs))
+        pytest.fail()
+
+    assert np.isclose(total_costs[0], 3 * 50.0, atol=1e-2)
+
+
+if __name__ == "__main__":
+
+    test_optimize_venue()
@@ -0,0 +1,369 @@
+#!/usr/bin:env python
+"""
+Finds the cheapest venue for an astro3d meeting.
+
+The travel cost of every institute to every candidate venue is held in a dense
+(num_institutes, num_venues) matrix.  By default the cost is proportional to
+the great-circle distance.  When a venue is one of the cities in the data file
+and the fare between two cities has been cached (see ``scrape_airfares.py``),
+that fare is used instead.  The matrix is weighted by the number of people in
+each group at each institute to give the cost of each venue for each group
+and for everyone.
+"""
+from __future__ import print_function
+import numpy as np
+import argparse
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+import fare_matrix as fm
+import locations_data as ld
+
+# Mean radius of the Earth (km).
+earth_radius = 6371.0
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['fname_in']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-f", "--fname_in", dest="fname_in",
+                        help="Filename for the HDF5 data file containing the "
+                        "institutes. Default: './data/astro3d_data.hdf5'",
+                        default="./data/astro3d_data.hdf5", type=str)
+    parser.add_argument("-d", "--date", dest="date",
+                        help="Use the cached airfares on this date "
+                        "'DD/MM/YYYY' for travel between cities. Nothing is "
+                        "scraped. Default: distance only.", type=str)
+    parser.add_argument("-c", "--cache_dir", dest="cache_dir",
+                        help="Directory scraped airfares are cached in. "
+                        "Default: './data/airfares'.",
+                        default="./data/airfares", type=str)
+    parser.add_argument("-k", "--cost_per_km", dest="cost_per_km",
+                        help="Travel cost (AUD) per km of great-circle "
+                        "distance, used when there is no cached fare. "
+                        "Default: 0.25.", default=0.25, type=float)
+    parser.add_argument("-g", "--grid", dest="grid", nargs=2,
+                        metavar=("NUM_LON", "NUM_LAT"),
+                        help="Also consider a NUM_LON x NUM_LAT grid of "
+                        "venues covering the institutes. Default: only the "
+                        "cities.", type=int)
+
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    args = vars(args)
+
+    return args
+
+
+def haversine_distance(lon1, lat1, lon2, lat2):
+    """
+    Computes the great-circle distance between every pair of two sets of
+    points.
+
+    Parameters
+    ----------
+
+    lon1, lat1: Arrays of floats, shape (N,). Required.
+        Coordinates (degrees) of the first set of points.
+
+    lon2, lat2: Arrays of floats, shape (M,). Required.
+        Coordinates (degrees) of the second set of points.
+
+    Returns
+    ----------
+
+    distance: 2D array of floats, shape (N, M).
+        ``distance[i, j]`` is the distance (km) between point ``i`` of the
+        first set and point ``j`` of the second.
+    """
+
+    xyz1 = get_unit_vectors(lon1, lat1)
+    xyz2 = get_unit_vectors(lon2, lat2)
+
+    # The haversine of the central angle, hav = (1 - cos(angle)) / 2, written
+    # with the unit vectors so every pair comes from one matrix product.
+    hav = 0.5 - 0.5 * xyz1.dot(xyz2.T)
+    np.clip(hav, 0.0, 1.0, out=hav)
+
+    return 2.0 * earth_radius * np.arcsin(np.sqrt(hav, out=hav), out=hav)
+
+
+def get_unit_vectors(lon, lat):
+    """
+    Converts coordinates to unit vectors.
+
+    Parameters
+    ----------
+
+    lon, lat: Arrays of floats. Required.
+        Coordinates (degrees).
+
+    Returns
+    ----------
+
+    xyz: 2D array of floats, shape (num_points, 3).
+        The unit vector of each point.
+    """
+
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon),
+                     np.sin(lat)], axis=1)
+
+
+def get_city_venues(locations):
+    """
+    Gets the cities of the data file as candidate venues.
+
+    Parameters
+    ----------
+
+    locations: Dictionary of arrays. Required.
+        The location data, see ``locations_data.load_locations``.
+
+    Returns
+    ----------
+
+    venues: Dictionary of arrays.
+        Keyed by ``name``, ``lon``, ``lat`` and ``city`` (the index of the
+        venue's city, see ``locations_data.get_unique``).
+    """
+
+    cities, city_codes = ld.get_unique(locations["city"])
+
+    first_row = np.zeros(len(cities), dtype=np.int64)
+    first_row[city_codes[::-1]] = np.arange(len(city_codes))[::-1]
+
+    venues = {"name": cities,
+              "lon": locations["city_lon"][first_row],
+              "lat": locations["city_lat"][first_row],
+              "city": np.arange(len(cities))}
+
+    return venues
+
+
+def get_grid_venues(lon, lat, num_lon, num_lat):
+    """
+    Gets a regular lon/lat grid of candidate venues covering a set of points.
+
+    Grid venues don't belong to any city, so only distance based costs apply.
+
+    Parameters
+    ----------
+
+    lon, lat: Arrays of floats. Required.
+        Coordinates (degrees) the grid should cover.
+
+    num_lon, num_lat: Integers. Required.
+        Number of grid points along each axis.
+
+    Returns
+    ----------
+
+    venues: Dictionary of arrays.
+        See ``get_city_venues``.  The ``city`` of each venue is -1.
+    """
+
+    grid_lon, grid_lat = np.meshgrid(np.linspace(np.min(lon), np.max(lon),
+                                                 num_lon),
+                                     np.linspace(np.min(lat), np.max(lat),
+                                                 num_lat))
+
+    grid_lon = grid_lon.ravel()
+    grid_lat = grid_lat.ravel()
+
+    names = np.array(["({0:.2f}, {1:.2f})".format(x, y)
+                      for (x, y) in zip(grid_lon, grid_lat)])
+
+    venues = {"name": names,
+              "lon": grid_lon,
+              "lat": grid_lat,
+              "city": np.full(len(grid_lon), -1, dtype=np.int64)}
+
+    return venues
+
+
+def combine_venues(*venue_sets):
+    """
+    Joins several sets of candidate venues.
+
+    Parameters
+    ----------
+
+    venue_sets: Dictionaries of arrays. Required.
+        See ``get_city_venues``.
+
+    Returns
+    ----------
+
+    venues: Dictionary of arrays.
+        All the venues, in order.
+    """
+
+    return dict((key, np.concatenate([venues[key] for venues in venue_sets]))
+                for key in ["name", "lon", "lat", "city"])
+
+
+def build_cost_matrix(inst_lon, inst_lat, venue_lon, venue_lat,
+                      cost_per_km=0.25, fares=None, inst_city=None,
+                      venue_city=None):
+    """
+    Computes the cost for one person from each institute to travel to each
+    venue.
+
+    Parameters
+    ----------
+
+    inst_lon, inst_lat: Arrays of floats, shape (num_institutes,). Required.
+        Coordinates (degrees) of the institutes.
+
+    venue_lon, venue_lat: Arrays of floats, shape (num_venues,). Required.
+        Coordinates (degrees) of the candidate venues.
+
+    cost_per_km: Float. Optional, default 0.25.
+        Travel cost (AUD) per km of great-circle distance.
+
+    fares: 2D array of floats, shape (num_cities, num_cities). Optional.
+        ``fares[source, dest]`` is the fare (AUD) between two cities, NaN if
+        unknown, e.g. from ``fare_matrix.load_cached_fare_matrix``.  Used
+        instead of the distance cost wherever it is known and the institute
+        and venue are in different cities.
+
+    inst_city, venue_city: Arrays of integers. Optional.
+        Index (into ``fares``) of the city of each institute and venue, or -1
+        if it has none.  Required if ``fares`` is passed.
+
+    Returns
+    ----------
+
+    cost: 2D array of floats, shape (num_institutes, num_venues).
+        The travel cost (AUD) per person.
+    """
+
+    cost = cost_per_km * haversine_distance(inst_lon, inst_lat, venue_lon,
+                                            venue_lat)
+
+    if fares is None:
+        return cost
+
+    if inst_city is None or venue_city is None:
+        print("The city of each institute and venue is needed to use the "
+              "fares.")
+        raise ValueError
+
+    inst_city = np.asarray(inst_city)[:, np.newaxis]
+    venue_city = np.asarray(venue_city)[np.newaxis, :]
+
+    pair_fares = np.asarray(fares)[np.maximum(inst_city, 0),
+                                   np.maximum(venue_city, 0)]
+
+    use_fare = (inst_city >= 0) & (venue_city >= 0) & \
+               (inst_city != venue_city) & ~np.isnan(pair_fares)
+
+    return np.where(use_fare, pair_fares, cost)
+
+
+def optimize_venue(cost, counts):
+    """
+    Finds the cheapest venue for each group and for everyone.
+
+    Parameters
+    ----------
+
+    cost: 2D array of floats, shape (num_institutes, num_venues). Required.
+        The travel cost per person, see ``build_cost_matrix``.
+
+    counts: 2D array of integers, shape (num_institutes, num_groups).
+        Required.
+        The number of people in each group at each institute, see
+        ``locations_data.get_institute_table``.
+
+    Returns
+    ----------
+
+    group_costs: 2D array of floats, shape (num_groups, num_venues).
+        Total cost of each group travelling to each venue.
+
+    total_costs: Array of floats, shape (num_venues,).
+        Total cost of everyone travelling to each venue.
+
+    group_best: Array of integers, shape (num_groups,).
+        Index of the cheapest venue for each group.
+
+    total_best: Integer.
+        Index of the cheapest venue for everyone.
+    """
+
+    counts = np.asarray(counts, dtype=np.float64)
+
+    group_costs = counts.T.dot(cost)
+    total_costs = counts.sum(axis=1).dot(cost)
+
+    return group_costs, total_costs, np.argmin(group_costs, axis=1), \
+        np.argmin(total_costs)
+
+
+if __name__ == '__main__':
+
+    args = parse_inputs()
+    enable_from_args(args, "venue_optimizer")
+
+    locations = ld.load_locations(args["fname_in"])
+    institutes = ld.get_institute_table(locations)
+
+    venues = get_city_venues(locations)
+    cities = list(venues["name"])
+
+    if args["grid"]:
+        venues = combine_venues(venues,
+                                get_grid_venues(institutes["lon"],
+                                                institutes["lat"],
+                                                *args["grid"]))
+
+    if args["date"]:
+        fares = fm.load_cached_fare_matrix(cities, args["date"],
+                                           args["cache_dir"])
+        inst_city = np.array([cities.index(city)
+                              for city in institutes["city"]])
+    else:
+        fares = None
+        inst_city = None
+
+    with profiler.stage("build_cost_matrix",
+                        num_items=len(institutes["lon"]) * len(venues["lon"])):
+        cost = build_cost_matrix(institutes["lon"], institutes["lat"],
+                                 venues["lon"], venues["lat"],
+                                 args["cost_per_km"], fares, inst_city,
+                                 venues["city"])
+
+    with profiler.stage("optimize_venue", num_items=cost.size):
+        group_costs, total_costs, group_best, total_best = \
+            optimize_venue(cost, institutes["counts"])
+
+    for group_idx, group in enumerate(institutes["group_names"]):
+        best = group_best[group_idx]
+        print("The cheapest venue for {0} is {1} and costs {2:.2f}"
+              .format(group, venues["name"][best],
+                      group_costs[group_idx, best]))
+
+    print("The cheapest venue for everyone is {0} and costs {1:.2f}"
+          .format(venues["name"][total_best], total_costs[total_best]))
@@ -0,0 +1,476 @@
+#!/usr/bin:env python
+"""
+Times each stage of the pipeline on synthetic inputs (see ``synthetic.py``).
+
+The cases are:
+
+- ``convert_binary_to_hdf5``: ``lhalo_to_hdf5.convert_binary_to_hdf5`` on a
+  whole LHaloTree binary.
+- ``read_tree``: ``plot_merger_tree.read_tree`` of the last tree in the file.
+- ``scan_trees``: a full sequential scan with ``lhalo_io.iterate_trees``.
+- ``scan_trees_prefetch``: the same scan, reading ahead on a background
+  thread.
+- ``subsample_grid``: ``subsample.subsample_grid`` halving a double grid.
+- ``read_density_grid``: ``plot_density.read_binary_grid``, the read path of
+  ``plot_density_slice``.
+- ``hdf5_to_gadget``: ``hdf5_to_gadget.write_binary`` of one snapshot chunk.
+
+The inputs for each scale are generated once and reused by later runs.  The
+results (with the commit they were run on) are saved as JSON so runs on
+different commits can be compared with ``--compare``.
+"""
+from __future__ import print_function
+import numpy as np
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+import synthetic
+
+repo_dir = os.path.realpath("{0}/../".format(
+    os.path.dirname(os.path.realpath(__file__))))
+
+# The scripts aren't packages, so their directories go at the front of the
+# path (ahead of the empty ``lhalo_to_hdf5`` package at the top level).
+script_dirs = ["lhalo_to_hdf5", "merger_tree", "subsample_grid", "plot_grids",
+               "hdf5_to_gadget"]
+sys.path[:0] = ["{0}/{1}".format(repo_dir, name) for name in script_dirs]
+
+scales = OrderedDict([
+    ("small", {"num_trees": 200, "mean_halos": 100, "gridsize": 32,
+               "npart": [10**4, 10**5, 0, 0, 10**3, 0]}),
+    ("medium", {"num_trees": 2000, "mean_halos": 200, "gridsize": 128,
+                "npart": [10**5, 10**6, 0, 0, 10**4, 0]}),
+    ("large", {"num_trees": 10000, "mean_halos": 200, "gridsize": 256,
+               "npart": [10**6, 4 * 10**6, 0, 0, 10**5, 0]}),
+                      ])
+
+cases = ["convert_binary_to_hdf5", "read_tree", "scan_trees",
+         "scan_trees_prefetch", "subsample_grid", "read_density_grid",
+         "hdf5_to_gadget"]
+
+# ``hdf5_to_gadget.get_fname`` uses a flat directory from this snapshot on.
+snapshot_num = 66
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['scales']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-s", "--scales", dest="scales", nargs="+",
+                        help="Scales to run, any of {0}. Default: small."
+                        .format(list(scales.keys())), default=["small"],
+                        choices=list(scales.keys()))
+    parser.add_argument("-c", "--cases", dest="cases", nargs="+",
+                        help="Cases to time. Default: all.", default=cases,
+                        choices=cases)
+    parser.add_argument("-r", "--repeats", dest="repeats",
+                        help="Number of times each case is timed. Default: 3.",
+                        default=3, type=int)
+    parser.add_argument("-d", "--data_dir", dest="data_dir",
+                        help="Directory the synthetic inputs and outputs are "
+                        "written to. Default: './bench_data'.",
+                        default="./bench_data", type=str)
+    parser.add_argument("-o", "--fname_out", dest="fname_out",
+                        help="Save the results to this .json file. Default: "
+                        "'bench_<commit>.json'.", type=str)
+    parser.add_argument("--compare", dest="compare",
+                        help="Results .json file of an earlier run to compare "
+                        "against.", type=str)
+
+    args = parser.parse_args()
+
+    if args.repeats < 1:
+        print("The number of repeats must be at least 1.")
+        parser.print_help()
+        raise ValueError
+
+    return vars(args)
+
+
+def get_commit():
+    """
+    Gets the commit the repository is at.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    commit: String or None.
+        The short commit hash (with '-dirty' appended if there are uncommitted
+        changes), or None if it isn't a git repository.
+    """
+
+    try:
+        commit = subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], cwd=repo_dir,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return commit
+
+
+def make_inputs(scale, data_dir, seed=0):
+    """
+    Generates the synthetic inputs of a scale, unless they already exist.
+
+    Parameters
+    ----------
+
+    scale: String. Required.
+        One of the keys of ``scales``.
+
+    data_dir: String. Required.
+        Directory the inputs are written to.
+
+    seed: Integer. Optional, default 0.
+        Random seed.
+
+    Returns
+    ----------
+
+    inputs: Dictionary.
+        The ``scales`` settings plus the paths ``scale_dir``, ``trees``,
+        ``grid`` (double precision) and ``snapdir``.
+    """
+
+    settings = scales[scale]
+    scale_dir = "{0}/{1}".format(data_dir, scale)
+
+    inputs = dict(settings)
+    inputs["scale_dir"] = scale_dir
+    inputs["trees"] = "{0}/trees.dat".format(scale_dir)
+    inputs["grid"] = "{0}/grid.dat".format(scale_dir)
+    inputs["snapdir"] = "{0}/snapshots".format(scale_dir)
+
+    snapshot = "{0}/snapdir_{1:03d}/snapshot_{1:03d}.0.hdf5".format(
+        inputs["snapdir"], snapshot_num)
+
+    os.makedirs(os.path.dirname(snapshot), exist_ok=True)
+
+    if not os.path.exists(inputs["trees"]):
+        print("Generating {0}".format(inputs["trees"]))
+        synthetic.write_lhalo_binary(inputs["trees"], settings["num_trees"],
+                                     settings["mean_halos"], seed=seed)
+
+    if not os.path.exists(inputs["grid"]):
+        print("Generating {0}".format(inputs["grid"]))
+        synthetic.write_grid(inputs["grid"], settings["gridsize"], "double",
+                             seed=seed)
+
+    if not os.path.exists(snapshot):
+        print("Generating {0}".format(snapshot))
+        synthetic.write_snapshot(snapshot, settings["npart"], seed=seed)
+
+    return inputs
+
+
+def setup_case(case, inputs):
+    """
+    Prepares a case to be timed.
+
+    The script a case uses is only imported here, so a case whose
+    dependencies are missing can be skipped without stopping the others.
+
+    Parameters
+    ----------
+
+    case: String. Required.
+        One of ``cases``.
+
+    inputs: Dictionary. Required.
+        See ``make_inputs``.
+
+    Returns
+    ----------
+
+    run: Function.
+        Runs the case once.
+
+    num_items: Integer.
+        Number of items (trees, cells or particles) processed by one run.
+
+    nbytes: Integer.
+        Size of the input read by one run.
+    """
+
+    scale_dir = inputs["scale_dir"]
+
+    if case in ["convert_binary_to_hdf5", "read_tree", "scan_trees",
+                "scan_trees_prefetch"]:
+        from lhalo import lhalo_io
+
+        with open(inputs["trees"], "rb") as f_in:
+            NTrees, NHalos, NHalosPerTree = lhalo_io.read_header(f_in)
+
+        nbytes = os.path.getsize(inputs["trees"])
+
+    if case == "convert_binary_to_hdf5":
+        import lhalo_to_hdf5 as converter
+
+        args = {"fname_in": inputs["trees"],
+                "fname_out": "{0}/trees.hdf5".format(scale_dir)}
+
+        return (lambda: converter.convert_binary_to_hdf5(args)), NTrees, nbytes
+
+    if case == "read_tree":
+        import plot_merger_tree
+
+        tree_num = NTrees - 1
+        nbytes = int(NHalosPerTree[tree_num]) * \
+                 lhalo_io.get_LHalo_datastruct().itemsize
+
+        return (lambda: plot_merger_tree.read_tree(inputs["trees"], tree_num)), \
+               1, nbytes
+
+    if case in ["scan_trees", "scan_trees_prefetch"]:
+        prefetch = case == "scan_trees_prefetch"
+
+        def run():
+            for tree_idx, tree in lhalo_io.iterate_trees(inputs["trees"],
+                                                         prefetch=prefetch):
+                pass
+
+        return run, NTrees, nbytes
+
+    if case == "subsample_grid":
+        import subsample
+
+        args = {"fname_in": inputs["grid"],
+                "fname_out": "{0}/grid_subsampled.dat".format(scale_dir),
+                "precision": "double",
+                "gridsize_in": inputs["gridsize"],
+                "gridsize_out": inputs["gridsize"] // 2}
+
+        return (lambda: subsample.subsample_grid(args)), \
+               inputs["gridsize"]**3, os.path.getsize(inputs["grid"])
+
+    if case == "read_density_grid":
+        import plot_density
+
+        return (lambda: plot_density.read_binary_grid(inputs["grid"],
+                                                      inputs["gridsize"], 2)), \
+               inputs["gridsize"]**3, os.path.getsize(inputs["grid"])
+
+    if case == "hdf5_to_gadget":
+        import hdf5_to_gadget as converter
+
+        outdir = "{0}/gadget".format(scale_dir)
+        fname_in, fname_out = converter.get_fname(snapshot_num, 0,
+                                                  inputs["snapdir"], outdir)
+        os.makedirs(os.path.dirname(fname_out), exist_ok=True)
+
+        fields = ["Coordinates", "Velocities", "ParticleIDs", "Masses"]
+
+        return (lambda: converter.write_binary(snapshot_num, snapshot_num, 1,
+                                               inputs["snapdir"], outdir,
+                                               fields)), \
+               int(sum(inputs["npart"])), os.path.getsize(fname_in)
+
+    print("The case was {0}. The only accepted cases are {1}."
+          .format(case, cases))
+    raise ValueError
+
+
+def time_case(run, repeats):
+    """
+    Times a case.  Anything the case prints (including progress bars) is
+    discarded.
+
+    Parameters
+    ----------
+
+    run: Function. Required.
+        Runs the case once, see ``setup_case``.
+
+    repeats: Integer. Required.
+        Number of times the case is run.
+
+    Returns
+    ----------
+
+    times: List of floats.
+        Wall time (seconds) of each run.
+    """
+
+    times = []
+
+    with open(os.devnull, "w") as devnull, \
+         contextlib.redirect_stdout(devnull), \
+         contextlib.redirect_stderr(devnull):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+    return times
+
+
+def run_benchmarks(scale_list=["small"], case_list=cases, repeats=3,
+                   data_dir="./bench_data", seed=0):
+    """
+    Generates the inputs and times every case at every scale.
+
+    Parameters
+    ----------
+
+    scale_list: List of strings. Optional, default ["small"].
+        The scales to run, see ``scales``.
+
+    case_list: List of strings. Optional, default all ``cases``.
+        The cases to time.
+
+    repeats: Integer. Optional, default 3.
+        Number of times each case is timed.
+
+    data_dir: String. Optional, default "./bench_data".
+        Directory the inputs and outputs are written to.
+
+    seed: Integer. Optional, default 0.
+        Random seed for the inputs.
+
+    Returns
+    ----------
+
+    results: Dictionary.
+        Keyed by ``commit``, ``date``, ``python``, ``numpy``, ``repeats`` and
+        ``cases``.  Each entry of ``cases`` is keyed by ``case``, ``scale``,
+        ``num_items``, ``nbytes``, ``times``, ``best``, ``median``,
+        ``items_per_sec`` and ``MB_per_sec``; a case that couldn't run has
+        ``skipped`` set to the reason instead.
+    """
+
+    case_results = []
+
+    for scale in scale_list:
+        inputs = make_inputs(scale, data_dir, seed)
+
+        for case in case_list:
+            try:
+                run, num_items, nbytes = setup_case(case, inputs)
+            except ImportError as err:
+                print("Skipping {0} ({1}): {2}".format(case, scale, err))
+                case_results.append({"case": case, "scale": scale,
+                                     "skipped": str(err)})
+                continue
+
+            times = time_case(run, repeats)
+            best = min(times)
+
+            case_results.append({"case": case,
+                                 "scale": scale,
+                                 "num_items": int(num_items),
+                                 "nbytes": int(nbytes),
+                                 "times": times,
+                                 "best": best,
+                                 "median": float(np.median(times)),
+                                 "items_per_sec": num_items / best,
+                                 "MB_per_sec": nbytes / 1.0e6 / best})
+
+    results = {"commit": get_commit(),
+               "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(),
+               "numpy": np.__version__,
+               "repeats": repeats,
+               "cases": case_results}
+
+    return results
+
+
+def print_results(results, old_results=None):
+    """
+    Prints a summary table of the benchmarks.
+
+    Parameters
+    ----------
+
+    results: Dictionary. Required.
+        See ``run_benchmarks``.
+
+    old_results: Dictionary. Optional.
+        Results of an earlier run.  If specified, the speedup of each case
+        relative to it is printed as well.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    old_best = {}
+    if old_results is not None:
+        for result in old_results["cases"]:
+            if "best" in result:
+                old_best[(result["case"], result["scale"])] = result["best"]
+
+        print("Comparing {0} against {1}".format(results["commit"],
+                                                 old_results["commit"]))
+
+    print("{0:>24} {1:>8} {2:>10} {3:>10} {4:>14} {5:>9}"
+          .format("case", "scale", "best (s)", "MB/s", "items/s", "speedup"))
+
+    for result in results["cases"]:
+        if "skipped" in result:
+            print("{0:>24} {1:>8} skipped: {2}".format(result["case"],
+                                                       result["scale"],
+                                                       result["skipped"]))
+            continue
+
+        key = (result["case"], result["scale"])
+        if key in old_best:
+            speedup = "{0:.2f}x".format(old_best[key] / result["best"])
+        else:
+            speedup = "-"
+
+        print("{0:>24} {1:>8} {2:>10.4f} {3:>10.1f} {4:>14.1f} {5:>9}"
+              .format(result["case"], result["scale"], result["best"],
+                      result["MB_per_sec"], result["items_per_sec"], speedup))
+
+
+if __name__ == '__main__':
+
+    args = parse_inputs()
+
+    results = run_benchmarks(args["scales"], args["cases"], args["repeats"],
+                             args["data_dir"])
+
+    old_results = None
+    if args["compare"]:
+        with open(args["compare"], "r") as f:
+            old_results = json.load(f)
+
+    print_results(results, old_results)
+
+    fname_out = args["fname_out"]
+    if fname_out is None:
+        fname_out = "bench_{0}.json".format(results["commit"])
+
+    with open(fname_out, "w") as f:
+        json.dump(results, f, indent=4)
+    print("Saved results to {0}".format(fname_out))
@@ -0,0 +1,349 @@
+#!/usr/bin:env python
+"""
+Generators for synthetic inputs to the scripts in this repository.
+
+- LHaloTree binaries, with every tree having a valid pointer structure (see
+  ``make_tree``).
+- Cubic, Cartesian binary grids as read by ``subsample_grid`` and
+  ``plot_density``.
+- HDF5 particle snapshot chunks as read by ``hdf5_to_gadget``.
+
+Everything is drawn from a seeded ``np.random.RandomState`` so the same
+arguments always give the same files.
+"""
+from __future__ import print_function
+import numpy as np
+
+from lhalo import lhalo_io
+
+precision_dtypes = {"int": np.int32, "float": np.float32, "double": np.float64}
+
+
+def get_tree_sizes(num_trees, mean_halos, rng):
+    """
+    Draws the number of halos in each tree.
+
+    The sizes follow a geometric distribution so, as in real simulations, most
+    trees are small and a few are much larger than the mean.
+
+    Parameters
+    ----------
+
+    num_trees: Integer. Required.
+        Number of trees.
+
+    mean_halos: Float. Required.
+        Mean number of halos per tree.
+
+    rng: ``np.random.RandomState``. Required.
+        Random number generator.
+
+    Returns
+    ----------
+
+    NHalosPerTree: Array of integers.
+        Number of halos in each tree, all at least 1.
+    """
+
+    return rng.geometric(1.0 / max(mean_halos, 1.0), num_trees).astype(np.int32)
+
+
+def get_level_counts(num_halos, num_snaps):
+    """
+    Splits the halos of a tree across its snapshots.
+
+    Parameters
+    ----------
+
+    num_halos: Integer. Required.
+        Number of halos in the tree.
+
+    num_snaps: Integer. Required.
+        Maximum number of snapshots the tree spans.
+
+    Returns
+    ----------
+
+    counts: Array of integers.
+        Number of halos at each snapshot, starting at the root snapshot.  Every
+        entry is at least 1.
+    """
+
+    num_levels = min(num_snaps, num_halos)
+
+    counts = np.full(num_levels, num_halos // num_levels, dtype=np.int64)
+    counts[:num_halos % num_levels] += 1
+
+    return counts
+
+
+def make_tree(num_halos, rng, num_snaps=64, root_snap=63, fof_fraction=0.3,
+              first_id=0, boxsize=100.0):
+    """
+    Makes one LHaloTree tree with a valid pointer structure.
+
+    Halos are ordered by snapshot, starting with the root snapshot.  Every halo
+    at the root snapshot is in the FoF group of the first halo (the root halo).
+    Every other halo has a descendant at the snapshot after it; the
+    progenitors of each halo are consecutive and linked through
+    ``FirstProgenitor`` and ``NextProgenitor``.  Below the root snapshot each
+    halo starts a new FoF group with probability ``fof_fraction``, otherwise it
+    joins the group of the halo before it.
+
+    Parameters
+    ----------
+
+    num_halos: Integer. Required.
+        Number of halos in the tree.
+
+    rng: ``np.random.RandomState``. Required.
+        Random number generator.
+
+    num_snaps: Integer. Optional, default 64.
+        Maximum number of snapshots the tree spans.
+
+    root_snap: Integer. Optional, default 63.
+        Snapshot number of the root halo.
+
+    fof_fraction: Float. Optional, default 0.3.
+        Probability a halo below the root snapshot starts a new FoF group.
+
+    first_id: Integer. Optional, default 0.
+        ``MostBoundID`` of the first halo.  The others follow on from it.
+
+    boxsize: Float. Optional, default 100.0.
+        Halo positions are drawn uniformly inside this box.
+
+    Returns
+    ----------
+
+    tree: LHalo structured array, see ``lhalo_io.get_LHalo_datastruct``.
+        The tree.
+    """
+
+    LHalo_struct = lhalo_io.get_LHalo_datastruct()
+    tree = np.zeros(num_halos, dtype=LHalo_struct)
+
+    counts = get_level_counts(num_halos, num_snaps)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    level = np.repeat(np.arange(len(counts)), counts)
+    idx = np.arange(num_halos)
+
+    # Each halo below the root snapshot picks a descendant at the snapshot
+    # after it.  Sorting within each snapshot keeps progenitors consecutive.
+    desc = np.full(num_halos, -1, dtype=np.int64)
+    below = level > 0
+    desc[below] = offsets[level[below] - 1] + \
+                  (rng.random_sample(below.sum()) *
+                   counts[level[below] - 1]).astype(np.int64)
+    desc[below] = np.sort(desc[below])
+
+    next_prog = np.full(num_halos, -1, dtype=np.int64)
+    same_desc = below[1:] & (desc[1:] == desc[:-1])
+    next_prog[:-1][same_desc] = idx[1:][same_desc]
+
+    first_prog = np.full(num_halos, -1, dtype=np.int64)
+    descendants, first = np.unique(desc[below], return_index=True)
+    first_prog[descendants] = idx[below][first]
+
+    # FoF groups are runs of halos at the same snapshot.
+    starts = rng.random_sample(num_halos) < fof_fraction
+    starts[offsets[:-1]] = True
+    starts[level == 0] = False
+    starts[0] = True
+    first_in_fof = np.maximum.accumulate(np.where(starts, idx, 0))
+
+    next_in_fof = np.full(num_halos, -1, dtype=np.int64)
+    same_fof = first_in_fof[1:] == first_in_fof[:-1]
+    next_in_fof[:-1][same_fof] = idx[1:][same_fof]
+
+    tree["Descendant"] = desc
+    tree["FirstProgenitor"] = first_prog
+    tree["NextProgenitor"] = next_prog
+    tree["FirstHaloInFOFgroup"] = first_in_fof
+    tree["NextHaloInFOFgroup"] = next_in_fof
+    tree["SnapNum"] = root_snap - level
+    tree["SubHaloIndex"] = idx - first_in_fof
+
+    tree["Len"] = 20 + rng.geometric(0.01, num_halos)
+    tree["Mvir"] = tree["Len"] * 1.0e-3
+    tree["M_mean200"] = tree["Mvir"]
+    tree["M_TopHat"] = tree["Mvir"]
+    tree["Pos"] = rng.uniform(0.0, boxsize, (num_halos, 3))
+    tree["Vel"] = rng.normal(0.0, 100.0, (num_halos, 3))
+    tree["VelDisp"] = np.abs(rng.normal(50.0, 10.0, num_halos))
+    tree["Vmax"] = tree["VelDisp"] * 1.5
+    tree["Spin"] = rng.normal(0.0, 0.05, (num_halos, 3))
+    tree["MostBoundID"] = first_id + idx
+    tree["SubHalfMass"] = tree["Mvir"] * 0.5
+
+    return tree
+
+
+def write_lhalo_binary(tree_path, num_trees, mean_halos, num_snaps=64,
+                       root_snap=63, seed=0):
+    """
+    Writes a synthetic LHaloTree binary file.
+
+    Parameters
+    ----------
+
+    tree_path: String. Required.
+        Path to the binary file.
+
+    num_trees: Integer. Required.
+        Number of trees.
+
+    mean_halos: Float. Required.
+        Mean number of halos per tree, see ``get_tree_sizes``.
+
+    num_snaps, root_snap: Integers. Optional, default 64 and 63.
+        See ``make_tree``.
+
+    seed: Integer. Optional, default 0.
+        Random seed.
+
+    Returns
+    ----------
+
+    NHalosPerTree: Array of integers.
+        Number of halos in each tree.
+    """
+
+    rng = np.random.RandomState(seed)
+    NHalosPerTree = get_tree_sizes(num_trees, mean_halos, rng)
+
+    # The trees are written one at a time so large files don't have to fit in
+    # memory.
+    with open(tree_path, "wb") as f_out:
+        lhalo_io.write_header(f_out, NHalosPerTree)
+
+        first_id = 0
+        for num_halos in NHalosPerTree:
+            tree = make_tree(num_halos, rng, num_snaps, root_snap,
+                             first_id=first_id)
+            tree.tofile(f_out)
+            first_id += num_halos
+
+    return NHalosPerTree
+
+
+def write_grid(fname, gridsize, precision="float", seed=0):
+    """
+    Writes a synthetic cubic, Cartesian binary grid.
+
+    The cells are drawn from a log-normal distribution with a mean of 1, like
+    an overdensity field.  The grid is written one slab at a time.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Path to the grid file.
+
+    gridsize: Integer. Required.
+        Number of cells along one dimension.
+
+    precision: String. Optional, default "float".
+        One of "int", "float" or "double".
+
+    seed: Integer. Optional, default 0.
+        Random seed.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    if precision not in precision_dtypes:
+        print("The precision was {0}. The only accepted values are {1}."
+              .format(precision, list(precision_dtypes.keys())))
+        raise ValueError
+
+    rng = np.random.RandomState(seed)
+    dtype = precision_dtypes[precision]
+
+    with open(fname, "wb") as f_out:
+        for slab in range(gridsize):
+            cells = rng.lognormal(-0.5, 1.0, (gridsize, gridsize))
+            if precision == "int":
+                cells = np.round(cells * 10.0)
+            cells.astype(dtype).tofile(f_out)
+
+
+def write_snapshot(fname, npart, seed=0, block_size=2**20):
+    """
+    Writes a synthetic HDF5 snapshot chunk.
+
+    Every type with particles gets ``Coordinates``, ``Velocities`` and
+    ``ParticleIDs``.  Only the gas (type 0) has ``Masses``; the other types use
+    the mass table.  The datasets are filled ``block_size`` particles at a
+    time.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Path to the snapshot chunk.
+
+    npart: List of integers. Required.
+        Number of particles of each of the six types.
+
+    seed: Integer. Optional, default 0.
+        Random seed.
+
+    block_size: Integer. Optional, default 2**20.
+        Number of particles generated at a time.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    import h5py
+
+    rng = np.random.RandomState(seed)
+
+    with h5py.File(fname, "w") as f:
+        header = f.create_group("Header")
+        header.attrs["NumPart_ThisFile"] = np.array(npart, dtype=np.uint32)
+        header.attrs["NumPart_Total"] = np.array(npart, dtype=np.uint32)
+        header.attrs["NumPart_Total_HighWord"] = np.zeros(6, dtype=np.uint32)
+        header.attrs["MassTable"] = np.array([0.0, 0.5, 0.0, 0.0, 0.1, 0.0])
+        header.attrs["Time"] = 0.5
+        header.attrs["Redshift"] = 1.0
+        header.attrs["BoxSize"] = 100.0
+        header.attrs["Omega0"] = 0.302
+        header.attrs["OmegaLambda"] = 0.698
+        header.attrs["HubbleParam"] = 0.681
+        header.attrs["NumFilesPerSnapshot"] = 1
+        for flag in ["Flag_Sfr", "Flag_Feedback", "Flag_Cooling",
+                     "Flag_StellarAge", "Flag_Metals"]:
+            header.attrs[flag] = 0
+
+        offset = 0
+        for part_type in range(6):
+            num = npart[part_type]
+            if num == 0:
+                continue
+
+            group = f.create_group("PartType{0}".format(part_type))
+            pos = group.create_dataset("Coordinates", (num, 3), dtype=np.float64)
+            vel = group.create_dataset("Velocities", (num, 3), dtype=np.float64)
+            ids = group.create_dataset("ParticleIDs", (num,), dtype=np.uint64)
+            if part_type == 0:
+                mass = group.create_dataset("Masses", (num,), dtype=np.float64)
+
+            for start in range(0, num, block_size):
+                end = min(start + block_size, num)
+
+                pos[start:end] = rng.uniform(0.0, 100.0, (end - start, 3))
+                vel[start:end] = rng.normal(0.0, 100.0, (end - start, 3))
+                ids[start:end] = np.arange(offset + start, offset + end,
+                                           dtype=np.uint64)
+                if part_type == 0:
+                    mass[start:end] = rng.uniform(0.1, 1.0, end - start)
+
+            offset += num
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import numpy as np
+import sys
+import os
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+
+import synthetic
+from lhalo import lhalo_io
+
+
+def check_pointers(tree):
+    """
+    Checks the pointers of a tree are consistent.
+
+    Parameters
+    ----------
+
+    tree: LHalo structured array. Required.
+        The tree.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    num_halos = len(tree)
+    idx = np.arange(num_halos)
+
+    for field in ["Descendant", "FirstProgenitor", "NextProgenitor",
+                  "FirstHaloInFOFgroup", "NextHaloInFOFgroup"]:
+        pointers = tree[field]
+        if np.any((pointers < -1) | (pointers >= num_halos)):
+            print("The {0} of a halo points outside the tree.".format(field))
+            pytest.fail()
+
+    if tree["Descendant"][0] != -1 or tree["FirstHaloInFOFgroup"][0] != 0:
+        print("The first halo isn't the root halo.")
+        pytest.fail()
+
+    # Walking each halo's progenitors must visit exactly the halos that have
+    # it as their descendant.
+    for halo_idx in idx:
+        progenitors = []
+        prog = tree["FirstProgenitor"][halo_idx]
+        while prog != -1:
+            progenitors.append(prog)
+            prog = tree["NextProgenitor"][prog]
+
+        expected = idx[tree["Descendant"] == halo_idx]
+        if sorted(progenitors) != list(expected):
+            print("Halo {0} has progenitors {1} but {2} have it as their "
+                  "descendant.".format(halo_idx, progenitors, expected))
+            pytest.fail()
+
+        desc = tree["Descendant"][halo_idx]
+        if desc != -1 and tree["SnapNum"][desc] != tree["SnapNum"][halo_idx] + 1:
+            print("Halo {0} isn't at the snapshot before its descendant."
+                  .format(halo_idx))
+            pytest.fail()
+
+        first_in_fof = tree["FirstHaloInFOFgroup"][halo_idx]
+        if tree["SnapNum"][first_in_fof] != tree["SnapNum"][halo_idx]:
+            print("Halo {0} is in a FoF group at another snapshot."
+                  .format(halo_idx))
+            pytest.fail()
+
+
+def test_trees(tmpdir):
+    """
+    Checks the synthetic trees have valid pointers and are read back
+    correctly.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    tree_path = str(tmpdir.join("trees.dat"))
+    NHalosPerTree = synthetic.write_lhalo_binary(tree_path, 20, 50, seed=1)
+
+    num_trees = 0
+    for tree_idx, tree in lhalo_io.iterate_trees(tree_path):
+        if len(tree) != NHalosPerTree[tree_idx]:
+            print("Tree {0} has {1} halos but the header says {2}."
+                  .format(tree_idx, len(tree), NHalosPerTree[tree_idx]))
+            pytest.fail()
+
+        check_pointers(tree)
+        num_trees += 1
+
+    if num_trees != 20:
+        print("{0} trees were read but 20 were written.".format(num_trees))
+        pytest.fail()
+
+
+def test_grid(tmpdir):
+    """
+    Checks the synthetic grids have the size the readers expect.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    for precision, itemsize in [("int", 4), ("float", 4), ("double", 8)]:
+        fname = str(tmpdir.join("grid_{0}.dat".format(precision)))
+        synthetic.write_grid(fname, 8, precision)
+
+        if os.path.getsize(fname) != 8**3 * itemsize:
+            print("The {0} grid is {1} bytes but should be {2}."
+                  .format(precision, os.path.getsize(fname), 8**3 * itemsize))
+            pytest.fail()
+
+    with pytest.raises(ValueError):
+        synthetic.write_grid(fname, 8, "half")
+
+
+if __name__ == "__main__":
+
+    pytest.main([__file__])
@@ -0,0 +1,8 @@
+"""
+Lets the tests import the shared ``lhalo`` and ``instrument`` packages
+without installing them first (see ``setup.py``).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
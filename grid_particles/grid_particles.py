@@ -0,0 +1,404 @@
+#!/usr/bin:env python
+from __future__ import print_function
+import numpy as np
+import argparse
+import threading
+from collections import OrderedDict
+import h5py
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    If there has not been an input or output file specified a ValueError will
+    be raised.
+
+    The only accepted arguments for `precision` is "float" or "double" and for
+    `scheme` "ngp", "cic" or "tsc"; any other input will raise a ValueError.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['fname_in']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-f", "--fname_in", dest="fname_in", nargs="+",
+                        help="Path to the input HDF5 snapshot chunk(s). "
+                        "Required.")
+    parser.add_argument("-o", "--fname_out", dest="fname_out",
+                        help="Path to the output grid file. Required.")
+    parser.add_argument("-s", "--gridsize", dest="gridsize",
+                        help="Size of the grid (i.e., number of cells per "
+                             "dimension). Required.", type=int)
+    parser.add_argument("-k", "--scheme", dest="scheme",
+                        help="Mass assignment scheme. Accepted values are "
+                        "'ngp', 'cic' and 'tsc'. Default: 'cic'.",
+                        default="cic")
+    parser.add_argument("-p", "--precision", dest="precision",
+                        help="Precision of the output grid. Accepted values "
+                        "are 'float' and 'double'. Default: 'double'.",
+                        default="double")
+    parser.add_argument("-t", "--num_threads", dest="num_threads",
+                        help="Number of threads, each with a private grid "
+                        "(memory scales with NUM_THREADS * GRIDSIZE^3). "
+                        "Default: 1.", default=1, type=int)
+    parser.add_argument("-b", "--block_size", dest="block_size",
+                        help="Number of particles read per block. "
+                        "Default: 1048576.", default=2**20, type=int)
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.fname_in is None or args.fname_out is None:
+        print("Both an input and output filepath is required.")
+        parser.print_help()
+        raise ValueError
+
+    if args.gridsize is None:
+        print("A gridsize is required.")
+        parser.print_help()
+        raise ValueError
+
+    if args.precision not in ["float", "double"]:
+        print("The only accepted precision options are 'float' or 'double' "
+              "(don't use apostrophes).")
+        parser.print_help()
+        raise ValueError
+
+    if args.scheme not in ["ngp", "cic", "tsc"]:
+        print("The only accepted mass assignment schemes are 'ngp', 'cic' or "
+              "'tsc' (don't use apostrophes).")
+        parser.print_help()
+        raise ValueError
+
+    # Print some useful startup info. #
+    print("")
+    print("======================================")
+    print("Input snapshot(s): {0}".format(args.fname_in))
+    print("Output grid: {0}".format(args.fname_out))
+    print("Gridsize: {0}".format(args.gridsize))
+    print("Scheme: {0}".format(args.scheme))
+    print("Precision: {0}".format(args.precision))
+    print("======================================")
+    print("")
+
+    return vars(args)
+
+
+def get_kernel_weights(pos, scheme, gridsize):
+    """
+    Computes the cells and weights a set of particles is assigned to along
+    one axis.
+
+    Cell ``i`` spans ``[i, i+1)`` in grid units.  Indices are wrapped
+    periodically.
+
+    Parameters
+    ----------
+
+    pos: 1D array of floats. Required.
+        Particle positions along the axis in grid units, i.e., in [0,
+        gridsize).
+
+    scheme: String. Required.
+        Mass assignment scheme, one of "ngp", "cic" or "tsc".
+
+    gridsize: Integer. Required.
+        Number of cells along the axis.
+
+    Returns
+    ----------
+
+    indices: 2D array of integers, shape (len(pos), M).
+        The cells each particle contributes to.  M is 1, 2 or 3 for NGP, CIC
+        and TSC respectively.
+
+    weights: 2D array of floats, shape (len(pos), M).
+        The fraction of each particle assigned to each cell.  Each row sums to
+        1.
+    """
+
+    if scheme == "ngp":
+        cell = np.floor(pos).astype(np.int64)
+        indices = cell[:, None]
+        weights = np.ones((len(pos), 1))
+
+    elif scheme == "cic":
+        # Distance from the centre of the cell to the left of the particle.
+        shifted = pos - 0.5
+        cell = np.floor(shifted).astype(np.int64)
+        dist = shifted - cell
+
+        indices = np.stack([cell, cell + 1], axis=1)
+        weights = np.stack([1.0 - dist, dist], axis=1)
+
+    elif scheme == "tsc":
+        # Distance from the centre of the host cell, in [-0.5, 0.5).
+        cell = np.floor(pos).astype(np.int64)
+        dist = pos - cell - 0.5
+
+        indices = np.stack([cell - 1, cell, cell + 1], axis=1)
+        weights = np.stack([0.5 * (0.5 - dist)**2,
+                            0.75 - dist**2,
+                            0.5 * (0.5 + dist)**2], axis=1)
+
+    else:
+        print("The mass assignment scheme was {0}".format(scheme))
+        print("Currently I only support 'ngp', 'cic' or 'tsc'.")
+        raise ValueError
+
+    indices %= gridsize
+
+    return indices, weights
+
+
+def deposit_particles(grid, pos, scheme):
+    """
+    Adds particles onto a flattened cubic grid.
+
+    The contributions are summed with ``np.bincount``, which releases the GIL
+    so threads depositing onto their own grids run in parallel.  Each call
+    only counts over the range of cells the particles touch, so the temporary
+    array is at most the size of the grid and usually much smaller.
+
+    Parameters
+    ----------
+
+    grid: 1D array of floats, length gridsize**3. Required.
+        The grid being deposited onto.  Cell (i, j, k) is element
+        ``(i * gridsize + j) * gridsize + k``.
+
+    pos: 2D array of floats, shape (N, 3). Required.
+        Particle positions in grid units.
+
+    scheme: String. Required.
+        Mass assignment scheme, one of "ngp", "cic" or "tsc".
+
+    Returns
+    ----------
+
+    None.  ``grid`` is updated in place.
+    """
+
+    if len(pos) == 0:
+        return
+
+    gridsize = int(round(len(grid) ** (1.0 / 3.0)))
+
+    ix, wx = get_kernel_weights(pos[:, 0], scheme, gridsize)
+    iy, wy = get_kernel_weights(pos[:, 1], scheme, gridsize)
+    iz, wz = get_kernel_weights(pos[:, 2], scheme, gridsize)
+
+    # One ``bincount`` per x-offset covers the M^2 (y, z) offsets at once.
+    # Doing all M^3 together would need ~27 * 16 bytes per particle for TSC.
+    flat_yz = (iy[:, :, None] * gridsize + iz[:, None, :]).reshape(len(pos), -1)
+    weight_yz = (wy[:, :, None] * wz[:, None, :]).reshape(len(pos), -1)
+
+    num_cells = ix.shape[1]
+    for a in range(num_cells):
+        flat = (ix[:, a, None] * gridsize * gridsize + flat_yz).ravel()
+        weights = (wx[:, a, None] * weight_yz).ravel()
+
+        lo = flat.min()
+        counts = np.bincount(flat - lo, weights)
+        grid[lo:lo + len(counts)] += counts
+
+
+def get_work(fnames, block_size, part_type=1):
+    """
+    Splits the snapshot chunks into blocks of particles.
+
+    Parameters
+    ----------
+
+    fnames: List of strings. Required.
+        Paths to the HDF5 snapshot chunks.
+
+    block_size: Integer. Required.
+        Maximum number of particles per block.
+
+    part_type: Integer. Optional, default 1.
+        Particle type being gridded.
+
+    Returns
+    ----------
+
+    work: List of tuples.
+        ``(fname, start, end)`` particle ranges.
+
+    boxsize: Float.
+        Side length of the simulation box, from the first chunk's header.
+    """
+
+    work = []
+    boxsize = None
+
+    for fname in fnames:
+        with h5py.File(fname, "r") as f_in:
+            if boxsize is None:
+                boxsize = float(f_in["Header"].attrs["BoxSize"])
+
+            npart = int(f_in["Header"].attrs["NumPart_ThisFile"][part_type])
+
+        for start in range(0, npart, block_size):
+            work.append((fname, start, min(start + block_size, npart)))
+
+    return work, boxsize
+
+
+def grid_worker(work, grid, boxsize, scheme, block_size, part_type=1):
+    """
+    Deposits a list of particle blocks onto a thread-private grid.
+
+    Each chunk is opened once and its blocks are read with ``read_direct``
+    into a single reusable buffer so memory usage does not depend on the
+    number of particles.
+
+    Parameters
+    ----------
+
+    work: List of tuples. Required.
+        ``(fname, start, end)`` particle ranges, see ``get_work``.
+
+    grid: 1D array of floats. Required.
+        The private grid for this thread.
+
+    boxsize: Float. Required.
+        Side length of the simulation box (same units as the coordinates).
+
+    scheme: String. Required.
+        Mass assignment scheme, one of "ngp", "cic" or "tsc".
+
+    block_size: Integer. Required.
+        Maximum number of particles per block.
+
+    part_type: Integer. Optional, default 1.
+        Particle type being gridded.
+
+    Returns
+    ----------
+
+    None.  ``grid`` is updated in place.
+    """
+
+    gridsize = int(round(len(grid) ** (1.0 / 3.0)))
+    buf = np.empty((block_size, 3), dtype=np.float64)
+
+    # Group the blocks by chunk so each chunk is opened once and its blocks
+    # are read in order.
+    blocks_by_fname = OrderedDict()
+    for (fname, start, end) in work:
+        blocks_by_fname.setdefault(fname, []).append((start, end))
+
+    for fname, blocks in blocks_by_fname.items():
+        with h5py.File(fname, "r") as f_in:
+            dataset = f_in["PartType{0}".format(part_type)]["Coordinates"]
+
+            for (start, end) in sorted(blocks):
+                count = end - start
+                dataset.read_direct(buf, source_sel=np.s_[start:end],
+                                    dest_sel=np.s_[0:count])
+
+                pos = buf[:count]
+                pos *= gridsize / boxsize
+                np.mod(pos, gridsize, out=pos)
+
+                deposit_particles(grid, pos, scheme)
+
+
+def grid_particles(args):
+    """
+    Deposits the particles of HDF5 snapshot chunks onto a cubic grid.
+
+    The particle blocks are split into ``num_threads`` contiguous runs, so a
+    thread reads each chunk in one pass.  Each thread deposits onto its own
+    private grid and the grids are summed at the end.  The grids dominate
+    memory usage: ``num_threads * gridsize**3 * 8`` bytes, plus one more grid
+    of temporaries per thread at worst while depositing.  The final grid is
+    normalized by its mean, i.e., it holds rho/<rho>.
+
+    Parameters
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['fname_in']).
+        Contains paths, gridsize, scheme, precision and threading options.
+
+    Returns
+    ----------
+
+    None. The grid will be saved to the path specified by args['fname_out']
+    in the same layout as read by ``subsample_grid.read_grid``.
+    """
+
+    gridsize = args["gridsize"]
+    block_size = args["block_size"]
+    num_threads = max(args["num_threads"], 1)
+
+    with profiler.stage("get_work", num_items=len(args["fname_in"])):
+        work, boxsize = get_work(args["fname_in"], block_size)
+
+    grids = [np.zeros(gridsize**3, dtype=np.float64)
+             for thread_idx in range(num_threads)]
+
+    num_particles = sum(end - start for (fname, start, end) in work)
+
+    # Contiguous runs of blocks rather than round-robin keep the blocks of
+    # each chunk with as few threads as possible.
+    bounds = np.linspace(0, len(work), num_threads + 1).astype(int)
+    work_split = [work[bounds[idx]:bounds[idx + 1]]
+                  for idx in range(num_threads)]
+
+    with profiler.stage("deposit", num_items=num_particles,
+                        bytes_read=num_particles * 3 * 8):
+        threads = []
+        for thread_idx in range(num_threads):
+            thread = threading.Thread(target=grid_worker,
+                                      args=(work_split[thread_idx],
+                                            grids[thread_idx], boxsize,
+                                            args["scheme"], block_size))
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+    print("Particles deposited, now reducing the {0} private grids."
+          .format(num_threads))
+
+    with profiler.stage("reduce", num_items=num_threads * gridsize**3):
+        grid = grids[0]
+        for thread_grid in grids[1:]:
+            grid += thread_grid
+
+        mean = np.mean(grid)
+        if mean > 0.0:
+            grid /= mean
+
+        if args["precision"] == "float":
+            grid = grid.astype(np.float32)
+
+    with profiler.stage("write_grid", num_items=grid.size,
+                        bytes_written=grid.nbytes):
+        grid.tofile(args["fname_out"])
+    print("Grid saved to {0}".format(args["fname_out"]))
+
+if __name__ == '__main__':
+
+    args = parse_inputs()
+    enable_from_args(args, "grid_particles")
+    grid_particles(args)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import numpy as np
+import sys
+import os
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+sys.path.append("{0}/../../subsample_grid/".format(test_dir))
+sys.path.append("{0}/../../benchmarks/".format(test_dir))
+
+import grid_particles
+import subsample
+import synthetic
+
+
+def test_mass_conservation():
+    """
+    Checks every scheme deposits the whole mass of the particles, including
+    particles near the edges of the box.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    gridsize = 8
+    rng = np.random.RandomState(0)
+    pos = rng.uniform(0.0, gridsize, (1000, 3))
+    pos[:10] = gridsize - 1.0e-6
+    pos[10:20] = 0.0
+
+    for scheme in ["ngp", "cic", "tsc"]:
+        grid = np.zeros(gridsize**3)
+        grid_particles.deposit_particles(grid, pos, scheme)
+
+        if not np.isclose(grid.sum(), len(pos)) or grid.min() < 0.0:
+            print("The {0} grid holds a mass of {1} (minimum cell {2}) but "
+                  "{3} particles were deposited."
+                  .format(scheme, grid.sum(), grid.min(), len(pos)))
+            pytest.fail()
+
+
+def test_periodic_wrap():
+    """
+    Checks a CIC particle just inside the edge of the box is shared with the
+    cell on the opposite side.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    gridsize = 4
+    grid = np.zeros(gridsize**3)
+
+    # 0.4 cells from the centre of the last cell, 0.6 from the (wrapped)
+    # centre of the first.
+    pos = np.array([[1.5, 1.5, gridsize - 0.1]])
+    grid_particles.deposit_particles(grid, pos, "cic")
+    grid.shape = (gridsize, gridsize, gridsize)
+
+    expected = np.zeros((gridsize, gridsize, gridsize))
+    expected[1, 1, gridsize - 1] = 0.6
+    expected[1, 1, 0] = 0.4
+
+    if not np.allclose(grid, expected):
+        print("The wrapped cells were {0} and {1} but should be 0.6 and 0.4."
+              .format(grid[1, 1, gridsize - 1], grid[1, 1, 0]))
+        pytest.fail()
+
+
+def test_cell_centre_weights():
+    """
+    Checks the CIC and TSC weights of a particle at the centre of a cell.
+
+    CIC puts all the mass in the host cell.  TSC puts 3/4 in the host cell and
+    1/8 in each neighbour along each axis.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    gridsize = 5
+    pos = np.array([[2.5, 2.5, 2.5]])
+
+    kernels = {"cic": np.array([0.0, 1.0, 0.0]),
+               "tsc": np.array([0.125, 0.75, 0.125])}
+
+    for scheme, kernel in kernels.items():
+        grid = np.zeros(gridsize**3)
+        grid_particles.deposit_particles(grid, pos, scheme)
+        grid.shape = (gridsize, gridsize, gridsize)
+
+        expected = np.zeros((gridsize, gridsize, gridsize))
+        expected[1:4, 1:4, 1:4] = kernel[:, None, None] * \
+                                  kernel[None, :, None] * \
+                                  kernel[None, None, :]
+
+        if not np.allclose(grid, expected):
+            print("The {0} weights around the host cell were {1} but should "
+                  "be {2}.".format(scheme, grid[1:4, 1:4, 1:4],
+                                   expected[1:4, 1:4, 1:4]))
+            pytest.fail()
+
+
+def test_grid_roundtrip(tmpdir):
+    """
+    Checks the saved grid is read back by ``subsample_grid.read_grid`` and
+    doesn't depend on the number of threads.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    gridsize = 8
+    fnames = []
+    for chunk in range(2):
+        fname = str(tmpdir.join("snapshot_000.{0}.hdf5".format(chunk)))
+        synthetic.write_snapshot(fname, [0, 500 + chunk * 100, 0, 0, 0, 0],
+                                 seed=chunk)
+        fnames.append(fname)
+
+    grids = []
+    for num_threads in [1, 2]:
+        fname_out = str(tmpdir.join("grid_{0}.dat".format(num_threads)))
+        args = {"fname_in": fnames, "fname_out": fname_out,
+                "gridsize": gridsize, "scheme": "tsc", "precision": "float",
+                "num_threads": num_threads, "block_size": 128}
+        grid_particles.grid_particles(args)
+
+        grid = subsample.read_grid(fname_out, gridsize, "float")
+        grids.append(grid)
+
+        if grid.shape != (gridsize, gridsize, gridsize) or \
+           not np.isclose(np.mean(grid), 1.0):
+            print("The grid read back has shape {0} and mean {1}."
+                  .format(grid.shape, np.mean(grid)))
+            pytest.fail()
+
+    if not np.allclose(grids[0], grids[1], rtol=1.0e-6):
+        print("The grids made with 1 and 2 threads differ.")
+        pytest.fail()
+
+
+if __name__ == "__main__":
+
+    pytest.main([__file__])
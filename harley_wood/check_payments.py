@@ -3,6 +3,20 @@ from __future__ import print_function
 import numpy as np
 import csv
 import argparse
+import hashlib
+import io
+import json
+import os
+from collections import OrderedDict
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+# Column of each field in the registration export.
+csv_columns = OrderedDict([("name", 0), ("institution", 1), ("gender", 2),
+                           ("event", 3), ("email", 4), ("paid", 6),
+                           ("payID", 7)])
+
 
 def parse_inputs():
     """
@@ -28,11 +42,22 @@ def parse_inputs():
 
     parser.add_argument("-f", "--fname_in", dest="fname_in",
                         help="Path to the input csv data file. Required.")
+    parser.add_argument("-s", "--state_file", dest="state_file",
+                        help="Path to the state file for incremental runs. "
+                        "Only registrations that are new or changed since "
+                        "the last run are read, and the output files are "
+                        "only rewritten if something changed. Default: read "
+                        "the whole export every run.")
+    parser.add_argument("-o", "--out_dir", dest="out_dir",
+                        help="Directory the output csv files are written to. "
+                        "Default: '.'", default=".")
+
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
 
     # We require an input file and an output one.
-    if args.fname_in is None: 
+    if args.fname_in is None:
         parser.print_help()
         raise RuntimeError
 
@@ -44,16 +69,313 @@ def parse_inputs():
     return vars(args)
 
 
-def check_payments(args):
+def build_table(rows):
+    """
+    Converts registration rows into columns.
+
+    Parameters
+    ----------
+
+    rows: List of lists of strings. Required.
+        The rows of the registration export.
+
+    Returns
+    ----------
+
+    table: Dictionary of arrays.
+        One entry per row, keyed by ``name``, ``institution``, ``gender``,
+        ``event``, ``email`` and ``payID`` (strings), ``paid`` (True if the
+        payment column says "True") and ``attending`` (True if the event is
+        HWSA).
+    """
+
+    if rows:
+        columns = list(zip(*rows))
+    else:
+        columns = [()] * (max(csv_columns.values()) + 1)
+
+    table = {}
+    for key, col in csv_columns.items():
+        table[key] = np.array(columns[col], dtype=str)
+
+    table["attending"] = np.char.find(table["event"], "HWSA") >= 0
+    table["paid"] = np.char.find(table["paid"], "True") >= 0
+
+    return table
+
+
+def read_registrations(fname):
+    """
+    Reads the registration export into columns in a single pass.
+
+    Repeated registrations are merged, see ``dedupe_rows``.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Path to the registration csv file.
+
+    Returns
+    ----------
+
+    table: Dictionary of arrays.
+        See ``build_table``.
+    """
+
+    with open(fname, 'r') as f:
+        registrations = dedupe_rows(csv.reader(f))
+
+    return build_table(list(registrations.values()))
+
+
+def dedupe_rows(rows, registrations=None):
+    """
+    Keys registrations by ``get_row_key``, merging repeated ones.
+
+    If a person is registered for an event more than once the last row is
+    kept, in the place of the first, and a warning is printed.  Both the full
+    and the incremental reads go through this so they agree.
+
+    Parameters
+    ----------
+
+    rows: Iterable of lists of strings. Required.
+        Rows of the registration export.  Empty rows are skipped.
+
+    registrations: ``OrderedDict``. Optional.
+        Registrations already read, e.g. from an earlier run.  Updated in
+        place.  Default: start from none.
+
+    Returns
+    ----------
+
+    registrations: ``OrderedDict``.
+        The rows keyed by ``get_row_key``.
+    """
+
+    if registrations is None:
+        registrations = OrderedDict()
+
+    for row in rows:
+        if not row:
+            continue
+
+        key = get_row_key(row)
+        if key in registrations:
+            print("{0} is registered for {1} more than once; keeping the "
+                  "last row.".format(row[csv_columns["email"]],
+                                     row[csv_columns["event"]]))
+
+        registrations[key] = row
+
+    return registrations
+
+
+def get_row_key(row):
+    """
+    Gets the key a registration is tracked by between runs.
+
+    Parameters
+    ----------
+
+    row: List of strings. Required.
+        A row of the registration export.
+
+    Returns
+    ----------
+
+    key: String.
+        The email and the event of the registration.  The payID isn't used as
+        one group payment covers several people (and one person can register
+        before paying), so it's only kept as a field of the row.
+    """
+
+    return "{0}|{1}".format(row[csv_columns["email"]].strip().lower(),
+                            row[csv_columns["event"]])
+
+
+def load_state(fname):
+    """
+    Loads the state saved by the previous incremental run.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Path to the state file.  If it doesn't exist an empty state is
+        returned.
+
+    Returns
+    ----------
+
+    state: Dictionary.
+        Keyed by ``nbytes`` and ``md5`` (size and checksum of the export read
+        last time) and ``rows`` (``OrderedDict`` of the registrations keyed by
+        ``get_row_key``).
+    """
+
+    if not os.path.exists(fname):
+        return {"nbytes": 0, "md5": hashlib.md5().hexdigest(),
+                "rows": OrderedDict()}
+
+    with open(fname, "r") as f:
+        state = json.load(f, object_pairs_hook=OrderedDict)
+
+    return state
+
+
+def save_state(state, fname):
+    """
+    Saves the state for the next incremental run.
+
+    The file is written to a temporary name first so an interrupted run
+    never leaves a partial state behind.
+
+    Parameters
+    ----------
+
+    state: Dictionary. Required.
+        See ``load_state``.
+
+    fname: String. Required.
+        Path to the state file.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    tmp_fname = "{0}.tmp".format(fname)
+    with open(tmp_fname, "w") as f:
+        json.dump(state, f)
+
+    os.replace(tmp_fname, fname)
+
+
+def update_state(state, fname):
+    """
+    Adds the new and changed registrations in an export to the state.
+
+    Exports normally only grow, so if the export still starts with exactly
+    the bytes read last time only the rows after them are parsed.  Otherwise
+    (e.g., a row was edited) the whole export is parsed and compared row by
+    row; registrations no longer in the export are dropped.
+
+    Repeated registrations are merged as in ``read_registrations``, see
+    ``dedupe_rows``.  A state saved with other keys (e.g., the payID keys of
+    older versions) is rebuilt from the whole export.
+
+    Parameters
+    ----------
+
+    state: Dictionary. Required.
+        See ``load_state``.  Updated in place.
+
+    fname: String. Required.
+        Path to the registration csv file.
+
+    Returns
+    ----------
+
+    new_keys, changed_keys, removed_keys: Lists of strings.
+        The registrations that were added, those whose row changed and those
+        no longer in the export.
+    """
+
+    with open(fname, "rb") as f:
+        content = f.read()
+
+    old_rows = state["rows"]
+
+    prefix = content[:state["nbytes"]]
+    appended = len(prefix) == state["nbytes"] and \
+               hashlib.md5(prefix).hexdigest() == state["md5"] and \
+               (not prefix or prefix.endswith(b"\n"))
+
+    if any(key != get_row_key(row) for key, row in old_rows.items()):
+        print("The state was saved with different keys; reading all of the "
+              "export.")
+        appended = False
+    elif not appended:
+        print("The export has changed since the last run; reading all of "
+              "it.")
+
+    if appended:
+        content_new = content[state["nbytes"]:]
+        rows = OrderedDict(old_rows)
+    else:
+        content_new = content
+        rows = OrderedDict()
+
+    reader = csv.reader(io.StringIO(content_new.decode("utf-8")))
+    rows = dedupe_rows(reader, rows)
+
+    new_keys = [key for key in rows if key not in old_rows]
+    changed_keys = [key for key in rows if key in old_rows and
+                    old_rows[key] != rows[key]]
+    removed_keys = [key for key in old_rows if key not in rows]
+
+    state["rows"] = rows
+    state["nbytes"] = len(content)
+    state["md5"] = hashlib.md5(content).hexdigest()
+
+    return new_keys, changed_keys, removed_keys
+
+
+def write_outputs(outputs, out_dir="."):
+    """
+    Writes all the output files together.
+
+    Every file is formatted in memory first, then each is written to a
+    temporary name and moved into place.
+
+    Parameters
+    ----------
+
+    outputs: Dictionary. Required.
+        Keyed by the output file name with the array of values (one per line)
+        as the value.
+
+    out_dir: String. Optional, default ".".
+        Directory the files are written to.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    contents = OrderedDict()
+    for fname, values in outputs.items():
+        contents[fname] = "".join("{0}\n".format(value) for value in values)
+
+    for fname, content in contents.items():
+        path = "{0}/{1}".format(out_dir, fname)
+        with open("{0}.tmp".format(path), "w") as f:
+            f.write(content)
+
+    for fname in contents.keys():
+        path = "{0}/{1}".format(out_dir, fname)
+        os.replace("{0}.tmp".format(path), path)
+
+
+def check_payments(table, out_dir=".", write=True):
     """
     Checks how many students have registered and how many have paid.
 
     Parameters
     ----------
 
-    args: Dictionary.  Required.
-        Contains the runtime variables such as input file name.
-        For full contents of the dictionary refer to ``parse_inputs``.
+    table: Dictionary of arrays.  Required.
+        The registrations, see ``read_registrations``.
+
+    out_dir: String. Optional, default ".".
+        Directory the output csv files are written to.
+
+    write: Boolean. Optional, default True.
+        Whether to write the output csv files.
 
     Returns
     ----------
@@ -61,128 +383,63 @@ def check_payments(args):
     None. The results will be printed to stdout.
     """
 
-    name = []
-    institution = []
-    gender = []
-    event = []
-    email = []
-    paid = []
-    payID = []
+    going = table["attending"]
+    paid = going & table["paid"]
+    not_paid = going & ~table["paid"]
 
-    money = []
-    isgoing = []
-
-    attending = 0
-    has_paid = 0
+    name = table["name"]
+    email = table["email"]
 
     print("")
-    with open(args["fname_in"], 'r') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            name.append(row[0])
-            institution.append(row[1])
-            gender.append(row[2])
-            event.append(row[3])
-            email.append(row[4])
-            paid.append(row[6])
-            payID.append(row[7])
-
-            #if "Annual" in row[3] and "HWSA" not in row[3]:
-            if "HWSA" in row[3]: 
-                attending += 1
-                isgoing.append(True)
-
-                if "True" in row[6]: 
-                    has_paid += 1
-                    money.append(True)
-                if "False" in row[6]:
-                    #print("{0}: {1}".format(row[0], row[3]))
-                    money.append(False)
-            else:
-                isgoing.append(False)
-                money.append(False)
-
-    w_isgoing = np.nonzero(isgoing)[0]
-    w_paid = np.nonzero(money)[0]
-
     print("PEOPLE WHO HAVE PAID:")
-    for w in w_paid:
+    for w in np.nonzero(paid)[0]:
         print("{0}: {1}".format(name[w], email[w]))
 
     print("")
     print("PEOPLE WHO HAVE NOT PAID:")
     print("")
 
-    going_name = [] 
-    going_institute = [] 
-    going_email = []
-    going_paid = []
-    not_paid_email = []
-
-    my_csv = open("./onlyASA.csv", "w")
-
-
-    for w in w_isgoing:
-        going_name.append(str(name[w]))
-        going_email.append(str(email[w]))
-        going_institute.append(str(institution[w]))
-        going_paid.append(str(money[w]))
-        row = "{0},{1},{2},{3}\n".format(name[w], institution[w], email[w],
-                money[w]) 
-        #my_csv.write(row)
-        if not w in w_paid:
-            not_paid_email.append(email[w])
-            print("{0}: {1}".format(name[w], email[w]))
-
-
-    print("{0} people have registered and {1} have paid.".format(len(w_isgoing),
-                                                                 len(w_paid)))
-    np.savetxt("./emails.csv", going_email, fmt="%s") 
-    np.savetxt("./paid.csv", going_paid, fmt="%s") 
-    np.savetxt("./not_paid_emails.csv", not_paid_email, fmt="%s") 
-    np.savetxt("./names.csv", going_name, fmt="%s") 
-    np.savetxt("./institutes.csv", going_institute, fmt="%s") 
-    
-
-def read_data(args):
-
-    name = []
-    institution = []
-    gender = []
-    event = []
-    email = []
-    paid = []
-    payID = []
-
-    isgoing = []
+    for w in np.nonzero(not_paid)[0]:
+        print("{0}: {1}".format(name[w], email[w]))
 
-    print("")
-    with open(args["fname_in"], 'r') as f:
-        reader = csv.reader(f)
-        for row in reader:
-            name.append(row[0])
-            institution.append(row[1])
-            gender.append(row[2])
-            event.append(row[3])
-            email.append(row[4])
-            paid.append(row[6])
-            payID.append(row[7])
-
-            if "HWSA" in row[3]: 
-                isgoing.append(True)
-            else:
-                isgoing.append(False)
-
-    w = np.where(isgoing)[0]
-   
-    name = np.asarray(name)
-    gender = np.asarray(gender)
-    institution = np.asarray(institution)
+    print("{0} people have registered and {1} have paid.".format(going.sum(),
+                                                                 paid.sum()))
+
+    if not write:
+        return
+
+    outputs = OrderedDict([("emails.csv", email[going]),
+                           ("paid.csv", paid[going]),
+                           ("not_paid_emails.csv", email[not_paid]),
+                           ("names.csv", name[going]),
+                           ("institutes.csv", table["institution"][going])])
+
+    write_outputs(outputs, out_dir)
+
+
+def read_data(table):
+    """
+    Gets the details of the people attending HWSA.
+
+    Parameters
+    ----------
+
+    table: Dictionary of arrays.  Required.
+        The registrations, see ``read_registrations``.
+
+    Returns
+    ----------
+
+    data: Dictionary of arrays.
+        The ``name``, ``gender`` and ``institution`` of each attendee.
+    """
+
+    going = table["attending"]
 
     data = {}
-    data["name"] = name[w]
-    data["gender"] = gender[w]
-    data["institution"] = institution[w]
+    data["name"] = table["name"][going]
+    data["gender"] = table["gender"][going]
+    data["institution"] = table["institution"][going]
 
     return data
 
@@ -190,7 +447,32 @@ def read_data(args):
 if __name__ == '__main__':
 
     args = parse_inputs()
-
-    data = read_data(args)
-
-    check_payments(args)
+    enable_from_args(args, "check_payments")
+
+    if args["state_file"]:
+        with profiler.stage("update_state",
+                            bytes_read=os.path.getsize(args["fname_in"])):
+            state = load_state(args["state_file"])
+            new_keys, changed_keys, removed_keys = \
+                update_state(state, args["fname_in"])
+
+        print("{0} new, {1} changed and {2} removed registrations since the "
+              "last run.".format(len(new_keys), len(changed_keys),
+                                 len(removed_keys)))
+
+        table = build_table(list(state["rows"].values()))
+        changed = bool(new_keys or changed_keys or removed_keys) or \
+                  not os.path.exists("{0}/emails.csv".format(args["out_dir"]))
+    else:
+        with profiler.stage("read_registrations",
+                            bytes_read=os.path.getsize(args["fname_in"])):
+            table = read_registrations(args["fname_in"])
+        changed = True
+
+    data = read_data(table)
+
+    with profiler.stage("check_payments", num_items=len(table["email"])):
+        check_payments(table, args["out_dir"], write=changed)
+
+    if args["state_file"]:
+        save_state(state, args["state_file"])
@@ -0,0 +1,266 @@
+#!/usr/bin:env python
+"""
+Summarises the registrations by institution, gender and event.
+
+Each grouping column is converted to integer codes once, then the number of
+registrations and the number that have paid are counted for every grouping
+with ``np.bincount``.  Groupings can also combine several columns, e.g.
+event and gender.
+"""
+from __future__ import print_function
+import numpy as np
+import argparse
+import csv
+import os
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+import check_payments as cp
+
+default_groupings = ["institution", "gender", "event", ("event", "gender")]
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    If there has not been an input file specified a RuntimeError will be
+    raised.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['fname_in']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-f", "--fname_in", dest="fname_in",
+                        help="Path to the input csv data file. Required.")
+    parser.add_argument("-a", "--attending", dest="attending",
+                        action="store_true",
+                        help="Only count the people attending HWSA.")
+    parser.add_argument("-o", "--out_dir", dest="out_dir",
+                        help="Also save each table as a csv file in this "
+                        "directory.")
+
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.fname_in is None:
+        parser.print_help()
+        raise RuntimeError
+
+    return vars(args)
+
+
+def factorize(values):
+    """
+    Converts a column into integer codes.
+
+    Parameters
+    ----------
+
+    values: Array. Required.
+        The column.
+
+    Returns
+    ----------
+
+    uniques: Array.
+        The distinct values, sorted.
+
+    codes: Array of integers.
+        For each row, the index of its value in ``uniques``.
+    """
+
+    uniques, codes = np.unique(values, return_inverse=True)
+
+    return uniques, codes.ravel()
+
+
+def group_stats(table, groupings=default_groupings, mask=None):
+    """
+    Counts the registrations and payments for every grouping.
+
+    Parameters
+    ----------
+
+    table: Dictionary of arrays. Required.
+        The registrations, see ``check_payments.read_registrations``.
+
+    groupings: List. Optional, default ``default_groupings``.
+        Each grouping is either a column name or a tuple of column names.
+
+    mask: Array of booleans. Optional.
+        Only count the rows where this is True.  Default: every row.
+
+    Returns
+    ----------
+
+    stats: Dictionary.
+        Keyed by each grouping.  Each value is a dictionary with ``keys`` (a
+        list with the group values of each column, only groups with at least
+        one registration), ``count``, ``paid`` and ``paid_fraction``.
+    """
+
+    if mask is None:
+        mask = np.ones(len(table["paid"]), dtype=bool)
+
+    paid = table["paid"][mask]
+
+    # Each column is only factorized once, however many groupings use it.
+    factors = {}
+    for grouping in groupings:
+        for column in np.atleast_1d(grouping):
+            if column not in factors:
+                factors[column] = factorize(table[column][mask])
+
+    stats = {}
+    for grouping in groupings:
+        columns = list(np.atleast_1d(grouping))
+
+        uniques = [factors[column][0] for column in columns]
+        shape = tuple(len(unique) for unique in uniques)
+
+        # Combine the codes of each column into a single code.
+        codes = np.ravel_multi_index([factors[column][1]
+                                      for column in columns], shape)
+
+        size = int(np.prod(shape))
+        count = np.bincount(codes, minlength=size)
+        num_paid = np.bincount(codes, weights=paid, minlength=size)
+
+        groups = np.nonzero(count)[0]
+        keys = [unique[idx] for unique, idx in
+                zip(uniques, np.unravel_index(groups, shape))]
+
+        stats[grouping] = {"keys": keys,
+                           "count": count[groups],
+                           "paid": num_paid[groups].astype(np.int64),
+                           "paid_fraction": num_paid[groups] / count[groups]}
+
+    return stats
+
+
+def get_grouping_name(grouping):
+    """
+    Gets a printable name for a grouping.
+
+    Parameters
+    ----------
+
+    grouping: String or tuple of strings. Required.
+        See ``group_stats``.
+
+    Returns
+    ----------
+
+    name: String.
+        The column names joined by "_".
+    """
+
+    return "_".join(np.atleast_1d(grouping))
+
+
+def print_stats(stats, groupings=default_groupings):
+    """
+    Prints the tables computed by ``group_stats``.
+
+    Parameters
+    ----------
+
+    stats: Dictionary. Required.
+        See ``group_stats``.
+
+    groupings: List. Optional, default ``default_groupings``.
+        The groupings to print, in order.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    for grouping in groupings:
+        table = stats[grouping]
+        columns = list(np.atleast_1d(grouping))
+
+        print("")
+        print("REGISTRATIONS BY {0}:".format(" AND ".join(columns).upper()))
+
+        for row in range(len(table["count"])):
+            name = ", ".join(str(key[row]) for key in table["keys"])
+            print("{0}: {1} registered, {2} paid ({3:.0%})"
+                  .format(name, table["count"][row], table["paid"][row],
+                          table["paid_fraction"][row]))
+
+
+def save_stats(stats, out_dir, groupings=default_groupings):
+    """
+    Saves each table computed by ``group_stats`` as a csv file called
+    'stats_<grouping>.csv'.
+
+    Parameters
+    ----------
+
+    stats: Dictionary. Required.
+        See ``group_stats``.
+
+    out_dir: String. Required.
+        Directory the files are saved in.
+
+    groupings: List. Optional, default ``default_groupings``.
+        The groupings to save.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    for grouping in groupings:
+        table = stats[grouping]
+        columns = list(np.atleast_1d(grouping))
+
+        fname = "{0}/stats_{1}.csv".format(out_dir, get_grouping_name(grouping))
+        with open(fname, "w") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns + ["count", "paid", "paid_fraction"])
+            writer.writerows(zip(*(table["keys"] +
+                                   [table["count"], table["paid"],
+                                    table["paid_fraction"]])))
+
+        print("Saved {0}".format(fname))
+
+
+if __name__ == '__main__':
+
+    args = parse_inputs()
+    enable_from_args(args, "registration_stats")
+
+    with profiler.stage("read_registrations",
+                        bytes_read=os.path.getsize(args["fname_in"])):
+        table = cp.read_registrations(args["fname_in"])
+
+    if args["attending"]:
+        mask = table["attending"]
+    else:
+        mask = None
+
+    with profiler.stage("group_stats", num_items=len(table["paid"])):
+        stats = group_stats(table, mask=mask)
+
+    print_stats(stats)
+
+    if args["out_dir"]:
+        save_stats(stats, args["out_dir"])
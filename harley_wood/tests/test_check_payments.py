@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import numpy as np
+import csv
+import sys
+import os
+from collections import OrderedDict
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+
+import check_payments as cp
+
+# name, institution, gender, event, email, (unused), paid, payID.
+registrations = [
+    ["Ada", "ANU", "F", "HWSA 2019", "ada@anu.edu.au", "", "True", "P1"],
+    ["Ben", "UQ", "M", "HWSA 2019", "ben@uq.edu.au", "", "False", ""],
+    ["Cat", "Swinburne, CAS", "F", "Annual Meeting", "cat@swin.edu.au", "",
+     "True", "P2"],
+    ["Dan", "UWA", "M", "HWSA 2019", "dan@uwa.edu.au", "", "True", "P3"],
+    ["Eve", "UWA", "F", "HWSA 2019", "eve@uwa.edu.au", "", "True", "P3"],
+    ["Fay", "ANU", "X", "Annual Meeting", "fay@anu.edu.au", "", "False", ""],
+]
+
+
+def write_export(fname, rows, mode="w"):
+    """
+    Writes registration rows the way the export does.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Path to the csv file.
+
+    rows: List of lists of strings. Required.
+        The rows.
+
+    mode: String. Optional, default "w".
+        Mode the file is opened with, "a" to append.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    with open(fname, mode, newline="") as f:
+        csv.writer(f).writerows(rows)
+
+
+def read_baseline(fname):
+    """
+    Reads an export row by row into lists as the original two passes did.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Path to the registration csv file.
+
+    Returns
+    ----------
+
+    columns: Dictionary of lists.
+        Each column of the export, plus ``attending`` and ``paid`` flags.
+    """
+
+    columns = dict((key, []) for key in cp.csv_columns.keys())
+    columns["attending"] = []
+
+    with open(fname, "r") as f:
+        for row in csv.reader(f):
+            for key, col in cp.csv_columns.items():
+                columns[key].append(row[col])
+
+            columns["attending"].append("HWSA" in row[3])
+            columns["paid"][-1] = "True" in row[6]
+
+    return columns
+
+
+def get_outputs(table, out_dir):
+    """
+    Writes the output files of ``check_payments`` and reads them back.
+
+    Parameters
+    ----------
+
+    table: Dictionary of arrays. Required.
+        The registrations, see ``cp.build_table``.
+
+    out_dir: ``py.path.local``. Required.
+        Directory the files are written to.  Created if it doesn't exist.
+
+    Returns
+    ----------
+
+    outputs: Dictionary.
+        Keyed by the output file name with its contents.
+    """
+
+    out_dir.ensure(dir=True)
+    cp.check_payments(table, str(out_dir), write=True)
+
+    outputs = {}
+    for out_fname in ["emails.csv", "paid.csv", "not_paid_emails.csv",
+                      "names.csv", "institutes.csv"]:
+        with open(str(out_dir.join(out_fname)), "r") as f:
+            outputs[out_fname] = f.read()
+
+    return outputs
+
+
+def test_read_registrations(tmpdir):
+    """
+    Checks the columns and masks of ``read_registrations`` match reading the
+    export row by row, and ``check_payments`` writes the same files.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    fname = str(tmpdir.join("export.csv"))
+    write_export(fname, registrations)
+
+    table = cp.read_registrations(fname)
+    expected = read_baseline(fname)
+
+    for key, values in expected.items():
+        if not isinstance(table[key], np.ndarray) or \
+           table[key].tolist() != values:
+            print("The {0} column was {1} but should be {2}."
+                  .format(key, table[key], values))
+            pytest.fail()
+
+    going = np.array(expected["attending"])
+    paid = np.array(expected["paid"])
+
+    cp.check_payments(table, str(tmpdir), write=True)
+
+    baseline = {"emails.csv": np.array(expected["email"])[going],
+                "paid.csv": paid[going],
+                "not_paid_emails.csv": np.array(expected["email"])[going &
+                                                                   ~paid],
+                "names.csv": np.array(expected["name"])[going],
+                "institutes.csv": np.array(expected["institution"])[going]}
+
+    for out_fname, values in baseline.items():
+        with open(str(tmpdir.join(out_fname)), "r") as f:
+            lines = f.read().splitlines()
+
+        if lines != [str(value) for value in values]:
+            print("{0} was {1} but should be {2}.".format(out_fname, lines,
+                                                          values))
+            pytest.fail()
+
+    data = cp.read_data(table)
+    if data["name"].tolist() != ["Ada", "Ben", "Dan", "Eve"]:
+        print("The attendees were {0}.".format(data["name"]))
+        pytest.fail()
+
+    # An empty export still gives every column.
+    empty_fname = str(tmpdir.join("empty.csv"))
+    write_export(empty_fname, [])
+    empty = cp.read_registrations(empty_fname)
+    if sorted(empty.keys()) != sorted(table.keys()) or \
+       any(len(values) for values in empty.values()):
+        print("The empty table was {0}.".format(empty))
+        pytest.fail()
+
+
+def test_update_state(tmpdir, capsys):
+    """
+    Checks ``update_state`` on appended, edited and removed registrations,
+    and that the incremental outputs match reading the export in full.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    capsys: ``pytest`` fixture. Required.
+        Captures what is printed, to tell whether the whole export was read.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    fname = str(tmpdir.join("export.csv"))
+    state_fname = str(tmpdir.join("state.json"))
+    keys = [cp.get_row_key(row) for row in registrations]
+
+    def update(expected_new, expected_changed, expected_removed, full):
+        state = cp.load_state(state_fname)
+        capsys.readouterr()
+        result = cp.update_state(state, fname)
+        read_all = "reading all of" in capsys.readouterr().out
+        cp.save_state(state, state_fname)
+
+        if list(result) != [expected_new, expected_changed,
+                            expected_removed] or read_all != full:
+            print("update_state gave {0} (whole export read: {1}) but should "
+                  "give {2} (whole export read: {3})."
+                  .format(result, read_all, [expected_new, expected_changed,
+                                             expected_removed], full))
+            pytest.fail()
+
+        return state
+
+    # Dan and Eve are covered by one group payment so share a payID.
+    write_export(fname, registrations[:4])
+    update(keys[:4], [], [], False)
+
+    # Appended rows are read without re-reading the start.
+    write_export(fname, registrations[4:], mode="a")
+    state = update(keys[4:], [], [], False)
+
+    if len(state["rows"]) != len(registrations):
+        print("{0} registrations were tracked but {1} were exported."
+              .format(len(state["rows"]), len(registrations)))
+        pytest.fail()
+
+    # An edit that keeps the size of the export still fails the checksum.
+    rows = [list(row) for row in registrations]
+    rows[0][1] = "UNA"
+    write_export(fname, rows)
+    update([], [keys[0]], [], True)
+
+    # Ben paying is a change to his registration, not a new one.
+    rows[1][6] = "True"
+    rows[1][7] = "P4"
+    write_export(fname, rows)
+    update([], [keys[1]], [], True)
+
+    # Fay withdraws.
+    del rows[5]
+    write_export(fname, rows)
+    state = update([], [], [keys[5]], True)
+
+    incremental = get_outputs(cp.build_table(list(state["rows"].values())),
+                              tmpdir.join("incremental"))
+    full = get_outputs(cp.read_registrations(fname), tmpdir.join("full"))
+    if incremental != full:
+        print("The incremental outputs were {0} but reading the export in "
+              "full gives {1}.".format(incremental, full))
+        pytest.fail()
+
+    # Registering again appends a row; the last one is kept in place of the
+    # first.
+    rows.append(list(rows[3]))
+    rows[-1][1] = "Curtin"
+    write_export(fname, rows[-1:], mode="a")
+    state = update([], [keys[3]], [], False)
+
+    if state["rows"][keys[3]][1] != "Curtin" or \
+       list(state["rows"].keys()) != keys[:5]:
+        print("The registrations after a duplicate were {0}."
+              .format(state["rows"]))
+        pytest.fail()
+
+    # Re-reading the whole export from scratch gives the same registrations.
+    fresh = cp.load_state(str(tmpdir.join("missing.json")))
+    cp.update_state(fresh, fname)
+    if fresh["rows"] != state["rows"]:
+        print("The incremental registrations were {0} but reading the export "
+              "from scratch gives {1}.".format(state["rows"], fresh["rows"]))
+        pytest.fail()
+
+
+def test_duplicates(tmpdir):
+    """
+    Checks a repeated registration is merged the same way with and without a
+    state file.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    fname = str(tmpdir.join("export.csv"))
+    state = cp.load_state(str(tmpdir.join("state.json")))
+
+    # Ben registers twice before the first run and Dan again after it, with
+    # the email in capitals.
+    rows = [list(row) for row in registrations]
+    rows.insert(3, rows[1][:6] + ["True", "P4"])
+    write_export(fname, rows)
+    cp.update_state(state, fname)
+
+    again = list(rows[4])
+    again[1] = "Curtin"
+    again[4] = again[4].upper()
+    write_export(fname, [again], mode="a")
+    cp.update_state(state, fname)
+
+    table = cp.read_registrations(fname)
+    if len(table["email"]) != len(registrations) or \
+       table["paid"].tolist() != [True, True, True, True, True, False] or \
+       table["institution"][3] != "Curtin":
+        print("The registrations read in full were {0}.".format(table))
+        pytest.fail()
+
+    incremental = get_outputs(cp.build_table(list(state["rows"].values())),
+                              tmpdir.join("incremental"))
+    full = get_outputs(table, tmpdir.join("full"))
+    if incremental != full:
+        print("The incremental outputs were {0} but reading the export in "
+              "full gives {1}.".format(incremental, full))
+        pytest.fail()
+
+
+def test_legacy_state(tmpdir):
+    """
+    Checks a state saved with the old payID keys is rebuilt on the next run,
+    even if the export hasn't changed.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    fname = str(tmpdir.join("export.csv"))
+    state_fname = str(tmpdir.join("state.json"))
+    write_export(fname, registrations)
+
+    # The old keys merged Dan and Eve, who share a group payment.
+    state = cp.load_state(state_fname)
+    cp.update_state(state, fname)
+    legacy_rows = OrderedDict()
+    for row in registrations:
+        payID = row[7] if row[7] else "email:{0}".format(row[4])
+        legacy_rows["{0}|{1}".format(payID, row[3])] = row
+    state["rows"] = legacy_rows
+    cp.save_state(state, state_fname)
+
+    state = cp.load_state(state_fname)
+    new_keys, changed_keys, removed_keys = cp.update_state(state, fname)
+
+    keys = [cp.get_row_key(row) for row in registrations]
+    if list(state["rows"].keys()) != keys or new_keys != keys or \
+       removed_keys != list(legacy_rows.keys()):
+        print("After one run the registrations were {0}, with {1} new and "
+              "{2} removed.".format(list(state["rows"].keys()), new_keys,
+                                    removed_keys))
+        pytest.fail()
+
+    incremental = get_outputs(cp.build_table(list(state["rows"].values())),
+                              tmpdir.join("incremental"))
+    full = get_outputs(cp.read_registrations(fname), tmpdir.join("full"))
+    if incremental != full:
+        print("The outputs after one run were {0} but reading the export in "
+              "full gives {1}.".format(incremental, full))
+        pytest.fail()
+
+
+if __name__ == "__main__":
+
+    pytest.main([__file__])
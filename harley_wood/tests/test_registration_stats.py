@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import numpy as np
+import sys
+import os
+from collections import Counter
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+
+import check_payments as cp
+import registration_stats as rs
+
+
+def make_rows(num_rows, seed=0):
+    """
+    Makes random registration rows.
+
+    Parameters
+    ----------
+
+    num_rows: Integer. Required.
+        Number of rows.
+
+    seed: Integer. Optional, default 0.
+        Random seed.
+
+    Returns
+    ----------
+
+    rows: List of lists of strings.
+        The rows, laid out as the registration export.
+    """
+
+    rng = np.random.RandomState(seed)
+
+    institutions = ["ANU", "UQ", "UWA", "Swinburne"]
+    genders = ["F", "M", "X"]
+    events = ["HWSA 2019", "Annual Meeting"]
+
+    rows = []
+    for idx in range(num_rows):
+        rows.append(["Person {0}".format(idx), rng.choice(institutions),
+                     rng.choice(genders), rng.choice(events),
+                     "person{0}@example.com".format(idx), "",
+                     str(rng.random_sample() < 0.6), ""])
+
+    return rows
+
+
+def test_group_stats():
+    """
+    Checks the counts, payments and paid fractions of ``group_stats`` match
+    counting the rows with ``collections.Counter``, with and without a mask.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    rows = make_rows(200)
+    table = cp.build_table(rows)
+
+    for mask in [None, table["attending"]]:
+        stats = rs.group_stats(table, mask=mask)
+
+        if mask is None:
+            kept = rows
+        else:
+            kept = [row for (row, keep) in zip(rows, mask) if keep]
+
+        for grouping in rs.default_groupings:
+            columns = [cp.csv_columns[column]
+                       for column in np.atleast_1d(grouping)]
+
+            count = Counter(tuple(row[col] for col in columns)
+                            for row in kept)
+            paid = Counter(tuple(row[col] for col in columns)
+                           for row in kept if row[6] == "True")
+
+            result = stats[grouping]
+            keys = list(zip(*result["keys"]))
+
+            # Only groups with registrations are listed, sorted by value.
+            if keys != sorted(count.keys()):
+                print("The {0} groups were {1} but should be {2}."
+                      .format(grouping, keys, sorted(count.keys())))
+                pytest.fail()
+
+            for idx, key in enumerate(keys):
+                if result["count"][idx] != count[key] or \
+                   result["paid"][idx] != paid[key] or \
+                   not np.isclose(result["paid_fraction"][idx],
+                                  paid[key] / count[key]):
+                    print("The {0} group {1} had {2} registered, {3} paid "
+                          "({4}) but should have {5} and {6}."
+                          .format(grouping, key, result["count"][idx],
+                                  result["paid"][idx],
+                                  result["paid_fraction"][idx], count[key],
+                                  paid[key]))
+                    pytest.fail()
+
+
+if __name__ == "__main__":
+
+    pytest.main([__file__])
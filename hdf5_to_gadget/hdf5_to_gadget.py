@@ -4,11 +4,18 @@ import numpy as np
 import h5py
 from tqdm import tqdm
 import argparse
+import os
 import time
+from multiprocessing import Pool
 from array import array
 import numpy as np
 
-def get_fname(snap, chunk, outdir):
+from read_gadget import get_field_dtype, get_block_index
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+def get_fname(snap, chunk, snapdir, outdir):
 
     if snap < 66: # Slightly different naming scheme depending upon the snapshot.
         fname= "{0}/snapdir_{1:03d}/snapdir_{1:03d}/snapshot_{1:03d}.{2}.hdf5".format(snapdir,
@@ -20,130 +27,580 @@ def get_fname(snap, chunk, outdir):
                                                                        chunk)
 
 
-    fname_in = fname 
+    fname_in = fname
     fname_out = "{0}/snapdir_{1:03d}/snapshot_{1:03d}.{2}.hdf5".format(outdir, snap, chunk)
 
-    return fname_in, fname_out 
+    return fname_in, fname_out
 
 
-def write_header(fname_in, fname_out):
+def get_field_types(f_in, field, part_types=range(6)):
+    """
+    Finds the particle types that have a given field in this chunk.
 
-    with h5py.File(fname_in, "r") as f_in:
-        npart_total = f_in["Header"].attrs["NumPart_Total"]
-        npart_total_highword = f_in["Header"].attrs["NumPart_Total_HighWord"]
-        npart_thisfile = f_in["Header"].attrs["NumPart_ThisFile"]
-        masstable = f_in["Header"].attrs["MassTable"]
+    Following the Gadget format-1 layout, each field's block contains the
+    particles of every type carrying that field, ordered by type.  Types with
+    no particles in this chunk, or without the dataset (e.g., "Masses" for
+    types whose mass is set in the ``MassTable``) are skipped.
 
-        for i in range(6):
-            if i == 1:
-                continue
-            npart_total[i] = 0
-            npart_total_highword[i] = 0
-            npart_thisfile[i] = 0
-            masstable[i] = 0
-       
-        fout = open(fname_out, "wb")
+    Parameters
+    ----------
 
-        x = np.array(256).astype(np.int32)
-        x.tofile(fout)
+    f_in: ``h5py.File``. Required.
+        The open input HDF5 snapshot chunk.
 
-        npart = np.array(npart_thisfile).astype(np.int32)
-        npart.tofile(fout) 
-    
-        mass = np.array(masstable).astype(np.float64)
-        mass.tofile(fout)
+    field: String. Required.
+        Name of the field being written.
 
-        time = np.array(f_in["Header"].attrs["Time"]).astype(np.float64)
-        time.tofile(fout)
+    part_types: Iterable of integers. Optional, default all six types.
+        The particle types being converted.
 
-        redshift = np.array(f_in["Header"].attrs["Redshift"]).astype(np.float64)
-        redshift.tofile(fout)
+    Returns
+    ----------
 
-        Flag_Sfr = np.array(f_in["Header"].attrs["Flag_Sfr"]).astype(np.int32)
-        Flag_Sfr.tofile(fout)
+    field_types: List of integers.
+        The particle types that contribute to the block, in order.
+    """
 
-        Flag_Feedback = np.array(f_in["Header"].attrs["Flag_Feedback"]).astype(np.int32)
-        Flag_Feedback.tofile(fout)
+    npart_thisfile = f_in["Header"].attrs["NumPart_ThisFile"]
 
-        npart_tot = np.array(npart_total).astype(np.int32)
-        npart_tot.tofile(fout) 
-         
-        Flag_Cooling= np.array(f_in["Header"].attrs["Flag_Cooling"]).astype(np.int32)
-        Flag_Cooling.tofile(fout)
+    field_types = []
+    for part_type in part_types:
+        if npart_thisfile[part_type] == 0:
+            continue
 
-        NumFiles = np.array(f_in["Header"].attrs["NumFilesPerSnapshot"]).astype(np.int32)
-        NumFiles.tofile(fout)
+        group_name = "PartType{0}".format(part_type)
+        if group_name not in f_in or field not in f_in[group_name]:
+            continue
 
-        boxsize = np.array(f_in["Header"].attrs["BoxSize"]).astype(np.float64)
-        boxsize.tofile(fout)
+        field_types.append(part_type)
 
-        Omega0 = np.array(f_in["Header"].attrs["Omega0"]).astype(np.float64)
-        Omega0.tofile(fout)
+    return field_types
 
-        OmegaLambda= np.array(f_in["Header"].attrs["OmegaLambda"]).astype(np.float64)
-        OmegaLambda.tofile(fout)
-       
-        HubbleParam = np.array(f_in["Header"].attrs["HubbleParam"]).astype(np.float64)
-        HubbleParam.tofile(fout)
-        
-        StellarAge = np.array(f_in["Header"].attrs["Flag_StellarAge"]).astype(np.int32)
-        StellarAge.tofile(fout)
-        
-        metals = np.array(f_in["Header"].attrs["Flag_Metals"]).astype(np.int32)
-        metals.tofile(fout)
 
-        npart_tot_hw = np.array(npart_total_highword).astype(np.int32)
-        npart_tot_hw.tofile(fout) 
-    
-        entropy = np.array(0).astype(np.int32)
-        entropy.tofile(fout)
-               
-        fill = np.array(np.zeros(int(60/4))).astype(np.int32)  # Pad to 256.
-        fill.tofile(fout)
+def get_field_nbytes(f_in, field, part_types=range(6)):
+    """
+    Determines the number of bytes a field occupies inside its Fortran record.
 
-        x.tofile(fout) 
- 
-        fout.close()
+    The size is computed from the shape of each contributing dataset, i.e.,
+    ``npart * ncomponents * itemsize`` summed over the particle types.
 
+    Parameters
+    ----------
 
-def write_field(fname_in, fname_out, field): 
+    f_in: ``h5py.File``. Required.
+        The open input HDF5 snapshot chunk.
 
-    with h5py.File(fname_in, "r") as f_in:
-        fout = open(fname_out, "ab")
+    field: String. Required.
+        Name of the field being written.
 
-        npart_thisfile = f_in["Header"].attrs["NumPart_ThisFile"][1]
-        field_data = f_in["PartType1"][field][:]
+    part_types: Iterable of integers. Optional, default all six types.
+        The particle types being converted.
 
-        # Write 3 floats per particle for Pos.
-        # -> NumberBytes = npart * 4 * 3.
+    Returns
+    ----------
 
-        # Write 1 longIDs per particle for IDs. 
-        # -> NumberBytes = npart * 8.
+    nbytes: Integer.
+        Number of data bytes, excluding the two 4-byte record markers.
+    """
 
-        if "ID" in field.upper():
-            nbytes = np.array(npart_thisfile * 8).astype(np.int32)
-            data = np.array(field_data).astype(np.int64)
-        else:
-            nbytes = np.array(npart_thisfile * 4 * 3).astype(np.int32)
-            data = np.array(field_data).astype(np.float32)
+    itemsize = get_field_dtype(field).itemsize
+
+    nbytes = 0
+    for part_type in get_field_types(f_in, field, part_types):
+        shape = f_in["PartType{0}".format(part_type)][field].shape
+        nbytes += int(np.prod(shape)) * itemsize
+
+    return nbytes
+
+
+def write_header(f_in, fout, part_types=range(6)):
+    """
+    Writes the 256 byte Gadget header (plus record markers) to ``fout``.
+
+    Particle types that are not being converted have their counts and masses
+    zeroed.
+
+    Parameters
+    ----------
+
+    f_in: ``h5py.File``. Required.
+        The open input HDF5 snapshot chunk.
+
+    fout: File object. Required.
+        The open output binary file, positioned at the start of the header.
+
+    part_types: Iterable of integers. Optional, default all six types.
+        The particle types being converted.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    npart_total = f_in["Header"].attrs["NumPart_Total"]
+    npart_total_highword = f_in["Header"].attrs["NumPart_Total_HighWord"]
+    npart_thisfile = f_in["Header"].attrs["NumPart_ThisFile"]
+    masstable = f_in["Header"].attrs["MassTable"]
+
+    for i in range(6):
+        if i in part_types:
+            continue
+        npart_total[i] = 0
+        npart_total_highword[i] = 0
+        npart_thisfile[i] = 0
+        masstable[i] = 0
+
+    x = np.array(256).astype(np.int32)
+    x.tofile(fout)
+
+    npart = np.array(npart_thisfile).astype(np.int32)
+    npart.tofile(fout)
+
+    mass = np.array(masstable).astype(np.float64)
+    mass.tofile(fout)
+
+    time = np.array(f_in["Header"].attrs["Time"]).astype(np.float64)
+    time.tofile(fout)
+
+    redshift = np.array(f_in["Header"].attrs["Redshift"]).astype(np.float64)
+    redshift.tofile(fout)
+
+    Flag_Sfr = np.array(f_in["Header"].attrs["Flag_Sfr"]).astype(np.int32)
+    Flag_Sfr.tofile(fout)
+
+    Flag_Feedback = np.array(f_in["Header"].attrs["Flag_Feedback"]).astype(np.int32)
+    Flag_Feedback.tofile(fout)
+
+    npart_tot = np.array(npart_total).astype(np.int32)
+    npart_tot.tofile(fout)
+
+    Flag_Cooling= np.array(f_in["Header"].attrs["Flag_Cooling"]).astype(np.int32)
+    Flag_Cooling.tofile(fout)
+
+    NumFiles = np.array(f_in["Header"].attrs["NumFilesPerSnapshot"]).astype(np.int32)
+    NumFiles.tofile(fout)
+
+    boxsize = np.array(f_in["Header"].attrs["BoxSize"]).astype(np.float64)
+    boxsize.tofile(fout)
+
+    Omega0 = np.array(f_in["Header"].attrs["Omega0"]).astype(np.float64)
+    Omega0.tofile(fout)
+
+    OmegaLambda= np.array(f_in["Header"].attrs["OmegaLambda"]).astype(np.float64)
+    OmegaLambda.tofile(fout)
+
+    HubbleParam = np.array(f_in["Header"].attrs["HubbleParam"]).astype(np.float64)
+    HubbleParam.tofile(fout)
+
+    StellarAge = np.array(f_in["Header"].attrs["Flag_StellarAge"]).astype(np.int32)
+    StellarAge.tofile(fout)
+
+    metals = np.array(f_in["Header"].attrs["Flag_Metals"]).astype(np.int32)
+    metals.tofile(fout)
+
+    npart_tot_hw = np.array(npart_total_highword).astype(np.int32)
+    npart_tot_hw.tofile(fout)
+
+    entropy = np.array(0).astype(np.int32)
+    entropy.tofile(fout)
+
+    fill = np.array(np.zeros(int(60/4))).astype(np.int32)  # Pad to 256.
+    fill.tofile(fout)
+
+    x.tofile(fout)
+
+
+def write_field(f_in, fout, field, part_types=range(6), block_size=2**20):
+    """
+    Writes a single field as one Fortran record to ``fout``.
+
+    The record contains the field for every particle type carrying it,
+    concatenated in type order.  Each dataset is streamed in blocks of
+    ``block_size`` particles.  Each block is read with ``read_direct`` into a
+    reusable buffer of the output datatype (HDF5 performs the conversion during
+    the read) so peak memory does not depend on the number of particles.
+
+    Parameters
+    ----------
+
+    f_in: ``h5py.File``. Required.
+        The open input HDF5 snapshot chunk.
+
+    fout: File object. Required.
+        The open output binary file, positioned at the start of the record.
+
+    field: String. Required.
+        Name of the field being written.
+
+    part_types: Iterable of integers. Optional, default all six types.
+        The particle types being converted.
+
+    block_size: Integer. Optional, default 2**20.
+        Number of particles copied per block.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    nbytes = np.array(get_field_nbytes(f_in, field, part_types)).astype(np.int32)
+    out_dtype = get_field_dtype(field)
+
+    nbytes.tofile(fout)
+
+    for part_type in get_field_types(f_in, field, part_types):
+        dataset = f_in["PartType{0}".format(part_type)][field]
+        npart = dataset.shape[0]
+
+        type_block_size = int(min(block_size, npart))
+        buf = np.empty((type_block_size,) + dataset.shape[1:], dtype=out_dtype)
+
+        for start in range(0, npart, type_block_size):
+            end = min(start + type_block_size, npart)
+            count = end - start
+
+            dataset.read_direct(buf, source_sel=np.s_[start:end],
+                                dest_sel=np.s_[0:count])
+            buf[:count].tofile(fout)
+
+    nbytes.tofile(fout)
+
+
+def write_chunk(fname_in, fname_out, fields, part_types=range(6)):
+    """
+    Converts a single HDF5 snapshot chunk into a Gadget binary file.
+
+    The input and output files are each opened exactly once.  The output is
+    preallocated to its final size before the header and fields are written.
+
+    Parameters
+    ----------
+
+    fname_in: String. Required.
+        Path to the input HDF5 snapshot chunk.
+
+    fname_out: String. Required.
+        Path to the output Gadget binary file.
+
+    fields: List of strings. Required.
+        The fields to write, in order (e.g., "Coordinates", "Velocities",
+        "ParticleIDs", "Masses").
+
+    part_types: Iterable of integers. Optional, default all six types.
+        The particle types being converted.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    with h5py.File(fname_in, "r") as f_in, open(fname_out, "wb") as fout:
+
+        # Header is 256 bytes plus two markers. Each field is its data plus
+        # two markers.
+        total_nbytes = 256 + 8
+        for field in fields:
+            total_nbytes += get_field_nbytes(f_in, field, part_types) + 8
+        fout.truncate(total_nbytes)
+
+        with profiler.stage("write_header", bytes_written=256 + 8):
+            write_header(f_in, fout, part_types)
+
+        # When the chunks are converted by worker processes these stages are
+        # only recorded in the workers, not in the report.
+        for field in fields:
+            with profiler.stage("write_field") as stage:
+                write_field(f_in, fout, field, part_types)
+                stage.add(num_items=1, bytes_written=
+                          get_field_nbytes(f_in, field, part_types) + 8)
+
+
+def verify_binary(fname, expected_nbytes=None):
+    """
+    Checks the Fortran record markers of every block in a Gadget binary file.
+
+    The file is memory-mapped so only the markers themselves are read.  If a
+    leading and trailing marker disagree, the first block is not the 256 byte
+    header, a record overruns the end of the file or the block sizes do not
+    match ``expected_nbytes`` a RuntimeError will be raised.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Path to the Gadget binary file.
+
+    expected_nbytes: List of integers. Optional.
+        If specified, the expected data size (bytes) of each block after the
+        header, in order.
 
-        nbytes.tofile(fout)
-        data.tofile(fout) 
-        nbytes.tofile(fout)
+    Returns
+    ----------
 
- 
-def write_binary(SnapLow, SnapHigh, num_chunks, snapdir, outdir, fields):
+    block_nbytes: List of integers.
+        The data size (bytes) of every block, including the header.
+    """
+
+    data = np.memmap(fname, dtype=np.uint8, mode="r")
+    block_nbytes = [nbytes for (offset, nbytes) in get_block_index(data, fname)]
+
+    if len(block_nbytes) == 0 or block_nbytes[0] != 256:
+        print("The first block of file {0} is not a 256 byte header."
+              .format(fname))
+        raise RuntimeError
+
+    if expected_nbytes is not None and \
+       list(block_nbytes[1:]) != list(expected_nbytes):
+        print("The blocks of file {0} have sizes {1} whereas we expected {2}."
+              .format(fname, block_nbytes[1:], list(expected_nbytes)))
+        raise RuntimeError
+
+    return block_nbytes
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['num_processes']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-n", "--num_processes", dest="num_processes",
+                        help="Number of worker processes used to convert "
+                        "chunks (per MPI rank if --mpi is set). Default: 1.",
+                        default=1, type=int)
+    parser.add_argument("--mpi", dest="use_mpi", action="store_true",
+                        help="Split the (snapshot, chunk) pairs across MPI "
+                        "ranks. Requires mpi4py.")
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.num_processes < 1:
+        print("The number of processes must be at least 1.")
+        parser.print_help()
+        raise ValueError
+
+    return vars(args)
+
+
+def convert_task(task):
+    """
+    Converts a single (snapshot, chunk) pair and times it.
+
+    Parameters
+    ----------
+
+    task: Tuple. Required.
+        ``(snap, chunk, fname_in, fname_out, fields)``.  See ``get_tasks``.
+
+    Returns
+    ----------
+
+    timing: Tuple.
+        ``(snap, chunk, nbytes_written, seconds)`` for the conversion.
+    """
+
+    snap, chunk, fname_in, fname_out, fields = task
+
+    start = time.time()
+    write_chunk(fname_in, fname_out, fields)
+    elapsed = time.time() - start
+
+    return snap, chunk, os.path.getsize(fname_out), elapsed
+
+
+def get_tasks(SnapLow, SnapHigh, num_chunks, snapdir, outdir, fields):
+    """
+    Builds the list of (snapshot, chunk) conversions, ordered for I/O.
+
+    The tasks are sorted by input file size and then interleaved largest,
+    smallest, second largest, second smallest, etc.  Workers pulling from the
+    front of the list (or ranks taking every N-th task) therefore mix heavy and
+    light conversions rather than all hitting the file system with the largest
+    chunks at the same time.
+
+    Parameters
+    ----------
+
+    SnapLow, SnapHigh: Integers. Required.
+        Inclusive range of snapshots to convert.
+
+    num_chunks: Integer. Required.
+        Number of chunks per snapshot.
+
+    snapdir, outdir: Strings. Required.
+        Input and output snapshot directories.  See ``get_fname``.
+
+    fields: List of strings. Required.
+        The fields to write (e.g., "Coordinates", "ParticleIDs").
+
+    Returns
+    ----------
+
+    tasks: List of tuples.
+        Each task is ``(snap, chunk, fname_in, fname_out, fields)``.
+    """
+
+    tasks = []
+    sizes = []
 
     for snap in range(SnapLow, SnapHigh + 1):
-        for chunk in tqdm(range(num_chunks)):
-            fname_in, fname_out = get_fname(snap, chunk, outdir)
-            write_header(fname_in, fname_out)
-            
-            for field in fields: 
-                write_field(fname_in, fname_out, field) 
+        for chunk in range(num_chunks):
+            fname_in, fname_out = get_fname(snap, chunk, snapdir, outdir)
+            tasks.append((snap, chunk, fname_in, fname_out, fields))
+
+            try:
+                sizes.append(os.path.getsize(fname_in))
+            except OSError:
+                sizes.append(0)
+
+    by_size = [tasks[idx] for idx in np.argsort(sizes)[::-1]]
+
+    ordered_tasks = []
+    low = 0
+    high = len(by_size) - 1
+    while low <= high:
+        ordered_tasks.append(by_size[low])
+        if low != high:
+            ordered_tasks.append(by_size[high])
+        low += 1
+        high -= 1
+
+    return ordered_tasks
+
+
+def report_timings(timings, elapsed):
+    """
+    Prints the per-task timings and the aggregate throughput.
+
+    Parameters
+    ----------
+
+    timings: List of tuples. Required.
+        The ``(snap, chunk, nbytes_written, seconds)`` output of
+        ``convert_task`` for every task.
+
+    elapsed: Float. Required.
+        Wall clock time (seconds) taken to convert all the tasks.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    total_bytes = 0
+    for (snap, chunk, nbytes, seconds) in sorted(timings):
+        print("Snapshot {0} chunk {1}: {2:.3f} MB in {3:.2f} seconds"
+              .format(snap, chunk, nbytes / 1.0e6, seconds))
+        total_bytes += nbytes
+
+    print("Converted {0} chunks ({1:.3f} GB) in {2:.2f} seconds: {3:.2f} MB/s."
+          .format(len(timings), total_bytes / 1.0e9, elapsed,
+                  total_bytes / 1.0e6 / max(elapsed, 1.0e-12)))
+
+
+def write_binary(SnapLow, SnapHigh, num_chunks, snapdir, outdir, fields,
+                 num_processes=1, use_mpi=False):
+    """
+    Converts every chunk of every snapshot in the range to Gadget binary.
+
+    Each (snapshot, chunk) pair is independent.  With ``use_mpi`` the ordered
+    tasks are dealt round-robin across the MPI ranks and each rank converts
+    its share with ``num_processes`` worker processes.
+
+    Parameters
+    ----------
+
+    SnapLow, SnapHigh: Integers. Required.
+        Inclusive range of snapshots to convert.
+
+    num_chunks: Integer. Required.
+        Number of chunks per snapshot.
+
+    snapdir, outdir: Strings. Required.
+        Input and output snapshot directories.  See ``get_fname``.
+
+    fields: List of strings. Required.
+        The fields to write (e.g., "Coordinates", "ParticleIDs").
+
+    num_processes: Integer. Optional, default 1.
+        Number of worker processes (per rank).
+
+    use_mpi: Boolean. Optional, default False.
+        If True, distribute the tasks across MPI ranks using ``mpi4py``.
+
+    Returns
+    ----------
+
+    timings: List of tuples.
+        The ``(snap, chunk, nbytes_written, seconds)`` of every task.  With MPI
+        only rank 0 returns the full list; other ranks return their own.
+    """
+
+    tasks = get_tasks(SnapLow, SnapHigh, num_chunks, snapdir, outdir, fields)
+
+    if use_mpi:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+        rank = comm.Get_rank()
+        size = comm.Get_size()
+    else:
+        rank = 0
+        size = 1
+
+    my_tasks = tasks[rank::size]
+
+    start = time.time()
+
+    with profiler.stage("convert_chunks") as stage:
+        if num_processes > 1:
+            with Pool(num_processes) as pool:
+                timings = list(tqdm(pool.imap_unordered(convert_task,
+                                                        my_tasks),
+                                    total=len(my_tasks)))
+        else:
+            timings = [convert_task(task) for task in tqdm(my_tasks)]
+
+        stage.add(num_items=len(timings),
+                  bytes_read=sum(os.path.getsize(task[2]) for task in my_tasks),
+                  bytes_written=sum(timing[2] for timing in timings))
+
+    elapsed = time.time() - start
+
+    if use_mpi:
+        all_timings = comm.gather(timings, root=0)
+        elapsed = comm.reduce(elapsed, op=MPI.MAX, root=0)
+        if rank != 0:
+            return timings
+        timings = [timing for rank_timings in all_timings
+                   for timing in rank_timings]
+
+    report_timings(timings, elapsed)
+
+    return timings
 
 if __name__ == '__main__':
 
+    args = parse_inputs()
+    enable_from_args(args, "hdf5_to_gadget")
+
     SnapLow=40
     SnapHigh=40
     num_chunks=1
@@ -151,5 +608,6 @@ if __name__ == '__main__':
     outdir="/lustre/projects/p004_swin/jseiler/britton_binary"
     fields=["Coordinates", "ParticleIDs"]
 
-    write_binary(SnapLow, SnapHigh, num_chunks, snapdir, outdir, fields)
- 
+    write_binary(SnapLow, SnapHigh, num_chunks, snapdir, outdir, fields,
+                 num_processes=args["num_processes"],
+                 use_mpi=args["use_mpi"])
@@ -0,0 +1,266 @@
+#!/usr/bin:env python
+"""
+Reads Gadget format-1 binary snapshots, such as those written by
+``hdf5_to_gadget.py``.
+
+Each block of the file is exposed as a zero-copy view into a single
+``np.memmap`` of the file, so individual fields can be pulled out of multi-GB
+snapshots without reading the rest of the file.
+"""
+from __future__ import print_function
+import numpy as np
+import argparse
+import os
+
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+
+def get_header_datastruct():
+    """
+    Generates the numpy structured array for the 256 byte Gadget header.
+
+    The layout matches the one produced by ``hdf5_to_gadget.write_header``.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    Header_Desc: numpy structured array.  Required.
+        Structured array for the Gadget header.
+    """
+
+    Header_Desc_full = [
+        ('NumPart_ThisFile',        (np.int32, 6)),
+        ('MassTable',               (np.float64, 6)),
+        ('Time',                    np.float64),
+        ('Redshift',                np.float64),
+        ('Flag_Sfr',                np.int32),
+        ('Flag_Feedback',           np.int32),
+        ('NumPart_Total',           (np.int32, 6)),
+        ('Flag_Cooling',            np.int32),
+        ('NumFilesPerSnapshot',     np.int32),
+        ('BoxSize',                 np.float64),
+        ('Omega0',                  np.float64),
+        ('OmegaLambda',             np.float64),
+        ('HubbleParam',             np.float64),
+        ('Flag_StellarAge',         np.int32),
+        ('Flag_Metals',             np.int32),
+        ('NumPart_Total_HighWord',  (np.int32, 6)),
+        ('Flag_Entropy_ICs',        np.int32),
+        ('Fill',                    (np.int32, 15))
+                        ]
+
+    names = [Header_Desc_full[i][0] for i in range(len(Header_Desc_full))]
+    formats = [Header_Desc_full[i][1] for i in range(len(Header_Desc_full))]
+    Header_Desc = np.dtype({'names': names, 'formats': formats})
+
+    return Header_Desc
+
+
+def get_field_dtype(field):
+    """
+    Determines the datatype a field is stored with in the Gadget binary.
+
+    Parameters
+    ----------
+
+    field: String. Required.
+        Name of the field (e.g., "Coordinates", "ParticleIDs").
+
+    Returns
+    ----------
+
+    dtype: ``numpy.dtype``.
+        64 bit integers for IDs, otherwise 32 bit floats.
+    """
+
+    if "ID" in field.upper():
+        return np.dtype(np.int64)
+    else:
+        return np.dtype(np.float32)
+
+
+def get_block_index(data, fname=""):
+    """
+    Builds the offset table of a Gadget binary file from its record markers.
+
+    If a leading and trailing record marker disagree or a record overruns the
+    end of the file a RuntimeError will be raised.
+
+    Parameters
+    ----------
+
+    data: ``np.memmap`` of ``np.uint8``. Required.
+        The memory-mapped file.
+
+    fname: String. Optional.
+        Name of the file, only used for error messages.
+
+    Returns
+    ----------
+
+    block_index: List of tuples.
+        ``(offset, nbytes)`` of the data (excluding the record markers) of
+        every block, starting with the header.
+    """
+
+    filesize = data.shape[0]
+
+    block_index = []
+    offset = 0
+    while offset < filesize:
+        if offset + 4 > filesize:
+            print("File {0} has {1} trailing bytes after the last block."
+                  .format(fname, filesize - offset))
+            raise RuntimeError
+
+        nbytes = int(data[offset:offset + 4].view(np.int32)[0])
+        end = offset + 4 + nbytes
+
+        if nbytes < 0 or end + 4 > filesize:
+            print("Block {0} of file {1} starting at byte {2} has a record "
+                  "marker of {3} bytes which overruns the file ({4} bytes)."
+                  .format(len(block_index), fname, offset, nbytes, filesize))
+            raise RuntimeError
+
+        end_nbytes = int(data[end:end + 4].view(np.int32)[0])
+        if end_nbytes != nbytes:
+            print("Block {0} of file {1} starting at byte {2} has a leading "
+                  "marker of {3} but a trailing marker of {4}."
+                  .format(len(block_index), fname, offset, nbytes,
+                          end_nbytes))
+            raise RuntimeError
+
+        block_index.append((offset + 4, nbytes))
+        offset = end + 4
+
+    return block_index
+
+
+def read_gadget(fname, fields=("Coordinates", "ParticleIDs")):
+    """
+    Memory-maps a Gadget binary file and indexes its blocks.
+
+    No particle data is read; each returned block is a view into the memory
+    map and is only paged in from disk when it is accessed.
+
+    If the first block is not the 256 byte header, or the number of blocks
+    after the header does not match ``fields``, a RuntimeError will be raised.
+
+    Parameters
+    ----------
+
+    fname: String. Required.
+        Path to the Gadget binary file.
+
+    fields: List of strings. Optional, default ("Coordinates", "ParticleIDs").
+        Names of the blocks following the header, in file order.  Format-1
+        files do not label their blocks so this must match how the file was
+        written.
+
+    Returns
+    ----------
+
+    header: numpy structured array.
+        The header, see ``get_header_datastruct``.
+
+    blocks: Dictionary of ``np.memmap`` views.
+        Keyed by field name.  Blocks whose size is a multiple of three elements
+        per particle (e.g., "Coordinates", "Velocities") have shape (N, 3),
+        otherwise (N,).
+    """
+
+    data = np.memmap(fname, dtype=np.uint8, mode="r")
+    block_index = get_block_index(data, fname)
+
+    if len(block_index) == 0 or block_index[0][1] != 256:
+        print("The first block of file {0} is not a 256 byte header."
+              .format(fname))
+        raise RuntimeError
+
+    if len(block_index) - 1 != len(fields):
+        print("File {0} has {1} blocks after the header but {2} fields were "
+              "specified ({3})."
+              .format(fname, len(block_index) - 1, len(fields), fields))
+        raise RuntimeError
+
+    offset, nbytes = block_index[0]
+    header = data[offset:offset + nbytes].view(get_header_datastruct())[0]
+
+    npart = int(np.sum(header["NumPart_ThisFile"]))
+
+    blocks = {}
+    for field, (offset, nbytes) in zip(fields, block_index[1:]):
+        dtype = get_field_dtype(field)
+        block = data[offset:offset + nbytes].view(dtype)
+
+        # Positions and velocities are 3 elements per particle.
+        if npart > 0 and block.shape[0] == 3 * npart:
+            block = block.reshape(npart, 3)
+
+        blocks[field] = block
+
+    return header, blocks
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments.
+
+    If there has not been an input file specified a RuntimeError will be
+    raised.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['fname_in']).
+    """
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("-f", "--fname_in", dest="fname_in",
+                        help="Path to the input Gadget binary file. Required.")
+    parser.add_argument("-b", "--fields", dest="fields", nargs="+",
+                        help="Names of the blocks after the header, in order. "
+                        "Default: Coordinates ParticleIDs.",
+                        default=["Coordinates", "ParticleIDs"])
+
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+
+    if args.fname_in is None:
+        parser.print_help()
+        raise RuntimeError
+
+    return vars(args)
+
+
+if __name__ == '__main__':
+
+    args = parse_inputs()
+    enable_from_args(args, "read_gadget")
+    with profiler.stage("read_gadget",
+                        bytes_read=os.path.getsize(args["fname_in"])):
+        header, blocks = read_gadget(args["fname_in"], args["fields"])
+
+    for name in header.dtype.names:
+        if name == "Fill":
+            continue
+        print("{0}: {1}".format(name, header[name]))
+
+    for field in blocks.keys():
+        print("{0}: shape {1}, dtype {2}".format(field, blocks[field].shape,
+                                                 blocks[field].dtype))
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import numpy as np
+import sys
+import h5py
+import os
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+location = "{0}/../".format(test_dir)
+sys.path.append(location)
+
+import hdf5_to_gadget as converter
+import read_gadget as reader
+
+fname_in = "{0}/test_snapshot.hdf5".format(test_dir)
+fname_out = "{0}/test_snapshot.binary".format(test_dir)
+
+fields = ["Coordinates", "Velocities", "ParticleIDs", "Masses"]
+
+
+def create_snapshot(npart, fname=fname_in):
+    """
+    Creates a small HDF5 snapshot chunk with gas, dark matter and stars.
+
+    Only the gas has a ``Masses`` dataset; the other types use the mass table.
+
+    Parameters
+    ----------
+
+    npart: List of integers.
+        Number of particles of each of the six types.
+
+    fname: String. Optional, default ``fname_in``.
+        Path the snapshot is saved to.
+
+    Returns
+    ----------
+
+    None.  The snapshot is saved as ``fname``.
+    """
+
+    with h5py.File(fname, "w") as f:
+        header = f.create_group("Header")
+        header.attrs["NumPart_ThisFile"] = np.array(npart, dtype=np.uint32)
+        header.attrs["NumPart_Total"] = np.array(npart, dtype=np.uint32)
+        header.attrs["NumPart_Total_HighWord"] = np.zeros(6, dtype=np.uint32)
+        header.attrs["MassTable"] = np.array([0.0, 0.5, 0.0, 0.0, 0.1, 0.0])
+        header.attrs["Time"] = 0.5
+        header.attrs["Redshift"] = 1.0
+        header.attrs["BoxSize"] = 100.0
+        header.attrs["Omega0"] = 0.302
+        header.attrs["OmegaLambda"] = 0.698
+        header.attrs["HubbleParam"] = 0.681
+        header.attrs["NumFilesPerSnapshot"] = 1
+        for flag in ["Flag_Sfr", "Flag_Feedback", "Flag_Cooling",
+                     "Flag_StellarAge", "Flag_Metals"]:
+            header.attrs[flag] = 0
+
+        offset = 0
+        for part_type in range(6):
+            if npart[part_type] == 0:
+                continue
+
+            group = f.create_group("PartType{0}".format(part_type))
+            group["Coordinates"] = np.random.uniform(0.0, 100.0,
+                                                     (npart[part_type], 3))
+            group["Velocities"] = np.random.normal(0.0, 100.0,
+                                                   (npart[part_type], 3))
+            group["ParticleIDs"] = np.arange(offset, offset + npart[part_type],
+                                             dtype=np.uint64)
+            if part_type == 0:
+                group["Masses"] = np.random.uniform(0.1, 1.0, npart[part_type])
+
+            offset += npart[part_type]
+
+
+def cleanup():
+    """
+    Remove the test snapshot and its converted binary.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None
+    """
+
+    for fname in [fname_in, fname_out]:
+        if os.path.exists(fname):
+            os.remove(fname)
+
+
+def test_run():
+    """
+    Converts a multi-type snapshot and checks it reads back unchanged.
+
+    The conversion is done with a block size smaller than the number of
+    particles so the streaming copy is exercised.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    npart = [300, 500, 0, 0, 20, 0]
+    create_snapshot(npart)
+
+    with h5py.File(fname_in, "r") as f_in, open(fname_out, "wb") as fout:
+        converter.write_header(f_in, fout)
+        for field in fields:
+            converter.write_field(f_in, fout, field, block_size=64)
+
+    ntotal = sum(npart)
+    converter.verify_binary(fname_out, [ntotal * 3 * 4, ntotal * 3 * 4,
+                                        ntotal * 8, npart[0] * 4])
+
+    header, blocks = reader.read_gadget(fname_out, fields)
+
+    with h5py.File(fname_in, "r") as f_in:
+        if list(header["NumPart_ThisFile"]) != npart:
+            print("The header has NumPart_ThisFile {0} whereas we expected {1}"
+                  .format(header["NumPart_ThisFile"], npart))
+            cleanup()
+            pytest.fail()
+
+        for field in fields:
+            expected = np.concatenate([f_in["PartType{0}".format(part_type)][field][:]
+                                       for part_type in range(6)
+                                       if "PartType{0}".format(part_type) in f_in and
+                                       field in f_in["PartType{0}".format(part_type)]])
+            expected = expected.astype(blocks[field].dtype)
+
+            if not np.array_equal(blocks[field], expected):
+                print("Field {0} was not read back correctly.".format(field))
+                cleanup()
+                pytest.fail()
+
+    # A corrupted trailing marker must be caught.
+    data = np.memmap(fname_out, dtype=np.uint8, mode="r+")
+    data[-1] = 7
+    data.flush()
+    del data
+
+    with pytest.raises(RuntimeError):
+        converter.verify_binary(fname_out)
+
+    cleanup()
+
+
+def test_write_binary(tmpdir):
+    """
+    Converts several chunks with one and with two worker processes and checks
+    the outputs are identical, and that the tasks are interleaved by size.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    snap = 66
+    snapdir = str(tmpdir.join("snapshots"))
+    chunk_npart = [[30, 50, 0, 0, 2, 0], [300, 500, 0, 0, 20, 0],
+                   [3, 5, 0, 0, 0, 0], [100, 200, 0, 0, 10, 0]]
+
+    os.makedirs("{0}/snapdir_{1:03d}".format(snapdir, snap))
+    for chunk, npart in enumerate(chunk_npart):
+        chunk_fname, _ = converter.get_fname(snap, chunk, snapdir, snapdir)
+        create_snapshot(npart, chunk_fname)
+
+    # Largest, smallest, second largest, second smallest.
+    tasks = converter.get_tasks(snap, snap, len(chunk_npart), snapdir,
+                                snapdir, fields)
+    if [task[1] for task in tasks] != [1, 2, 3, 0]:
+        print("The chunks were ordered {0} whereas we expected [1, 2, 3, 0]."
+              .format([task[1] for task in tasks]))
+        pytest.fail()
+
+    outputs = []
+    for num_processes in [1, 2]:
+        outdir = str(tmpdir.join("binary_{0}".format(num_processes)))
+        os.makedirs("{0}/snapdir_{1:03d}".format(outdir, snap))
+
+        timings = converter.write_binary(snap, snap, len(chunk_npart), snapdir,
+                                         outdir, fields,
+                                         num_processes=num_processes)
+        if len(timings) != len(chunk_npart):
+            print("{0} chunks were converted with {1} processes whereas we "
+                  "expected {2}.".format(len(timings), num_processes,
+                                         len(chunk_npart)))
+            pytest.fail()
+
+        chunks = []
+        for chunk, npart in enumerate(chunk_npart):
+            _, chunk_fname = converter.get_fname(snap, chunk, snapdir, outdir)
+            ntotal = sum(npart)
+            converter.verify_binary(chunk_fname,
+                                    [ntotal * 3 * 4, ntotal * 3 * 4,
+                                     ntotal * 8, npart[0] * 4])
+            with open(chunk_fname, "rb") as f:
+                chunks.append(f.read())
+        outputs.append(chunks)
+
+    for chunk in range(len(chunk_npart)):
+        if outputs[0][chunk] != outputs[1][chunk]:
+            print("Chunk {0} differs between one and two worker processes."
+                  .format(chunk))
+            pytest.fail()
+
+
+if __name__ == "__main__":
+
+    test_run()
@@ -0,0 +1,609 @@
+#!/usr/bin:env python
+"""
+Per-stage timing and throughput for the command line scripts.
+
+Scripts wrap each stage of their work in ``profiler.stage(...)`` and report how
+many items and bytes the stage handled.  Nothing is recorded unless the
+profiler is enabled, so the stages cost next to nothing in normal runs.
+
+The profiler is enabled for any script using ``add_profile_arguments`` by
+
+- passing ``--profile [REPORT.json]`` (and optionally ``--cprofile
+  OUT.prof``), or
+- setting the environment variable ``SHORT_SCRIPTS_PROFILE`` to the report
+  path, e.g. in a slurm job script, without changing the command line.
+
+Any other script can be run under the profiler with
+
+    python instrument/profiler.py --profile report.json script.py [args...]
+
+which records the whole run as one stage (plus any stages the script has).
+
+For every stage the wall time, number of calls, items and bytes read/written
+(as reported by the script), items/sec, the peak RSS of the process at the end
+of the stage and, on Linux, the bytes read/written by the process (from
+``/proc/self/io``) are saved in a JSON report when the script exits.
+"""
+from __future__ import print_function
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import platform
+import signal
+import sys
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+env_var = "SHORT_SCRIPTS_PROFILE"
+
+
+def get_peak_rss(who="self"):
+    """
+    Gets the peak resident set size of this process or its children.
+
+    Parameters
+    ----------
+
+    who: String. Optional, default "self".
+        "self" for this process, "children" for its finished child processes.
+
+    Returns
+    ----------
+
+    peak_rss: Integer or None.
+        Peak RSS in bytes, or None if it can't be measured on this platform.
+    """
+
+    if resource is None:
+        return None
+
+    if who == "self":
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    else:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    # Linux reports kilobytes, macOS reports bytes.
+    if sys.platform == "darwin":
+        return usage.ru_maxrss
+
+    return usage.ru_maxrss * 1024
+
+
+def get_io_counters():
+    """
+    Gets the number of bytes this process has read and written.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    read_bytes, written_bytes: Integers or None.
+        The ``rchar`` and ``wchar`` counters of ``/proc/self/io``, or None if
+        they aren't available.
+    """
+
+    try:
+        with open("/proc/self/io", "r") as f:
+            counters = dict(line.split(":") for line in f if ":" in line)
+    except (IOError, OSError):
+        return None, None
+
+    return int(counters["rchar"]), int(counters["wchar"])
+
+
+def get_rank():
+    """
+    Gets the rank of this task in a multi-task slurm or MPI job.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    rank, num_ranks: Integers.
+        The rank and number of tasks, 0 and 1 outside a multi-task job.
+    """
+
+    for rank_var, size_var in [("SLURM_PROCID", "SLURM_NTASKS"),
+                               ("OMPI_COMM_WORLD_RANK", "OMPI_COMM_WORLD_SIZE"),
+                               ("PMI_RANK", "PMI_SIZE")]:
+        if rank_var in os.environ and size_var in os.environ:
+            return int(os.environ[rank_var]), int(os.environ[size_var])
+
+    return 0, 1
+
+
+class Stage(object):
+
+    def __init__(self, name):
+        """
+        The totals of one named stage over all the times it was run.
+
+        Parameters
+        ----------
+
+        name: String. Required.
+            Name of the stage.
+        """
+
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.num_items = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_rss = None
+        self.io_read = None
+        self.io_written = None
+
+    def add(self, num_items=0, bytes_read=0, bytes_written=0):
+        """
+        Adds to the number of items and bytes the stage has handled.
+
+        Parameters
+        ----------
+
+        num_items, bytes_read, bytes_written: Integers. Optional, default 0.
+            Amounts to add.
+
+        Returns
+        ----------
+
+        None.
+        """
+
+        self.num_items += int(num_items)
+        self.bytes_read += int(bytes_read)
+        self.bytes_written += int(bytes_written)
+
+    def report(self):
+        """
+        Summarises the stage.
+
+        Parameters
+        ----------
+
+        None.
+
+        Returns
+        ----------
+
+        report: Dictionary.
+            Keyed by ``name``, ``calls``, ``wall``, ``num_items``,
+            ``bytes_read``, ``bytes_written``, ``items_per_sec``,
+            ``read_MB_per_sec``, ``write_MB_per_sec``, ``peak_rss_bytes``,
+            ``io_read_bytes`` and ``io_written_bytes``.
+        """
+
+        wall = max(self.wall, 1.0e-12)
+
+        return OrderedDict([("name", self.name),
+                            ("calls", self.calls),
+                            ("wall", self.wall),
+                            ("num_items", self.num_items),
+                            ("bytes_read", self.bytes_read),
+                            ("bytes_written", self.bytes_written),
+                            ("items_per_sec", self.num_items / wall),
+                            ("read_MB_per_sec", self.bytes_read / 1.0e6 / wall),
+                            ("write_MB_per_sec",
+                             self.bytes_written / 1.0e6 / wall),
+                            ("peak_rss_bytes", self.peak_rss),
+                            ("io_read_bytes", self.io_read),
+                            ("io_written_bytes", self.io_written)])
+
+
+class Profiler(object):
+
+    def __init__(self):
+        """
+        Records the stages of a script.  Disabled until ``enable`` is called.
+        """
+
+        self.enabled = False
+        self.name = None
+        self.fname_out = None
+        self.cprofile_out = None
+
+        self.stages = OrderedDict()
+        self.stack = []
+
+        # Handed out by ``stage`` while disabled so scripts can always call
+        # ``add`` on it.
+        self.null_stage = Stage("disabled")
+
+        self.pid = None
+        self.start_time = None
+        self.start_wall = None
+        self.cprofile = None
+        self.finished = False
+
+    def enable(self, name, fname_out=None, cprofile_out=None):
+        """
+        Starts recording.  Enabling an enabled profiler does nothing, so a
+        script run by the ``profiler.py`` runner keeps the runner's settings.
+
+        The report is saved when the process exits, including when it is
+        stopped by a SIGTERM (e.g., a slurm time limit).
+
+        Parameters
+        ----------
+
+        name: String. Required.
+            Name of the script being profiled.
+
+        fname_out: String. Optional.
+            Path of the JSON report.  Default: '<name>_profile.json'.  In a
+            multi-task job the rank is added before the extension.
+
+        cprofile_out: String. Optional.
+            If specified, the whole run is also profiled with ``cProfile`` and
+            the stats saved to this path (readable with ``pstats``).
+
+        Returns
+        ----------
+
+        None.
+        """
+
+        if self.enabled:
+            return
+
+        if not fname_out:
+            fname_out = "{0}_profile.json".format(name)
+
+        rank, num_ranks = get_rank()
+        if num_ranks > 1:
+            root, ext = os.path.splitext(fname_out)
+            fname_out = "{0}.{1}{2}".format(root, rank, ext)
+            if cprofile_out:
+                root, ext = os.path.splitext(cprofile_out)
+                cprofile_out = "{0}.{1}{2}".format(root, rank, ext)
+
+        self.enabled = True
+        self.name = name
+        self.fname_out = fname_out
+        self.cprofile_out = cprofile_out
+        self.pid = os.getpid()
+        self.start_time = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.start_wall = time.perf_counter()
+
+        atexit.register(self.finish)
+
+        if signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+            signal.signal(signal.SIGTERM, self.handle_sigterm)
+
+        if cprofile_out:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def handle_sigterm(self, signum, frame):
+        """
+        Exits normally on a SIGTERM so the report is still saved.  Forked
+        child processes (e.g. ``multiprocessing`` workers) are terminated as
+        usual.
+        """
+
+        if os.getpid() != self.pid:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+
+        sys.exit(128 + signum)
+
+    @contextlib.contextmanager
+    def stage(self, name, num_items=0, bytes_read=0, bytes_written=0):
+        """
+        Times the code inside the ``with`` block as a stage.
+
+        Stages run inside another stage are named 'outer/inner'.  Running a
+        stage with the same name again adds to its totals.
+
+        Parameters
+        ----------
+
+        name: String. Required.
+            Name of the stage.
+
+        num_items, bytes_read, bytes_written: Integers. Optional, default 0.
+            Amounts handled by the stage if they are known up front.  More can
+            be added with ``add`` on the yielded stage.
+
+        Yields
+        ----------
+
+        stage: ``Stage``.
+            The stage.
+        """
+
+        if not self.enabled:
+            yield self.null_stage
+            return
+
+        self.stack.append(name)
+        full_name = "/".join(self.stack)
+
+        if full_name not in self.stages:
+            self.stages[full_name] = Stage(full_name)
+        stage = self.stages[full_name]
+
+        stage.add(num_items, bytes_read, bytes_written)
+        io_start = get_io_counters()
+        start = time.perf_counter()
+
+        try:
+            yield stage
+        finally:
+            stage.wall += time.perf_counter() - start
+            stage.calls += 1
+            stage.peak_rss = get_peak_rss()
+
+            io_end = get_io_counters()
+            if io_start[0] is not None and io_end[0] is not None:
+                stage.io_read = (stage.io_read or 0) + io_end[0] - io_start[0]
+                stage.io_written = (stage.io_written or 0) + \
+                                   io_end[1] - io_start[1]
+
+            self.stack.pop()
+
+    def report(self):
+        """
+        Summarises the run so far.
+
+        Parameters
+        ----------
+
+        None.
+
+        Returns
+        ----------
+
+        report: Dictionary.
+            Keyed by ``script``, ``argv``, ``host``, ``pid``, ``rank``,
+            ``start``, ``wall``, ``peak_rss_bytes``,
+            ``peak_rss_children_bytes``, ``cprofile`` and ``stages`` (a list
+            of ``Stage.report``).
+        """
+
+        rank, num_ranks = get_rank()
+
+        return OrderedDict([("script", self.name),
+                            ("argv", sys.argv),
+                            ("host", platform.node()),
+                            ("pid", self.pid),
+                            ("rank", rank),
+                            ("start", self.start_time),
+                            ("wall", time.perf_counter() - self.start_wall),
+                            ("peak_rss_bytes", get_peak_rss()),
+                            ("peak_rss_children_bytes",
+                             get_peak_rss("children")),
+                            ("cprofile", self.cprofile_out),
+                            ("stages", [stage.report() for stage in
+                                        self.stages.values()])])
+
+    def finish(self):
+        """
+        Stops recording and saves the report (and the ``cProfile`` stats).
+        Called automatically when the process exits; later calls do nothing.
+
+        Parameters
+        ----------
+
+        None.
+
+        Returns
+        ----------
+
+        report: Dictionary or None.
+            See ``report``.  None if the profiler isn't enabled or has already
+            finished.
+        """
+
+        if not self.enabled or self.finished or os.getpid() != self.pid:
+            return None
+
+        self.finished = True
+
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_out)
+
+        report = self.report()
+
+        with open(self.fname_out, "w") as f:
+            json.dump(report, f, indent=4)
+
+        print_report(report)
+        print("Saved profile to {0}".format(self.fname_out))
+
+        return report
+
+
+def print_report(report):
+    """
+    Prints a summary table of a report.
+
+    Parameters
+    ----------
+
+    report: Dictionary. Required.
+        See ``Profiler.report``.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    print("")
+    print("Profile of {0}: {1:.2f} seconds".format(report["script"],
+                                                   report["wall"]))
+    print("{0:>30} {1:>6} {2:>10} {3:>12} {4:>10} {5:>10} {6:>11}"
+          .format("stage", "calls", "wall (s)", "items/s", "read MB/s",
+                  "write MB/s", "peak RSS MB"))
+
+    for stage in report["stages"]:
+        peak_rss = stage["peak_rss_bytes"]
+        print("{0:>30} {1:>6d} {2:>10.3f} {3:>12.1f} {4:>10.1f} {5:>10.1f} "
+              "{6:>11}".format(stage["name"], stage["calls"], stage["wall"],
+                               stage["items_per_sec"],
+                               stage["read_MB_per_sec"],
+                               stage["write_MB_per_sec"],
+                               "-" if peak_rss is None else
+                               "{0:.1f}".format(peak_rss / 1.0e6)))
+
+
+# Every script shares this profiler.
+profiler = Profiler()
+
+
+def add_profile_arguments(parser):
+    """
+    Adds the ``--profile`` and ``--cprofile`` options to a script's parser.
+
+    Parameters
+    ----------
+
+    parser: ``argparse.ArgumentParser``. Required.
+        The script's parser.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    parser.add_argument("--profile", dest="profile", nargs="?", const="",
+                        help="Time each stage of the run and save a JSON "
+                        "report to this path. Default: "
+                        "'<script>_profile.json'. Can also be turned on by "
+                        "setting ${0} to the report path.".format(env_var))
+    parser.add_argument("--cprofile", dest="cprofile",
+                        help="Also run cProfile and save the stats to this "
+                        "path. Implies --profile.")
+
+
+def enable_from_args(args, name):
+    """
+    Enables the shared profiler if it was asked for on the command line or
+    through the environment.
+
+    Parameters
+    ----------
+
+    args: Dictionary. Required.
+        The script's arguments, including those from
+        ``add_profile_arguments``.
+
+    name: String. Required.
+        Name of the script.
+
+    Returns
+    ----------
+
+    profiler: ``Profiler``.
+        The shared profiler.
+    """
+
+    fname_out = args.get("profile")
+    if fname_out is None:
+        fname_out = os.environ.get(env_var)
+
+    if fname_out is not None or args.get("cprofile"):
+        profiler.enable(name, fname_out, args.get("cprofile"))
+
+    return profiler
+
+
+def run_script(script, script_args, fname_out=None, cprofile_out=None):
+    """
+    Runs a script as ``__main__`` under the shared profiler.
+
+    Parameters
+    ----------
+
+    script: String. Required.
+        Path to the script.
+
+    script_args: List of strings. Required.
+        The script's command line arguments.
+
+    fname_out, cprofile_out: Strings. Optional.
+        See ``Profiler.enable``.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    import runpy
+
+    name = os.path.splitext(os.path.basename(script))[0]
+    profiler.enable(name, fname_out, cprofile_out)
+
+    sys.argv = [script] + list(script_args)
+    sys.path.insert(0, os.path.dirname(os.path.realpath(script)))
+
+    with profiler.stage("run"):
+        runpy.run_path(script, run_name="__main__")
+
+
+def parse_inputs():
+    """
+    Parses the command line input arguments of the runner.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    args: Dictionary.  Required.
+        Dictionary of arguments from the ``argparse`` package.
+        Dictionary is keyed by the argument name (e.g., args['script']).
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Runs a script with the profiler enabled.")
+
+    parser.add_argument("--profile", dest="profile",
+                        help="Path of the JSON report. Default: "
+                        "'<script>_profile.json'.")
+    parser.add_argument("--cprofile", dest="cprofile",
+                        help="Also run cProfile and save the stats to this "
+                        "path.")
+    parser.add_argument("script", help="The script to run.")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER,
+                        help="Arguments passed on to the script.")
+
+    args = parser.parse_args()
+
+    return vars(args)
+
+
+if __name__ == '__main__':
+
+    # Scripts import the profiler as ``instrument.profiler``, which must be
+    # the same module the runner enables rather than this ``__main__``.
+    from instrument import profiler as profiler_module
+
+    args = parse_inputs()
+    profiler_module.run_script(args["script"], args["script_args"],
+                               args["profile"], args["cprofile"])
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import json
+import subprocess
+import sys
+import os
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+repo_dir = os.path.realpath("{0}/../../".format(test_dir))
+sys.path.append(repo_dir)
+
+from instrument import profiler as profiler_module
+
+
+def test_stages(tmpdir):
+    """
+    Checks the stages are recorded, nested and summed, and nothing is recorded
+    while disabled.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    profiler = profiler_module.Profiler()
+
+    with profiler.stage("ignored") as stage:
+        stage.add(num_items=10)
+
+    if profiler.stages:
+        print("A disabled profiler recorded {0}."
+              .format(list(profiler.stages.keys())))
+        pytest.fail()
+
+    fname_out = str(tmpdir.join("report.json"))
+    profiler.enable("test", fname_out)
+
+    for _ in range(2):
+        with profiler.stage("outer", num_items=1):
+            with profiler.stage("inner", bytes_read=100) as stage:
+                stage.add(bytes_written=50)
+
+    profiler.finish()
+
+    with open(fname_out, "r") as f:
+        report = json.load(f)
+
+    stages = dict((stage["name"], stage) for stage in report["stages"])
+    if sorted(stages.keys()) != ["outer", "outer/inner"]:
+        print("The stages recorded were {0}.".format(list(stages.keys())))
+        pytest.fail()
+
+    inner = stages["outer/inner"]
+    if stages["outer"]["calls"] != 2 or stages["outer"]["num_items"] != 2 or \
+       inner["bytes_read"] != 200 or inner["bytes_written"] != 100:
+        print("The stages were {0}.".format(report["stages"]))
+        pytest.fail()
+
+    # The report is only saved once.
+    if profiler.finish() is not None:
+        print("The report was saved twice.")
+        pytest.fail()
+
+
+def test_runner(tmpdir):
+    """
+    Checks a script run under the profiler saves a report that includes the
+    script's own stages.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    script = str(tmpdir.join("script.py"))
+    with open(script, "w") as f:
+        f.write("import sys\n"
+                "from instrument.profiler import profiler\n"
+                "with profiler.stage('work', num_items=int(sys.argv[1])):\n"
+                "    pass\n")
+
+    # Stands in for ``pip install -e .``.
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [repo_dir,
+                                                      env.get("PYTHONPATH")]))
+
+    fname_out = str(tmpdir.join("report.json"))
+    subprocess.check_call([sys.executable,
+                           "{0}/instrument/profiler.py".format(repo_dir),
+                           "--profile", fname_out, script, "7"],
+                          stdout=subprocess.DEVNULL, env=env)
+
+    with open(fname_out, "r") as f:
+        report = json.load(f)
+
+    stages = dict((stage["name"], stage) for stage in report["stages"])
+    if "run/work" not in stages or stages["run/work"]["num_items"] != 7:
+        print("The stages were {0}.".format(report["stages"]))
+        pytest.fail()
+
+
+if __name__ == "__main__":
+
+    pytest.main([__file__])
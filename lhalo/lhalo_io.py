@@ -0,0 +1,550 @@
+#!/usr/bin:env python
+"""
+Reading and writing LHaloTree files.
+
+A binary LHaloTree file starts with a header of ``NTrees`` and ``NHalos``
+(int32) followed by ``NHalosPerTree`` (int32, one per tree).  The halos of
+each tree follow, one after another, in the structure given by
+``get_LHalo_datastruct``.
+
+Only ``numpy`` is imported when this module is loaded.  ``h5py`` is only
+imported inside the functions that open HDF5 files, so scripts that only need
+the header start quickly.
+"""
+from __future__ import print_function
+import numpy as np
+
+LHalo_Desc_full = [
+    ('Descendant',          np.int32),
+    ('FirstProgenitor',     np.int32),
+    ('NextProgenitor',      np.int32),
+    ('FirstHaloInFOFgroup', np.int32),
+    ('NextHaloInFOFgroup',  np.int32),
+    ('Len',                 np.int32),
+    ('M_mean200',           np.float32),
+    ('Mvir',                np.float32),
+    ('M_TopHat',            np.float32),
+    ('Pos',                 (np.float32, 3)),
+    ('Vel',                 (np.float32, 3)),
+    ('VelDisp',             np.float32),
+    ('Vmax',                np.float32),
+    ('Spin',                (np.float32, 3)),
+    ('MostBoundID',         np.int64),
+    ('SnapNum',             np.int32),
+    ('FileNr',              np.int32),
+    ('SubHaloIndex',        np.int32),
+    ('SubHalfMass',         np.float32)
+                   ]
+
+
+def get_LHalo_datastruct():
+    """
+    Generates the LHalo numpy structured array.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    LHalo_Desc: numpy structured array.  Required.
+        Structured array for the LHaloTree data format.
+    """
+
+    names = [LHalo_Desc_full[i][0] for i in range(len(LHalo_Desc_full))]
+    formats = [LHalo_Desc_full[i][1] for i in range(len(LHalo_Desc_full))]
+    LHalo_Desc = np.dtype({'names': names, 'formats': formats}, align=True)
+
+    return LHalo_Desc
+
+
+def read_header(f_in):
+    """
+    Reads the header of a binary LHaloTree file.
+
+    Parameters
+    ----------
+
+    f_in: Open file. Required.
+        The binary file, positioned at its start.  It is left positioned at
+        the first halo of the first tree.
+
+    Returns
+    ----------
+
+    NTrees, NHalos: Integers.
+        Number of trees and total number of halos in the file.
+
+    NHalosPerTree: Array of integers.
+        Number of halos in each tree.
+    """
+
+    NTrees = int(np.fromfile(f_in, np.dtype(np.int32), 1)[0])
+    NHalos = int(np.fromfile(f_in, np.dtype(np.int32), 1)[0])
+    NHalosPerTree = np.fromfile(f_in, np.dtype(np.int32), NTrees)
+
+    return NTrees, NHalos, NHalosPerTree
+
+
+def get_header_nbytes(NTrees):
+    """
+    Gets the size of the header of a binary LHaloTree file.
+
+    Parameters
+    ----------
+
+    NTrees: Integer. Required.
+        Number of trees in the file.
+
+    Returns
+    ----------
+
+    nbytes: Integer.
+        Size of the header in bytes.
+    """
+
+    return (2 + NTrees) * np.dtype(np.int32).itemsize
+
+
+def read_tree(tree_path, tree_num):
+    """
+    Reads one tree from a binary LHaloTree file.
+
+    The file is seeked straight to the tree, so the trees before it aren't
+    read.
+
+    If ``tree_num`` isn't in the file a ValueError will be raised.
+
+    Parameters
+    ----------
+
+    tree_path: String. Required.
+        Path to the binary file.
+
+    tree_num: Integer. Required.
+        The (zero-based) number of the tree.
+
+    Returns
+    ----------
+
+    tree: LHalo structured array, see ``get_LHalo_datastruct``.
+        The halos of the tree.
+    """
+
+    LHalo_struct = get_LHalo_datastruct()
+
+    with open(tree_path, "rb") as f_in:
+        NTrees, NHalos, NHalosPerTree = read_header(f_in)
+
+        if tree_num < 0 or tree_num >= NTrees:
+            print("The number of trees in file {0} is {1}. You requested to "
+                  "return tree {2}.".format(tree_path, NTrees, tree_num))
+            raise ValueError
+
+        offset = get_header_nbytes(NTrees) + \
+                 int(np.sum(NHalosPerTree[:tree_num], dtype=np.int64)) * \
+                 LHalo_struct.itemsize
+        f_in.seek(offset)
+
+        tree = np.fromfile(f_in, LHalo_struct, NHalosPerTree[tree_num])
+
+    return tree
+
+
+def get_blocks(NHalosPerTree, max_block_halos):
+    """
+    Groups consecutive trees into blocks that are read in one go.
+
+    Trees are added to a block until the next one would take it over
+    ``max_block_halos`` halos.  A tree with more halos than that is a block by
+    itself.
+
+    Parameters
+    ----------
+
+    NHalosPerTree: Array of integers. Required.
+        Number of halos in each tree.
+
+    max_block_halos: Integer. Required.
+        Maximum number of halos in a block of more than one tree.
+
+    Returns
+    ----------
+
+    blocks: List of tuples.
+        ``(first_tree, end_tree, num_halos)`` for each block, where the block
+        holds trees ``first_tree`` up to (but not including) ``end_tree``.
+    """
+
+    blocks = []
+
+    first_tree = 0
+    num_halos = 0
+    for tree_idx, tree_halos in enumerate(NHalosPerTree):
+        tree_halos = int(tree_halos)
+
+        if num_halos + tree_halos > max_block_halos and tree_idx > first_tree:
+            blocks.append((first_tree, tree_idx, num_halos))
+            first_tree = tree_idx
+            num_halos = 0
+
+        num_halos += tree_halos
+
+    if len(NHalosPerTree) > first_tree:
+        blocks.append((first_tree, len(NHalosPerTree), num_halos))
+
+    return blocks
+
+
+def read_exactly(f_in, buf):
+    """
+    Fills an array from a file, without any intermediate copy.
+
+    If the file ends before the array is full a RuntimeError will be raised.
+
+    Parameters
+    ----------
+
+    f_in: Open file. Required.
+        The binary file.
+
+    buf: Contiguous array. Required.
+        The array to fill.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    view = memoryview(buf.view(np.uint8))
+    nbytes = len(view)
+
+    # A single read can return less than was asked for (e.g., Linux caps it
+    # at just under 2 GB).
+    num_read = 0
+    while num_read < nbytes:
+        count = f_in.readinto(view[num_read:])
+        if not count:
+            print("The file {0} ended {1} bytes before the end of the last "
+                  "tree.".format(f_in.name, nbytes - num_read))
+            raise RuntimeError
+        num_read += count
+
+
+def read_blocks(f_in, blocks, buf):
+    """
+    Reads blocks of trees one after another into the same buffer.
+
+    Parameters
+    ----------
+
+    f_in: Open file. Required.
+        The binary file, positioned at the first halo of the first block.
+
+    blocks: List of tuples. Required.
+        See ``get_blocks``.
+
+    buf: LHalo structured array. Required.
+        Buffer large enough for the largest block.
+
+    Yields
+    ----------
+
+    first_tree, end_tree: Integers.
+        The trees in the block, see ``get_blocks``.
+
+    buf: LHalo structured array.
+        The buffer, holding the block's halos.
+    """
+
+    for (first_tree, end_tree, num_halos) in blocks:
+        read_exactly(f_in, buf[:num_halos])
+        yield first_tree, end_tree, buf
+
+
+def prefetch_blocks(f_in, blocks, buf_halos):
+    """
+    Reads blocks of trees on a background thread, one block ahead.
+
+    Two buffers are used in turn: the next block is read into one while the
+    trees of the current block are used from the other.  A buffer is only
+    reused once the block after it has been handed out.
+
+    Parameters
+    ----------
+
+    f_in: Open file. Required.
+        The binary file, positioned at the first halo of the first block.
+
+    blocks: List of tuples. Required.
+        See ``get_blocks``.
+
+    buf_halos: Integer. Required.
+        Number of halos in the largest block.
+
+    Yields
+    ----------
+
+    first_tree, end_tree, buf:
+        See ``read_blocks``.
+    """
+
+    import queue
+    import threading
+
+    LHalo_struct = get_LHalo_datastruct()
+
+    free = queue.Queue()
+    filled = queue.Queue()
+    for _ in range(2):
+        free.put(np.empty(buf_halos, dtype=LHalo_struct))
+
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for (first_tree, end_tree, num_halos) in blocks:
+                buf = free.get()
+                if stop.is_set():
+                    return
+                read_exactly(f_in, buf[:num_halos])
+                filled.put((first_tree, end_tree, buf))
+        except Exception as err:
+            filled.put(err)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+
+    held = None
+    try:
+        for _ in range(len(blocks)):
+            block = filled.get()
+            if isinstance(block, Exception):
+                raise block
+
+            # The previous block's trees are finished with, so its buffer can
+            # be filled again.
+            if held is not None:
+                free.put(held)
+            held = block[2]
+
+            yield block
+    finally:
+        stop.set()
+        free.put(None)
+        thread.join()
+
+
+def iterate_trees(tree_path, block_nbytes=2**24, prefetch=False):
+    """
+    Iterates over the trees of a binary LHaloTree file in order.
+
+    The trees are read in blocks of about ``block_nbytes`` with ``readinto``
+    straight into a buffer that is reused for every block, and each tree is
+    yielded as a view into it.  No memory is allocated per tree, so a full scan
+    runs at close to the speed of the disk.
+
+    The view of a tree is only valid until the next tree (``prefetch=False``)
+    or the next block (``prefetch=True``) is read.  Use ``tree.copy()`` to keep
+    a tree for longer.
+
+    Parameters
+    ----------
+
+    tree_path: String. Required.
+        Path to the binary file.
+
+    block_nbytes: Integer. Optional, default 2**24.
+        Size (bytes) of the blocks read.  The buffer is large enough for
+        whichever is larger of this and the largest tree.
+
+    prefetch: Boolean. Optional, default False.
+        If True, the next block is read on a background thread while the
+        trees of the current block are used.  Twice the memory is used.
+
+    Yields
+    ----------
+
+    tree_idx: Integer.
+        The number of the tree.
+
+    tree: LHalo structured array, see ``get_LHalo_datastruct``.
+        The halos of the tree.
+    """
+
+    LHalo_struct = get_LHalo_datastruct()
+
+    # Unbuffered, so ``readinto`` goes straight into our buffer.
+    with open(tree_path, "rb", buffering=0) as f_in:
+        NTrees, NHalos, NHalosPerTree = read_header(f_in)
+        f_in.seek(get_header_nbytes(NTrees))
+
+        max_block_halos = max(block_nbytes // LHalo_struct.itemsize, 1)
+        blocks = get_blocks(NHalosPerTree, max_block_halos)
+        buf_halos = max([num_halos for (_, _, num_halos) in blocks] + [0])
+
+        if prefetch:
+            block_reader = prefetch_blocks(f_in, blocks, buf_halos)
+        else:
+            buf = np.empty(buf_halos, dtype=LHalo_struct)
+            block_reader = read_blocks(f_in, blocks, buf)
+
+        try:
+            for (first_tree, end_tree, buf) in block_reader:
+                start = 0
+                for tree_idx in range(first_tree, end_tree):
+                    end = start + NHalosPerTree[tree_idx]
+                    yield tree_idx, buf[start:end]
+                    start = end
+        finally:
+            block_reader.close()
+
+
+def write_header(f_out, NHalosPerTree):
+    """
+    Writes the header of a binary LHaloTree file.
+
+    Parameters
+    ----------
+
+    f_out: Open file. Required.
+        The binary file, positioned at its start.
+
+    NHalosPerTree: Array of integers. Required.
+        Number of halos in each tree.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    NHalosPerTree = np.asarray(NHalosPerTree, dtype=np.int32)
+
+    header = np.empty(2 + len(NHalosPerTree), dtype=np.int32)
+    header[0] = len(NHalosPerTree)
+    header[1] = NHalosPerTree.sum()
+    header[2:] = NHalosPerTree
+
+    header.tofile(f_out)
+
+
+def write_binary(tree_path, trees):
+    """
+    Writes trees to a binary LHaloTree file.
+
+    Parameters
+    ----------
+
+    tree_path: String. Required.
+        Path to the binary file.
+
+    trees: List of LHalo structured arrays. Required.
+        The trees, see ``get_LHalo_datastruct``.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    LHalo_struct = get_LHalo_datastruct()
+
+    with open(tree_path, "wb") as f_out:
+        write_header(f_out, [len(tree) for tree in trees])
+
+        for tree in trees:
+            np.asarray(tree, dtype=LHalo_struct).tofile(f_out)
+
+
+def write_hdf5_header(hdf5_file, NTrees, NHalos, NHalosPerTree):
+    """
+    Writes the LHaloTree header to an open HDF5 file.
+
+    Parameters
+    ----------
+
+    hdf5_file: ``h5py.File``. Required.
+        The open HDF5 file.
+
+    NTrees, NHalos, NHalosPerTree: Required.
+        See ``read_header``.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    header = hdf5_file.create_group("Header")
+    header.attrs.create("Ntrees", NTrees, dtype=np.int32)
+    header.attrs.create("totNHalos", NHalos, dtype=np.int32)
+    header.attrs.create("TreeNHalos", NHalosPerTree, dtype=np.int32)
+
+
+def write_hdf5_tree(hdf5_file, tree_idx, tree):
+    """
+    Writes one tree to an open HDF5 file as the group 'tree_XXX', with one
+    dataset per field.
+
+    Parameters
+    ----------
+
+    hdf5_file: ``h5py.File``. Required.
+        The open HDF5 file.
+
+    tree_idx: Integer. Required.
+        The number of the tree.
+
+    tree: LHalo structured array. Required.
+        The halos of the tree.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    tree_name = "tree_{0:03d}".format(tree_idx)
+    group = hdf5_file.create_group(tree_name)
+
+    for field in tree.dtype.names:
+        group[field] = tree[field]
+
+
+def read_hdf5_tree(hdf5_path, tree_idx):
+    """
+    Reads one tree written by ``write_hdf5_tree``.
+
+    Parameters
+    ----------
+
+    hdf5_path: String. Required.
+        Path to the HDF5 file.
+
+    tree_idx: Integer. Required.
+        The number of the tree.
+
+    Returns
+    ----------
+
+    tree: LHalo structured array, see ``get_LHalo_datastruct``.
+        The halos of the tree.
+    """
+
+    import h5py
+
+    LHalo_struct = get_LHalo_datastruct()
+
+    with h5py.File(hdf5_path, "r") as hdf5_file:
+        group = hdf5_file["tree_{0:03d}".format(tree_idx)]
+
+        tree = np.empty(len(group[LHalo_struct.names[0]]), dtype=LHalo_struct)
+        for field in LHalo_struct.names:
+            tree[field] = group[field][:]
+
+    return tree
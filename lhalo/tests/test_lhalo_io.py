@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import numpy as np
+import subprocess
+import sys
+import os
+import pytest
+
+test_dir = os.path.dirname(os.path.realpath(__file__))
+repo_dir = "{0}/../../".format(test_dir)
+sys.path.append(repo_dir)
+
+from lhalo import lhalo_io
+
+
+def make_trees(NHalosPerTree):
+    """
+    Makes trees with every field set to a different value.
+
+    Parameters
+    ----------
+
+    NHalosPerTree: List of integers. Required.
+        Number of halos in each tree.
+
+    Returns
+    ----------
+
+    trees: List of LHalo structured arrays.
+        The trees.
+    """
+
+    LHalo_struct = lhalo_io.get_LHalo_datastruct()
+
+    trees = []
+    for tree_idx, num_halos in enumerate(NHalosPerTree):
+        tree = np.zeros(num_halos, dtype=LHalo_struct)
+        tree["Descendant"] = np.arange(num_halos) - 1
+        tree["SnapNum"] = 63 - np.arange(num_halos)
+        tree["Mvir"] = tree_idx + np.arange(num_halos) / 10.0
+        tree["Pos"] = tree_idx
+        tree["MostBoundID"] = 2**40 + tree_idx
+        trees.append(tree)
+
+    return trees
+
+
+def test_binary_roundtrip(tmpdir):
+    """
+    Checks trees written to a binary file are read back by each reader.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    NHalosPerTree = [3, 0, 5, 1]
+    trees = make_trees(NHalosPerTree)
+
+    tree_path = str(tmpdir.join("trees.dat"))
+    lhalo_io.write_binary(tree_path, trees)
+
+    with open(tree_path, "rb") as f_in:
+        NTrees, NHalos, header_NHalosPerTree = lhalo_io.read_header(f_in)
+        if f_in.tell() != lhalo_io.get_header_nbytes(NTrees):
+            print("The header was {0} bytes but {1} were read."
+                  .format(lhalo_io.get_header_nbytes(NTrees), f_in.tell()))
+            pytest.fail()
+
+    if NTrees != 4 or NHalos != 9 or \
+       list(header_NHalosPerTree) != NHalosPerTree:
+        print("The header was {0}, {1}, {2}.".format(NTrees, NHalos,
+                                                     header_NHalosPerTree))
+        pytest.fail()
+
+    for tree_idx, tree in lhalo_io.iterate_trees(tree_path):
+        if not np.array_equal(tree, trees[tree_idx]):
+            print("Tree {0} was not iterated correctly.".format(tree_idx))
+            pytest.fail()
+
+    for tree_idx in [3, 0, 2]:
+        if not np.array_equal(lhalo_io.read_tree(tree_path, tree_idx),
+                              trees[tree_idx]):
+            print("Tree {0} was not read correctly.".format(tree_idx))
+            pytest.fail()
+
+    with pytest.raises(ValueError):
+        lhalo_io.read_tree(tree_path, 4)
+
+
+def test_hdf5_roundtrip(tmpdir):
+    """
+    Checks a tree written to HDF5 is read back unchanged.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    h5py = pytest.importorskip("h5py")
+
+    tree = make_trees([4])[0]
+
+    hdf5_path = str(tmpdir.join("trees.hdf5"))
+    with h5py.File(hdf5_path, "w") as hdf5_file:
+        lhalo_io.write_hdf5_header(hdf5_file, 1, len(tree), [len(tree)])
+        lhalo_io.write_hdf5_tree(hdf5_file, 0, tree)
+
+    if not np.array_equal(lhalo_io.read_hdf5_tree(hdf5_path, 0), tree):
+        print("The HDF5 tree was not read correctly.")
+        pytest.fail()
+
+
+def test_lazy_imports():
+    """
+    Checks importing the reader and the scripts using it doesn't import any of
+    the slow plotting or HDF5 packages.
+
+    Parameters
+    ----------
+
+    None.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    code = ("import sys\n"
+            "sys.path[:0] = ['{0}/tree_walker', '{0}/lhalo_to_hdf5', '{0}']\n"
+            "import lhalo.lhalo_io, tree_walker, lhalo_to_hdf5\n"
+            "assert hasattr(lhalo_to_hdf5, 'convert_binary_to_hdf5')\n"
+            "heavy = ['h5py', 'tqdm', 'matplotlib', 'networkx', 'pygraphviz']\n"
+            "print(' '.join(m for m in heavy if m in sys.modules))\n"
+            .format(os.path.abspath(repo_dir)))
+
+    loaded = subprocess.check_output([sys.executable, "-c", code]).decode()
+
+    if loaded.strip():
+        print("Importing the LHaloTree reader also imported {0}."
+              .format(loaded.strip()))
+        pytest.fail()
+
+
+def test_streaming(tmpdir):
+    """
+    Checks the streaming reader gives the same trees for any block size, with
+    and without prefetching, and can be stopped early.
+
+    Parameters
+    ----------
+
+    tmpdir: ``py.path.local``. Required.
+        Temporary directory provided by ``pytest``.
+
+    Returns
+    ----------
+
+    None. ``Pytest.fail()`` is invoked if the test fails.
+    """
+
+    # Includes an empty tree and one larger than the smallest blocks.
+    NHalosPerTree = [3, 0, 40, 1, 7, 7, 2]
+    trees = make_trees(NHalosPerTree)
+
+    tree_path = str(tmpdir.join("trees.dat"))
+    lhalo_io.write_binary(tree_path, trees)
+
+    itemsize = lhalo_io.get_LHalo_datastruct().itemsize
+
+    for block_nbytes in [1, 5 * itemsize, 16 * itemsize, 2**24]:
+        for prefetch in [False, True]:
+            tree_idxs = []
+            for tree_idx, tree in lhalo_io.iterate_trees(tree_path,
+                                                         block_nbytes,
+                                                         prefetch):
+                tree_idxs.append(tree_idx)
+                if not np.array_equal(tree, trees[tree_idx]):
+                    print("Tree {0} was not streamed correctly with blocks "
+                          "of {1} bytes and prefetch {2}."
+                          .format(tree_idx, block_nbytes, prefetch))
+                    pytest.fail()
+
+            if tree_idxs != list(range(len(NHalosPerTree))):
+                print("The trees streamed were {0}.".format(tree_idxs))
+                pytest.fail()
+
+    # Stopping early must not leave the prefetching thread waiting.
+    for tree_idx, tree in lhalo_io.iterate_trees(tree_path, itemsize,
+                                                 prefetch=True):
+        if tree_idx == 2:
+            break
+
+    # A truncated file is an error rather than a short tree.
+    with open(tree_path, "rb") as f_in:
+        content = f_in.read()
+    with open(tree_path, "wb") as f_out:
+        f_out.write(content[:-itemsize])
+
+    for prefetch in [False, True]:
+        with pytest.raises(RuntimeError):
+            for tree_idx, tree in lhalo_io.iterate_trees(tree_path,
+                                                         prefetch=prefetch):
+                pass
@@ -1,55 +1,11 @@
 #!/usr/bin:env python
 from __future__ import print_function
 import numpy as np
-import h5py
-from tqdm import tqdm
 import argparse
-import time
 
-
-def get_LHalo_datastruct():
-    """
-    Generates the LHalo numpy structured array.
-
-    Parameters
-    ----------
-
-    None.
-
-    Returns
-    ----------
-
-    LHalo_Desc: numpy structured array.  Required.
-        Structured array for the LHaloTree data format.
-    """
-
-    LHalo_Desc_full = [
-        ('Descendant',          np.int32),
-        ('FirstProgenitor',     np.int32),
-        ('NextProgenitor',      np.int32),
-        ('FirstHaloInFOFgroup', np.int32),
-        ('NextHaloInFOFgroup',  np.int32),
-        ('Len',                 np.int32),
-        ('M_mean200',           np.float32),
-        ('Mvir',                np.float32),
-        ('M_TopHat',            np.float32),
-        ('Pos',                 (np.float32, 3)),
-        ('Vel',                 (np.float32, 3)),
-        ('VelDisp',             np.float32),
-        ('Vmax',                np.float32),
-        ('Spin',                (np.float32, 3)),
-        ('MostBoundID',         np.int64),
-        ('SnapNum',             np.int32),
-        ('FileNr',              np.int32),
-        ('SubHaloIndex',        np.int32),
-        ('SubHalfMass',         np.float32)
-                         ]
-
-    names = [LHalo_Desc_full[i][0] for i in range(len(LHalo_Desc_full))]
-    formats = [LHalo_Desc_full[i][1] for i in range(len(LHalo_Desc_full))]
-    LHalo_Desc = np.dtype({'names': names, 'formats': formats}, align=True)
-
-    return LHalo_Desc
+from lhalo import lhalo_io
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
 
 
 def parse_inputs():
@@ -78,6 +34,7 @@ def parse_inputs():
                         help="Path to the input HDF5 data file. Required.")
     parser.add_argument("-o", "--fname_out", dest="fname_out",
                         help="Path to the output HDF5 data file. Required.")
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
 
@@ -115,49 +72,45 @@ def convert_binary_to_hdf5(args):
     None
     """
 
-    LHalo_Struct = get_LHalo_datastruct()
+    # Only needed for the conversion itself, so not imported at startup.
+    import h5py
+    from tqdm import tqdm
+
+    LHalo_Struct = lhalo_io.get_LHalo_datastruct()
 
     with open(args["fname_in"], "rb") as binary_file, \
          h5py.File(args["fname_out"], "w") as hdf5_file:
 
-        binary_file = open(args["fname_in"], "rb")
-
         # First get header info from the binary file.
-        NTrees = np.fromfile(binary_file, np.dtype(np.int32), 1)[0]
-        NHalos = np.fromfile(binary_file, np.dtype(np.int32), 1)[0]
-        NHalosPerTree = np.fromfile(binary_file,
-                                    np.dtype((np.int32, NTrees)), 1)[0]
+        with profiler.stage("read_header"):
+            NTrees, NHalos, NHalosPerTree = lhalo_io.read_header(binary_file)
 
         print("For file {0} there are {1} trees with {2} total halos"
               .format(args["fname_in"], NTrees, NHalos))
 
         # Write the header information to the HDF5 file.
         """
-        hdf5_file.create_group("Header")
-        hdf5_file["Header"].attrs.create("Ntrees", NTrees, dtype=np.int32)
-        hdf5_file["Header"].attrs.create("totNHalos", NHalos, dtype=np.int32)
-        hdf5_file["Header"].attrs.create("TreeNHalos", NHalosPerTree,
-                                         dtype=np.int32)
+        lhalo_io.write_hdf5_header(hdf5_file, NTrees, NHalos, NHalosPerTree)
         """
         # Now loop over each tree and write the information to the HDF5 file.
-        for tree_idx in tqdm(range(NTrees)):
-            binary_tree = np.fromfile(binary_file, LHalo_Struct,
-                                      NHalosPerTree[tree_idx])
-
-            for halo_idx in range(NHalosPerTree[tree_idx]):
-                filenr = binary_tree["FileNr"][halo_idx]
-                if filenr != 0:
-                    print("Halo {0} FileNr {1}".format(halo_idx, filenr))
-
-            """
-            tree_name = "tree_{0:03d}".format(tree_idx)
-            hdf5_file.create_group(tree_name)
-
-            for subgroup_name in LHalo_Struct.names:
-                hdf5_file[tree_name][subgroup_name] = binary_tree[subgroup_name]
-            """
+        with profiler.stage("convert_trees", num_items=NTrees,
+                            bytes_read=NHalos * LHalo_Struct.itemsize):
+            # The trees are streamed through a reused buffer, with the next
+            # block read in the background.
+            trees = lhalo_io.iterate_trees(args["fname_in"], prefetch=True)
+            for tree_idx, binary_tree in tqdm(trees, total=NTrees):
+
+                filenr = binary_tree["FileNr"]
+                for halo_idx in np.nonzero(filenr != 0)[0]:
+                    print("Halo {0} FileNr {1}".format(halo_idx,
+                                                       filenr[halo_idx]))
+
+                """
+                lhalo_io.write_hdf5_tree(hdf5_file, tree_idx, binary_tree)
+                """
 
 if __name__ == "__main__":
 
     args = parse_inputs()
+    enable_from_args(args, "lhalo_to_hdf5")
     convert_binary_to_hdf5(args)
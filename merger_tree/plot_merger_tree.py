@@ -15,12 +15,14 @@ Author: Jacob Seiler
 #!/usr/bin:env python
 from __future__ import print_function
 import numpy as np
-import networkx as nx
-import pygraphviz as pgv
+import argparse
 
-import matplotlib as mpl
-mpl.use('PS')  # This is necessary to get matplotlib working on Mac.
-import matplotlib.cm as cm
+from lhalo import lhalo_io
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
+# matplotlib, networkx and pygraphviz are slow to import so they are only
+# imported by the functions that plot.
 
 class SimInfo(object):
 
@@ -81,51 +83,6 @@ class SimInfo(object):
         self._name = name
 
 
-def get_LHalo_datastruct():
-    """
-    Generates the LHalo numpy structured array.
-
-    Parameters
-    ----------
-
-    None.
-
-    Returns
-    ----------
-
-    LHalo_Desc: numpy structured array.  Required.
-        Structured array for the LHaloTree data format.
-    """
-
-    LHalo_Desc_full = [
-        ('Descendant',          np.int32),
-        ('FirstProgenitor',     np.int32),
-        ('NextProgenitor',      np.int32),
-        ('FirstHaloInFOFgroup', np.int32),
-        ('NextHaloInFOFgroup',  np.int32),
-        ('Len',                 np.int32),
-        ('M_mean200',           np.float32),
-        ('Mvir',                np.float32),
-        ('M_TopHat',            np.float32),
-        ('Pos',                 (np.float32, 3)),
-        ('Vel',                 (np.float32, 3)),
-        ('VelDisp',             np.float32),
-        ('Vmax',                np.float32),
-        ('Spin',                (np.float32, 3)),
-        ('MostBoundID',         np.int64),
-        ('SnapNum',             np.int32),
-        ('FileNr',              np.int32),
-        ('SubHaloIndex',        np.int32),
-        ('SubHalfMass',         np.float32)
-                         ]
-
-    names = [LHalo_Desc_full[i][0] for i in range(len(LHalo_Desc_full))]
-    formats = [LHalo_Desc_full[i][1] for i in range(len(LHalo_Desc_full))]
-    LHalo_Desc = np.dtype({'names': names, 'formats': formats}, align=True)
-
-    return LHalo_Desc
-
-
 def read_tree(tree_path, tree_num=None, num_root_fofs=None, root_snap_num=None, 
               num_halos=0):
     """
@@ -153,7 +110,7 @@ def read_tree(tree_path, tree_num=None, num_root_fofs=None, root_snap_num=None,
     Returns
     -------
 
-    tree: LHalo structure, specified by :py:func:`~get_LHalo_datastruct`
+    tree: LHalo structure, specified by :py:func:`~lhalo.lhalo_io.get_LHalo_datastruct`
         The specified tree.
     """
 
@@ -168,51 +125,32 @@ def read_tree(tree_path, tree_num=None, num_root_fofs=None, root_snap_num=None,
               f"values are {tree_num} and {num_root_fofs} respectively.")
         raise ValueError
 
-    # Structure to hold the trees.
-    LHalo_struct = get_LHalo_datastruct()
+    # A specific tree can be read straight from its position in the file.
+    if tree_num is not None:
+        tree = lhalo_io.read_tree(tree_path, tree_num)
+        print(f"Returning tree {tree_num}")
+        return tree
 
     with open(tree_path, "rb") as f_in:
+        NTrees, NHalos, NHalosPerTree = lhalo_io.read_header(f_in)
+
+    # Maybe the user asked for a tree with more halos than there are in ANY tree.
+    if num_halos > np.max(NHalosPerTree):
+        print(f"You requested a tree with at least {num_halos}. However, the "
+              f"maximum number of halos in any tree in file {tree_path} is "
+              f"{np.max(NHalosPerTree)}")
+        raise ValueError
 
-        # First get header info.
-        NTrees = np.fromfile(f_in, np.dtype(np.int32), 1)[0]
-        NHalos = np.fromfile(f_in, np.dtype(np.int32), 1)[0]
-        NHalosPerTree = np.fromfile(f_in, np.dtype((np.int32, NTrees)), 1)[0]
-
-        # If we asked for a tree number that is greater than the number of trees, then we
-        # can simply exit here.
-        if tree_num is not None:
-            if tree_num > NTrees:
-                print(f"The number of trees in file {tree_path} is {NTrees}. You requested to "
-                      f"return tree {tree_num}.")
-                raise ValueError
-
-        # Maybe the user asked for a tree with more halos than there are in ANY tree.
-        if num_root_fofs is not None:
-            if num_halos > np.max(NHalosPerTree):
-                print(f"You requested a tree with at least {num_halos}. However, the "
-                      f"maximum number of halos in any tree in file {tree_path} is "
-                      f"{np.max(NHalosPerTree)}")
-                raise ValueError
-
-        # Search for the requested tree.
-        for tree_idx in range(NTrees):
-
-            tree = np.fromfile(f_in, LHalo_struct, NHalosPerTree[tree_idx])
-
-            # If we're searching for a tree with a specified number of root FoFs, then
-            # check number of FoFs.  Also check the total number of halos in the tree.
-            if num_root_fofs is not None:
-                if len(np.where(tree["SnapNum"][:] == root_snap_num)[0]) == num_root_fofs \
-                    and len(tree) >= num_halos:
-                    print(f"Tree {tree_idx} has {num_root_fofs} root FoFs and a total of "
-                          f"{len(tree)} halos. Returning it.")
-                    return tree
-
-            # If we're searching for a specific tree and we're at that tree, return it.
-            if tree_num is not None:
-                if tree_idx == tree_num:
-                    print(f"Returning tree {tree_num}")
-                    return tree
+    # Search for the requested tree.
+    for tree_idx, tree in lhalo_io.iterate_trees(tree_path):
+
+        # Check the number of FoFs and the total number of halos in the tree.
+        if len(np.where(tree["SnapNum"][:] == root_snap_num)[0]) == num_root_fofs \
+            and len(tree) >= num_halos:
+            print(f"Tree {tree_idx} has {num_root_fofs} root FoFs and a total of "
+                  f"{len(tree)} halos. Returning it.")
+            # The iterator reuses its buffer, so keep our own copy.
+            return tree.copy()
 
     # If we reach here, we didn't hit the desired tree number or number of root FoFs somehow.
     print(f"After searching through all trees in {tree_path}, we could not find tree "
@@ -222,6 +160,24 @@ def read_tree(tree_path, tree_num=None, num_root_fofs=None, root_snap_num=None,
     return None
 
 
+def import_matplotlib():
+    """
+    Imports ``matplotlib`` for the plotting functions.
+
+    Returns
+    -------
+
+    mpl, cm: modules
+        ``matplotlib`` and ``matplotlib.cm``.
+    """
+
+    import matplotlib as mpl
+    mpl.use('PS')  # This is necessary to get matplotlib working on Mac.
+    import matplotlib.cm as cm
+
+    return mpl, cm
+
+
 def get_cmap_map(cmap_name, min_val, max_val, cmap_dir=None):
     """
     Gets a colormap and normalizes its values based on min/max values.
@@ -265,6 +221,8 @@ def get_cmap_map(cmap_name, min_val, max_val, cmap_dir=None):
 
     cmap = cmap_name
 
+    mpl, cm = import_matplotlib()
+
     # Normalize the colormap between the specified values.
     norm = mpl.colors.Normalize(vmin=min_val, vmax=max_val)
     m = cm.ScalarMappable(norm=norm, cmap=cmap)
@@ -293,6 +251,8 @@ def convert_networkx_to_graphvis(networkx_graph, halos_per_snapshot):
         ``pygraphviz`` graph with the nodes ranked by snapshot number.
     """
 
+    import networkx as nx
+
     # First convert the graph into a pygraphviz one.
     A = nx.nx_agraph.to_agraph(networkx_graph)
 
@@ -314,7 +274,7 @@ def plot_merger_tree(sim, tree, snapshots_to_plot, fname_out, cmap_map=None):
     sim: :py:class:`~SimInfo`
         Information about the simulation used for this tree.
 
-    tree: LHalo structure, specified by :py:func:`~get_LHalo_datastruct`
+    tree: LHalo structure, specified by :py:func:`~lhalo.lhalo_io.get_LHalo_datastruct`
         The tree being plotted.
 
     snapshots_to_plot: list or array-like of ints
@@ -332,6 +292,9 @@ def plot_merger_tree(sim, tree, snapshots_to_plot, fname_out, cmap_map=None):
     The graph saved as ``fname_out``.
     """
 
+    import networkx as nx
+    mpl, _ = import_matplotlib()
+
     # When we plot, we want to order them by their snapshots. When we go through the tree,
     # we will need to remember which halo is at which snapshot.
     halo_snapshot = {}
@@ -449,6 +412,11 @@ def plot_merger_tree(sim, tree, snapshots_to_plot, fname_out, cmap_map=None):
 
 if __name__ == '__main__':
 
+    # The inputs are set below; only profiling is set on the command line.
+    parser = argparse.ArgumentParser()
+    add_profile_arguments(parser)
+    enable_from_args(vars(parser.parse_args()), "plot_merger_tree")
+
     # Get some information about the simulation we're using.
     sim = SimInfo("Millennium", max_num_parts=2e6)
 
@@ -468,10 +436,13 @@ if __name__ == '__main__':
     num_root_fofs = None 
     root_snap_num = sim.root_snapnum
     num_halos = 0
-    tree = read_tree(tree_path, tree_num=tree_num, num_root_fofs=num_root_fofs,
-                     root_snap_num=root_snap_num, num_halos=num_halos)
+    with profiler.stage("read_tree") as stage:
+        tree = read_tree(tree_path, tree_num=tree_num, num_root_fofs=num_root_fofs,
+                         root_snap_num=root_snap_num, num_halos=num_halos)
+        stage.add(num_items=len(tree), bytes_read=tree.nbytes)
 
     # Time to plot the tree.
     snapshots_to_plot = np.arange(0, root_snap_num+1)
     fname_out = "mill/complex_merger_tree.png"
-    plot_merger_tree(sim, tree, snapshots_to_plot, fname_out, cmap_map=None) 
+    with profiler.stage("plot_merger_tree", num_items=len(tree)):
+        plot_merger_tree(sim, tree, snapshots_to_plot, fname_out, cmap_map=None)
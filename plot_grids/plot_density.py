@@ -1,11 +1,11 @@
 #!/usr/bin/env python
+import argparse
 import os
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import matplotlib.patheffects as PathEffects
 import numpy as np
 
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
 
 def read_binary_grid(filepath, GridSize, precision, reshape=True):
     '''
@@ -73,6 +73,12 @@ def plot_density_slice(density_path, snapshot, gridsize, slice_idx, slice_thickn
     #density_fname = f"{density_path}{snapshot:03}.dens.dat"
     density_fname = f"{density_path}_{snapshot}.dens.dat"
 
+    # matplotlib is only needed for the plot, not to read the grid.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import matplotlib.patheffects as PathEffects
+
     if double_precision:
         precision = 2
     else:
@@ -147,6 +153,11 @@ def plot_density_slice(density_path, snapshot, gridsize, slice_idx, slice_thickn
 
 if __name__ == "__main__":
 
+    # The inputs are set below; only profiling is set on the command line.
+    parser = argparse.ArgumentParser()
+    add_profile_arguments(parser)
+    enable_from_args(vars(parser.parse_args()), "plot_density")
+
     #density_path = "/fred/oz004/jseiler/kali/density_fields/1024_subsampled_256/snap"
     density_path = "/fred/oz004/jseiler/kali/density_fields/1024/snap"
     snapshot = 98
@@ -155,4 +166,5 @@ if __name__ == "__main__":
 
     output_fname = f"./plots/density_{snapshot:03}.png"
 
-    plot_density_slice(density_path, snapshot, gridsize, 128, 1, 108.08, double, output_fname)
+    with profiler.stage("plot_density_slice"):
+        plot_density_slice(density_path, snapshot, gridsize, 128, 1, 108.08, double, output_fname)
@@ -0,0 +1,18 @@
+#!/usr/bin/env python
+"""
+Installs the code shared by the scripts in this repository:
+
+- ``lhalo``: reading and writing LHaloTree files.
+- ``instrument``: the per-stage profiler behind ``--profile``.
+
+The scripts themselves are still run from their own directories, e.g.
+``python grid_particles/grid_particles.py ...``.
+"""
+from setuptools import setup
+
+setup(name="short_scripts",
+      version="0.1",
+      description="Shared code for the short scripts in this repository.",
+      packages=["lhalo", "instrument"],
+      install_requires=["numpy"],
+      extras_require={"hdf5": ["h5py"]})
@@ -6,6 +6,9 @@ import os
 from scipy import ndimage
 import itertools
 
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
+
 
 def parse_inputs():
     """
@@ -54,6 +57,7 @@ def parse_inputs():
                         help="Size of the grid (i.e., number of cells per "
                              "dimension) of output grid. Required.",
                         type=int)
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
 
@@ -198,15 +202,18 @@ def subsample_grid(args):
 
     conversion = int(args["gridsize_in"] / args["gridsize_out"])
 
-    full_density = read_grid(args["fname_in"], args["gridsize_in"], 
-                             args["precision"]) 
+    with profiler.stage("read_grid", num_items=args["gridsize_in"]**3,
+                        bytes_read=os.path.getsize(args["fname_in"])):
+        full_density = read_grid(args["fname_in"], args["gridsize_in"], 
+                                 args["precision"]) 
 
     footprint = np.ones((conversion, conversion, conversion))
 
     print("Input grid read, now convolving with the footprint.")
     # First generate a grid that contains the sliding sum of the original
     # density.
-    new_density = ndimage.convolve(full_density, footprint, mode='wrap')  
+    with profiler.stage("convolve", num_items=args["gridsize_in"]**3):
+        new_density = ndimage.convolve(full_density, footprint, mode='wrap')  
 
     # Now since we want our new cells to be the discrete average (i.e., no
     # overlaps), we will only use every ``conversion`` cells.
@@ -215,20 +222,24 @@ def subsample_grid(args):
     final_new_density = np.zeros((args["gridsize_out"], args["gridsize_out"],
                                   args["gridsize_out"]))
 
-    for (i, j, k) in itertools.product(range(args["gridsize_out"]),
-                                       range(args["gridsize_out"]),
-                                       range(args["gridsize_out"])): 
-        final_new_density[i, j, k] = new_density[i * conversion, 
-                                                 j * conversion, 
-                                                 k * conversion] \
-                                                / pow(conversion,3.0)
+    with profiler.stage("sample", num_items=args["gridsize_out"]**3):
+        for (i, j, k) in itertools.product(range(args["gridsize_out"]),
+                                           range(args["gridsize_out"]),
+                                           range(args["gridsize_out"])): 
+            final_new_density[i, j, k] = new_density[i * conversion, 
+                                                     j * conversion, 
+                                                     k * conversion] \
+                                                    / pow(conversion,3.0)
 
     
-    final_new_density.tofile(args["fname_out"])
+    with profiler.stage("write_grid", num_items=final_new_density.size,
+                        bytes_written=final_new_density.nbytes):
+        final_new_density.tofile(args["fname_out"])
     print("Subsampled grid saved to {0}".format(args["fname_out"]))
 
    
 if __name__ == '__main__':
 
     args = parse_inputs()    
+    enable_from_args(args, "subsample_grid")
     subsample_grid(args)
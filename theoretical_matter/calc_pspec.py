@@ -3,12 +3,12 @@ from __future__ import print_function
 import numpy as np
 import argparse
 import os
-import itertools
-from scipy.integrate import quad
+import hashlib
+
+from cosmology import Cosmology
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
 
-h = 0.681
-OmegaM = 0.302
-OmegaL= 0.698
 
 def parse_inputs():
     """
@@ -44,11 +44,32 @@ def parse_inputs():
     parser.add_argument("-f", "--camb_in", dest="camb_in",
                         help="Path to the input matter power spectrum from "
                         "CAMB. Required.")
-    parser.add_argument("-z", "--redshift", dest="redshift",
-                        help="Redshift we're calculating the power spectrum "
-                        "for. Required.", type = float)
+    parser.add_argument("-z", "--redshift", dest="redshift", nargs="+",
+                        help="Redshift(s) we're calculating the power spectrum "
+                        "for. If more than one is given, all spectra are saved "
+                        "to a single file. Required (or --redshift_range).",
+                        type = float)
+    parser.add_argument("-r", "--redshift_range", dest="redshift_range",
+                        nargs=3, metavar=("Z_LOW", "Z_HIGH", "NUM_Z"),
+                        help="Calculate the power spectrum at NUM_Z redshifts "
+                        "evenly spaced between Z_LOW and Z_HIGH (inclusive) "
+                        "and save them to a single file.", type = float)
     parser.add_argument("-o", "--fname_out", dest="fname_out",
                         help="Path to the ouput file. Required.")
+    parser.add_argument("--cache_dir", dest="cache_dir",
+                        help="Directory the binary copy of the CAMB input is "
+                        "cached in. Default: same directory as the CAMB "
+                        "input.")
+    parser.add_argument("--hubble_h", dest="hubble_h",
+                        help="Hubble constant in units of 100 km/s/Mpc. "
+                        "Default: 0.681.", default=0.681, type=float)
+    parser.add_argument("--OmegaM", dest="OmegaM",
+                        help="Matter density parameter. Default: 0.302.",
+                        default=0.302, type=float)
+    parser.add_argument("--OmegaL", dest="OmegaL",
+                        help="Dark energy density parameter. Default: 0.698.",
+                        default=0.698, type=float)
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
 
@@ -58,68 +79,297 @@ def parse_inputs():
         parser.print_help()
         raise ValueError 
 
-    if args.redshift is None:
+    if args.redshift is None and args.redshift_range is None:
         print("Require a redshift to calculate the power spectrum at.")
         parser.print_help()
         raise ValueError 
 
+    if args.redshift is not None and args.redshift_range is not None:
+        print("Only one of --redshift and --redshift_range can be specified.")
+        parser.print_help()
+        raise ValueError
+
+    # A range is just shorthand for a list of redshifts.
+    if args.redshift_range is not None:
+        z_low, z_high, num_z = args.redshift_range
+        args.redshift = list(np.linspace(z_low, z_high, int(num_z)))
+
+    # A single redshift keeps the original three-file output.
+    if len(args.redshift) == 1:
+        args.redshift = args.redshift[0]
+
     # Print some useful startup info. #
     print("")
     print("======================================")
     print("Input Power Spectrum: {0}".format(args.camb_in))
     print("Output File: {0}".format(args.fname_out))
     print("Redshift: {0}".format(args.redshift))
+    print("Cosmology: h = {0}, OmegaM = {1}, OmegaL = {2}"
+          .format(args.hubble_h, args.OmegaM, args.OmegaL))
     print("======================================")
     print("")
 
     return vars(args)
 
 
-def growth_int(z):
-    return (1 + z) / pow(Hubble_z(h * 100, OmegaM, OmegaL, z), 3.0) 
-          
+def get_cosmology(args):
+    """
+    Builds the cosmology specified at runtime.
 
-def Hubble_z(Hubble0, OmegaM, OmegaL, z):
+    Parameters
+    ----------
 
-    return pow(Hubble0 *Hubble0 * (OmegaM * pow(1.0+z,3.0) + OmegaL), 0.5) 
+    args: Dictionary.  Required.
+        Contains the runtime variables. For full contents of the dictionary
+        refer to ``parse_inputs``.
 
-def get_growth_factor(z):
+    Returns
+    ----------
 
-    Hz = Hubble_z(h * 100.0, OmegaM, OmegaL, z)
-    print(Hz)
-    
-    return growth(z) * Hz / (h * 100.0) / growth(0.0) 
+    cosmo: :py:class:`~cosmology.Cosmology`
+        The cosmology.
+    """
 
+    return Cosmology(args["hubble_h"], args["OmegaM"], args["OmegaL"])
 
-def growth(z):
 
-    growth_factor = quad(growth_int, z, np.inf)
+def get_camb_cache_fname(camb_in, cache_dir=None):
+    """
+    Gets the name of the binary cache for a CAMB matter power file.
+
+    The name is keyed by the absolute path and modification time of the CAMB
+    file, so editing (or replacing) the text file invalidates the cache.
+
+    Parameters
+    ----------
+
+    camb_in: String. Required.
+        Path to the CAMB matter power text file.
+
+    cache_dir: String. Optional.
+        Directory the cache is kept in. Default: same directory as
+        ``camb_in``.
+
+    Returns
+    ----------
+
+    fname_cache: String.
+        Path to the cache file.
+    """
+
+    path = os.path.abspath(camb_in)
+    if cache_dir is None:
+        cache_dir = os.path.dirname(path)
+
+    path_hash = hashlib.md5(path.encode("utf-8")).hexdigest()[:8]
+    mtime = os.stat(path).st_mtime_ns
+
+    fname_cache = "{0}/.{1}.{2}.{3}.npy".format(cache_dir,
+                                                os.path.basename(path),
+                                                path_hash, mtime)
+
+    return fname_cache
+
+
+def get_camb_source(camb_in, cache_dir=None):
+    """
+    Gets the file ``load_camb_power`` will read, i.e., the binary cache if
+    it exists and the text file otherwise.
+
+    Parameters
+    ----------
+
+    camb_in, cache_dir: Optional.
+        See ``load_camb_power``.
+
+    Returns
+    ----------
+
+    fname: String.
+        Path to the file that will be read.
+    """
+
+    fname_cache = get_camb_cache_fname(camb_in, cache_dir)
+
+    if os.path.exists(fname_cache):
+        return fname_cache
+
+    return camb_in
+
+
+def load_camb_power(camb_in, cache_dir=None):
+    """
+    Loads the k bins and power spectrum from a CAMB matter power file.
+
+    The first time a file is loaded its text is parsed and a binary (.npy)
+    copy is saved, see ``get_camb_cache_fname``.  Afterwards the binary copy is
+    memory-mapped so no text parsing is done.  Older caches of the same file
+    are removed.  If the cache can't be written the parsed values are simply
+    returned.
+
+    Parameters
+    ----------
+
+    camb_in: String. Required.
+        Path to the CAMB matter power text file.
+
+    cache_dir: String. Optional.
+        Directory the cache is kept in. Default: same directory as
+        ``camb_in``.
+
+    Returns
+    ----------
+
+    k_power, pspec: Arrays of floats.
+        The k bins and the z = 0 power spectrum.  When loaded from the cache
+        these are read-only views into the memory-mapped file.
+    """
+
+    fname_cache = get_camb_cache_fname(camb_in, cache_dir)
+
+    if os.path.exists(fname_cache):
+        camb_power = np.load(fname_cache, mmap_mode="r")
+        return camb_power[0], camb_power[1]
+
+    camb_power = np.loadtxt(camb_in, unpack = True)
+
+    # Write to a temporary file first so a partially written cache is never
+    # picked up by another job.
+    prefix = fname_cache.rsplit(".", 2)[0]
+    fname_tmp = "{0}.{1}.tmp.npy".format(fname_cache[:-4], os.getpid())
+    try:
+        np.save(fname_tmp, camb_power)
+        os.replace(fname_tmp, fname_cache)
+    except OSError:
+        print("Could not write the cache for {0} to {1}."
+              .format(camb_in, fname_cache))
+    else:
+        cache_dir = os.path.dirname(fname_cache)
+        for fname in os.listdir(cache_dir):
+            fname = "{0}/{1}".format(cache_dir, fname)
+            if fname.startswith(prefix + ".") and fname != fname_cache and \
+               not fname.endswith(".tmp.npy"):
+                # Another job sharing the cache may have removed it already.
+                try:
+                    os.remove(fname)
+                except OSError:
+                    pass
+
+    return camb_power[0], camb_power[1]
 
-    return growth_factor[0] 
 
 def calculate_matter_power(args):
+    """
+    Scales the z = 0 CAMB matter power spectrum to the requested redshift(s).
+
+    For a single redshift the k bins, original spectrum and scaled spectrum are
+    saved to three separate .npz files (``<fname_out>_kbins.npz`` etc.).  For a
+    list of redshifts see ``calculate_matter_power_batch``.
+
+    Parameters
+    ----------
+
+    args: Dictionary.  Required.
+        Contains the runtime variables such as input/output file names.
+        For full contents of the dictionary refer to ``parse_inputs``.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    if np.ndim(args["redshift"]) > 0:
+        calculate_matter_power_batch(args)
+        return
 
-    k_power, pspec = np.loadtxt(args["camb_in"], unpack = True)     
+    with profiler.stage("load_camb_power") as stage:
+        fname_source = get_camb_source(args["camb_in"], args["cache_dir"])
+        stage.add(bytes_read=os.path.getsize(fname_source))
+
+        k_power, pspec = load_camb_power(args["camb_in"], args["cache_dir"])
+        stage.add(num_items=len(k_power))
     
-    growth_factor = get_growth_factor(args["redshift"])
-    print("Growth factor at {0} is {1}".format(args["redshift"],
-                                               growth_factor))
+    with profiler.stage("rescale", num_items=len(pspec)):
+        growth_factor = get_cosmology(args).growth_factor(args["redshift"])[0, 0]
+        print("Growth factor at {0} is {1}".format(args["redshift"],
+                                                   growth_factor))
+
+        pspec_final = pspec * growth_factor 
+
+    with profiler.stage("save", num_items=3,
+                        bytes_written=k_power.nbytes + pspec.nbytes +
+                                      pspec_final.nbytes):
+        fname_kpower = "{0}_kbins".format(args["fname_out"])
+        np.savez(fname_kpower, k_power)
+        print("Successfully saved to {0}.npz".format(fname_kpower))
+
+        fname_originalpspec = "{0}_originalpspec".format(args["fname_out"])
+        np.savez(fname_originalpspec, pspec)
+        print("Successfully saved to {0}.npz".format(fname_originalpspec))
+
+        fname_pspec = "{0}_pspec".format(args["fname_out"])
+        np.savez(fname_pspec, pspec_final)
+        print("Successfully saved to {0}.npz".format(fname_pspec))
+
+
+def calculate_matter_power_batch(args):
+    """
+    Scales the z = 0 CAMB matter power spectrum to many redshifts at once.
+
+    The spectra for all redshifts are computed as a single (num_z, num_k)
+    broadcast and saved to one compressed file, ``<fname_out>.npz`` (or
+    ``fname_out`` if it already ends in .npz), with keys
+    ``kbins`` (num_k), ``redshift`` (num_z), ``growth_factor`` (num_z),
+    ``originalpspec`` (num_k) and ``pspec`` (num_z, num_k).
+
+    Parameters
+    ----------
+
+    args: Dictionary.  Required.
+        Contains the runtime variables such as input/output file names.
+        ``args["redshift"]`` is a list of redshifts.  For full contents of the
+        dictionary refer to ``parse_inputs``.
+
+    Returns
+    ----------
+
+    None.
+    """
+
+    with profiler.stage("load_camb_power") as stage:
+        fname_source = get_camb_source(args["camb_in"], args["cache_dir"])
+        stage.add(bytes_read=os.path.getsize(fname_source))
+
+        k_power, pspec = load_camb_power(args["camb_in"], args["cache_dir"])
+        stage.add(num_items=len(k_power))
+
+    redshift = np.asarray(args["redshift"], dtype=np.float64)
+
+    with profiler.stage("rescale", num_items=len(redshift) * len(pspec)):
+        cosmo = get_cosmology(args)
+        growth_factor = cosmo.growth_factor(redshift)[0]
 
-    pspec_final = pspec * growth_factor 
+        for (z, growth) in zip(redshift, growth_factor):
+            print("Growth factor at {0} is {1}".format(z, growth))
 
-    fname_kpower = "{0}_kbins".format(args["fname_out"])
-    np.savez(fname_kpower, k_power)
-    print("Successfully saved to {0}.npz".format(fname_kpower))
+        pspec_final = cosmo.rescale_power(pspec, redshift)[0]
 
-    fname_originalpspec = "{0}_originalpspec".format(args["fname_out"])
-    np.savez(fname_originalpspec, pspec)
-    print("Successfully saved to {0}.npz".format(fname_originalpspec))
+    # ``np.savez_compressed`` only adds the extension if it's missing.
+    fname_out = args["fname_out"]
+    if not fname_out.endswith(".npz"):
+        fname_out = "{0}.npz".format(fname_out)
 
-    fname_pspec = "{0}_pspec".format(args["fname_out"])
-    np.savez(fname_pspec, pspec_final)
-    print("Successfully saved to {0}.npz".format(fname_pspec))
+    with profiler.stage("save", num_items=len(redshift)) as stage:
+        np.savez_compressed(fname_out, kbins=k_power,
+                            redshift=redshift, growth_factor=growth_factor,
+                            originalpspec=pspec, pspec=pspec_final)
+        stage.add(bytes_written=os.path.getsize(fname_out))
+    print("Successfully saved {0} spectra to {1}"
+          .format(len(redshift), fname_out))
 
 if __name__ == '__main__':
 
     args = parse_inputs()    
+    enable_from_args(args, "calc_pspec")
     calculate_matter_power(args) 
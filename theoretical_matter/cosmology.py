@@ -0,0 +1,291 @@
+#!/usr/bin:env python
+"""
+Background cosmology helpers for ``calc_pspec.py``.
+
+The linear growth factor is tabulated once per set of cosmological parameters
+by integrating over a dense grid in scale factor, then interpolated for any
+array of redshifts.  The ``Cosmology`` class evaluates many cosmologies at
+once so parameter sweeps don't need a fresh process per cosmology.
+"""
+from __future__ import print_function
+import numpy as np
+from collections import OrderedDict
+
+# Growth tables that have already been computed, keyed by (OmegaM, OmegaL,
+# num_points).  The growth factor does not depend on h.  The least recently
+# used tables are dropped once there are more than ``max_growth_tables`` so
+# long parameter sweeps don't grow without bound (~32 MB at 4096 points).
+max_growth_tables = 1024
+_growth_tables = OrderedDict()
+
+
+def Hubble_z(Hubble0, OmegaM, OmegaL, z):
+    """
+    Computes the Hubble parameter at redshift ``z`` for a flat universe.
+
+    Parameters
+    ----------
+
+    Hubble0: Float or array of floats. Required.
+        Hubble constant at z = 0 (km/s/Mpc).
+
+    OmegaM, OmegaL: Floats or arrays of floats. Required.
+        Matter and dark energy density parameters.
+
+    z: Float or array of floats. Required.
+        The redshift(s).  Broadcast against the other parameters.
+
+    Returns
+    ----------
+
+    Hz: Float or array of floats.
+        The Hubble parameter at each redshift (km/s/Mpc).
+    """
+
+    z = np.asarray(z, dtype=np.float64)
+
+    return Hubble0 * np.sqrt(OmegaM * (1.0 + z)**3 + OmegaL)
+
+
+def get_scale_factor_table(num_points=4096):
+    """
+    Gets the scale factors the growth tables are evaluated at.
+
+    The table is uniform in u = sqrt(a) from a = 0 to a = 1.
+
+    Parameters
+    ----------
+
+    num_points: Integer. Optional, default 4096.
+        Number of points in the table.
+
+    Returns
+    ----------
+
+    a_table: Array of floats.
+        The scale factors of the table.
+    """
+
+    u = np.linspace(0.0, 1.0, num_points)
+
+    return u * u
+
+
+def get_growth_tables(OmegaM, OmegaL, num_points=4096):
+    """
+    Tabulates the linear growth factor, normalized to 1 at z = 0, for one or
+    more cosmologies.
+
+    The growth factor is D(z) = H(z) * int_z^inf (1 + z') / H(z')^3 dz'.
+    Changing variables to the scale factor a this integral becomes
+    int_0^a da' / (a' H(a'))^3, which is evaluated cumulatively with the
+    trapezoidal rule on a grid uniform in u = sqrt(a) (the integrand goes as
+    a^1.5 at early times so this keeps it smooth).  All cosmologies without a
+    cached table are integrated in a single vectorized pass.  At most
+    ``max_growth_tables`` tables are kept cached between calls.
+
+    Parameters
+    ----------
+
+    OmegaM, OmegaL: Floats or 1D arrays of floats. Required.
+        Matter and dark energy density parameters.  Broadcast against each
+        other.
+
+    num_points: Integer. Optional, default 4096.
+        Number of points in each table.
+
+    Returns
+    ----------
+
+    a_table: Array of floats, shape (num_points,).
+        The scale factors of the tables, see ``get_scale_factor_table``.
+
+    growth_tables: 2D array of floats, shape (num_cosmologies, num_points).
+        The growth factor of each cosmology at each scale factor.
+    """
+
+    OmegaM, OmegaL = np.broadcast_arrays(np.atleast_1d(OmegaM).astype(np.float64),
+                                         np.atleast_1d(OmegaL).astype(np.float64))
+
+    keys = [(m, l, num_points) for (m, l) in zip(OmegaM.tolist(),
+                                                 OmegaL.tolist())]
+
+    # Only integrate each missing cosmology once, even if it's repeated.  The
+    # tables for this call are gathered separately so evicting from the cache
+    # can't drop one that is still needed.
+    tables = {}
+    missing = OrderedDict()
+    for idx, key in enumerate(keys):
+        if key in tables or key in missing:
+            continue
+        if key in _growth_tables:
+            _growth_tables.move_to_end(key)
+            tables[key] = _growth_tables[key]
+        else:
+            missing[key] = idx
+
+    a_table = get_scale_factor_table(num_points)
+
+    if missing:
+        missing_idx = np.array(list(missing.values()))
+        Om = OmegaM[missing_idx][:, np.newaxis]
+        OL = OmegaL[missing_idx][:, np.newaxis]
+
+        u = np.sqrt(a_table)
+        a = a_table[1:]
+
+        # (a H(a) / H0)^3 = (OmegaM / a + OmegaL * a^2)^1.5, with da = 2u du.
+        # The integrand is 0 at a = 0.  H0 cancels in the normalization.
+        integrand = np.zeros((len(missing_idx), num_points))
+        integrand[:, 1:] = 2.0 * u[1:] / (Om / a + OL * a**2)**1.5
+
+        integral = np.zeros((len(missing_idx), num_points))
+        integral[:, 1:] = np.cumsum(0.5 * (integrand[:, 1:] + integrand[:, :-1]) *
+                                    np.diff(u), axis=1)
+
+        growth = np.zeros((len(missing_idx), num_points))
+        growth[:, 1:] = Hubble_z(1.0, Om, OL, 1.0 / a - 1.0) * integral[:, 1:]
+        growth /= growth[:, -1:]
+
+        for row, key in enumerate(missing.keys()):
+            tables[key] = growth[row]
+            _growth_tables[key] = growth[row]
+
+        while len(_growth_tables) > max_growth_tables:
+            _growth_tables.popitem(last=False)
+
+    growth_tables = np.array([tables[key] for key in keys])
+
+    return a_table, growth_tables
+
+
+class Cosmology(object):
+
+    def __init__(self, h=0.681, OmegaM=0.302, OmegaL=0.698, num_points=4096):
+        """
+        A flat LCDM cosmology, or a set of them.
+
+        Each parameter can be a float or a 1D array; they are broadcast
+        against each other so that element ``i`` of each defines cosmology
+        ``i``.  To evaluate a grid of cosmologies, flatten a ``np.meshgrid`` of
+        the parameters.
+
+        Parameters
+        ----------
+
+        h: Float or array of floats. Optional, default 0.681.
+            Hubble constant in units of 100 km/s/Mpc.
+
+        OmegaM, OmegaL: Floats or arrays of floats. Optional, default 0.302
+        and 0.698.
+            Matter and dark energy density parameters.
+
+        num_points: Integer. Optional, default 4096.
+            Number of points in the growth factor tables.
+        """
+
+        self.h, self.OmegaM, self.OmegaL = \
+            np.broadcast_arrays(np.atleast_1d(h).astype(np.float64),
+                                np.atleast_1d(OmegaM).astype(np.float64),
+                                np.atleast_1d(OmegaL).astype(np.float64))
+
+        if self.h.ndim != 1:
+            print("The cosmological parameters must be floats or 1D arrays. "
+                  "They had shape {0}".format(self.h.shape))
+            raise ValueError
+
+        self.num_points = num_points
+
+    @property
+    def num_cosmologies(self):
+        return len(self.h)
+
+    def Hubble_z(self, z):
+        """
+        Computes the Hubble parameter of every cosmology at every redshift.
+
+        Parameters
+        ----------
+
+        z: Float or 1D array of floats. Required.
+            The redshift(s).
+
+        Returns
+        ----------
+
+        Hz: 2D array of floats, shape (num_cosmologies, num_redshifts).
+            The Hubble parameter (km/s/Mpc).
+        """
+
+        z = np.atleast_1d(z).astype(np.float64)
+
+        return Hubble_z(self.h[:, np.newaxis] * 100.0,
+                        self.OmegaM[:, np.newaxis],
+                        self.OmegaL[:, np.newaxis], z[np.newaxis, :])
+
+    def growth_factor(self, z):
+        """
+        Interpolates the linear growth factor (normalized to 1 at z = 0) of
+        every cosmology at every redshift.
+
+        If any of the redshifts is negative a ValueError will be raised.
+
+        Parameters
+        ----------
+
+        z: Float or 1D array of floats. Required.
+            The redshift(s).
+
+        Returns
+        ----------
+
+        growth_factor: 2D array of floats, shape (num_cosmologies,
+        num_redshifts).
+            The growth factor.
+        """
+
+        z = np.atleast_1d(z).astype(np.float64)
+
+        if np.any(z < 0.0):
+            print("The growth factor table only covers z >= 0. The requested "
+                  "redshifts were {0}".format(z))
+            raise ValueError
+
+        a_table, growth_tables = get_growth_tables(self.OmegaM, self.OmegaL,
+                                                   self.num_points)
+
+        # All tables share the same scale factors so the interpolation
+        # weights are computed once for every cosmology.
+        a = 1.0 / (1.0 + z)
+        idx = np.clip(np.searchsorted(a_table, a, side="right") - 1, 0,
+                      len(a_table) - 2)
+        frac = (a - a_table[idx]) / (a_table[idx + 1] - a_table[idx])
+
+        return growth_tables[:, idx] * (1.0 - frac) + \
+               growth_tables[:, idx + 1] * frac
+
+    def rescale_power(self, pspec, z):
+        """
+        Scales a z = 0 power spectrum to every redshift for every cosmology.
+
+        Parameters
+        ----------
+
+        pspec: 1D array of floats. Required.
+            The z = 0 power spectrum.
+
+        z: Float or 1D array of floats. Required.
+            The redshift(s).
+
+        Returns
+        ----------
+
+        pspec_final: 3D array of floats, shape (num_cosmologies,
+        num_redshifts, num_k).
+            The scaled power spectra.
+        """
+
+        growth_factor = self.growth_factor(z)
+
+        return growth_factor[:, :, np.newaxis] * \
+               np.asarray(pspec)[np.newaxis, np.newaxis, :]
@@ -1,53 +1,12 @@
 #!/usr/bin:env python
 from __future__ import print_function
 import numpy as np
-import networkx as nx
-from matplotlib import pyplot as plt
+import argparse
 
+from lhalo import lhalo_io
+from instrument.profiler import profiler, add_profile_arguments, \
+                                enable_from_args
 
-def get_LHalo_datastruct():
-    """
-    Generates the LHalo numpy structured array.
-
-    Parameters
-    ----------
-
-    None.
-
-    Returns
-    ----------
-
-    LHalo_Desc: numpy structured array.  Required.
-        Structured array for the LHaloTree data format.
-    """
-
-    LHalo_Desc_full = [
-        ('Descendant',          np.int32),
-        ('FirstProgenitor',     np.int32),
-        ('NextProgenitor',      np.int32),
-        ('FirstHaloInFOFgroup', np.int32),
-        ('NextHaloInFOFgroup',  np.int32),
-        ('Len',                 np.int32),
-        ('M_mean200',           np.float32),
-        ('Mvir',                np.float32),
-        ('M_TopHat',            np.float32),
-        ('Pos',                 (np.float32, 3)),
-        ('Vel',                 (np.float32, 3)),
-        ('VelDisp',             np.float32),
-        ('Vmax',                np.float32),
-        ('Spin',                (np.float32, 3)),
-        ('MostBoundID',         np.int64),
-        ('SnapNum',             np.int32),
-        ('FileNr',              np.int32),
-        ('SubHaloIndex',        np.int32),
-        ('SubHalfMass',         np.float32)
-                         ]
-
-    names = [LHalo_Desc_full[i][0] for i in range(len(LHalo_Desc_full))]
-    formats = [LHalo_Desc_full[i][1] for i in range(len(LHalo_Desc_full))]
-    LHalo_Desc = np.dtype({'names': names, 'formats': formats}, align=True)
-
-    return LHalo_Desc
 
 def read_tree(tree_path, tree_num=None, num_root_fofs=None, root_snap_num=None):
 
@@ -61,14 +20,10 @@ def read_tree(tree_path, tree_num=None, num_root_fofs=None, root_snap_num=None):
               f"must be specified.")
         raise ValueError
 
-    LHalo_struct = get_LHalo_datastruct()
-
     with open(tree_path, "rb") as f_in:
 
         # First get header info.
-        NTrees = np.fromfile(f_in, np.dtype(np.int32), 1)[0]
-        NHalos = np.fromfile(f_in, np.dtype(np.int32), 1)[0]
-        NHalosPerTree = np.fromfile(f_in, np.dtype((np.int32, NTrees)), 1)[0]
+        NTrees, NHalos, NHalosPerTree = lhalo_io.read_header(f_in)
 
         max_halos_tree = np.argmax(NHalosPerTree)
         print(f"Max halos is {NHalosPerTree[max_halos_tree]} for tree {max_halos_tree}")
@@ -80,24 +35,20 @@ def read_tree(tree_path, tree_num=None, num_root_fofs=None, root_snap_num=None):
                       f"return tree {tree_num}.")
                 raise ValueError
 
-        # We could be sneaky and `fseek` to the correct point in the file. However, because
-        # I'm lazy, I'm just going to iterate over the trees until we reach the desired one.
-        for tree_idx in range(NTrees):
-
-            tree = np.fromfile(f_in, LHalo_struct, NHalosPerTree[tree_idx])
+    # A specific tree can be read straight from its position in the file.
+    if tree_num:
+        print(f"Returning tree {tree_num}")
+        return lhalo_io.read_tree(tree_path, tree_num)
 
-            if num_root_fofs is not None:
-                if len(np.where(tree["SnapNum"][:] == root_snap_num)[0]) == num_root_fofs \
-                    and len(tree) > 1000:
-                    print(f"Tree {tree_idx} has {num_root_fofs} root FoFs and a total of "
-                          f"{len(tree)} halos. Returning it.")
-                    print(f"{tree_path}")
-                    #return tree
+    for tree_idx, tree in lhalo_io.iterate_trees(tree_path):
 
-            if tree_num:
-                if tree_idx == tree_num:
-                    print(f"Returning tree {tree_num}")
-                    return tree
+        if num_root_fofs is not None:
+            if len(np.where(tree["SnapNum"][:] == root_snap_num)[0]) == num_root_fofs \
+                and len(tree) > 1000:
+                print(f"Tree {tree_idx} has {num_root_fofs} root FoFs and a total of "
+                      f"{len(tree)} halos. Returning it.")
+                print(f"{tree_path}")
+                #return tree.copy()
 
     # If we reach here, we didn't hit the desired tree number or number of root FoFs somehow.
     #print(f"After searching through all trees in {tree_path}, we could not find tree "
@@ -128,6 +79,10 @@ def fully_walk_tree(start_idx, tree):
 
 def plot_graph(G, plot_output_path, plot_output_format="png"):
 
+    # Plotting is slow to import and not needed to read the trees.
+    import networkx as nx
+    from matplotlib import pyplot as plt
+
     fig = plt.figure(figsize=(16,16))
     ax = fig.add_subplot(111)
 
@@ -149,6 +104,11 @@ def plot_graph(G, plot_output_path, plot_output_format="png"):
 
 if __name__ == '__main__':
 
+    # The inputs are set below; only profiling is set on the command line.
+    parser = argparse.ArgumentParser()
+    add_profile_arguments(parser)
+    enable_from_args(vars(parser.parse_args()), "tree_walker")
+
     # To make things easier and to make a better plot, let's read the first tree that has
     # exactly 1 FoF halo.
     trees = np.arange(0, 64)
@@ -156,11 +116,14 @@ if __name__ == '__main__':
     num_root_fofs = 1
     root_snap_num = 98
     #tree = read_tree(tree_path, num_root_fofs=num_root_fofs, root_snap_num=root_snap_num)
-    for suffix in trees:
-        print(f"{suffix}")
-        path = f"/fred/oz004/jseiler/kali/shifted_trees/subgroup_trees_{suffix:03}.dat"
-        read_tree(path, num_root_fofs=num_root_fofs, root_snap_num=root_snap_num)
+    with profiler.stage("read_tree", num_items=len(trees)):
+        for suffix in trees:
+            print(f"{suffix}")
+            path = f"/fred/oz004/jseiler/kali/shifted_trees/subgroup_trees_{suffix:03}.dat"
+            read_tree(path, num_root_fofs=num_root_fofs, root_snap_num=root_snap_num)
     exit()
+    import networkx as nx
+
     # Initialize the graph.
     G = nx.Graph()
 